@@ -0,0 +1,76 @@
+"""Compare the legacy string prefixing BTOR2 renumbering with Btor2Renumberer.
+
+Usage: python scripts/benchmark_btor2_renumber.py [btor2 files...]
+"""
+
+import glob
+import os
+import sys
+import time
+
+from verified_agile_hardware.btor2_utils import renumber_btor2
+
+
+def legacy_renumber(btor, unique):
+    lines = btor.splitlines(keepends=True)
+
+    rewritten_terms = {}
+
+    for l_idx, line in enumerate(lines):
+        split_lines = line.split()
+        if split_lines[0].isnumeric():
+            rewritten_terms[split_lines[0]] = str(unique) + split_lines[0]
+
+        for s_idx, s in enumerate(split_lines):
+            if "sort" == split_lines[1] and s_idx > 1 and "array" != split_lines[2]:
+                continue
+
+            if "const" == split_lines[1] and s_idx > 2:
+                continue
+
+            if ("uext" == split_lines[1] or "sext" == split_lines[1]) and s_idx > 3:
+                continue
+
+            if "slice" == split_lines[1] and s_idx > 3:
+                continue
+
+            if s in rewritten_terms:
+                split_lines[s_idx] = rewritten_terms[s]
+
+        lines[l_idx] = " ".join(split_lines) + "\n"
+
+    return "".join(lines)
+
+
+def best_of(fn, repeats=5):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main(filenames):
+    print(f"{'file':<24}{'size':>10}{'legacy':>10}{'new':>10}{'speedup':>9}")
+    for filename in filenames:
+        with open(filename, "r") as f:
+            btor = f.read()
+
+        legacy_time, legacy = best_of(lambda: legacy_renumber(btor, 12345))
+        new_time, (_, renumberer) = best_of(lambda: renumber_btor2(btor, 12345))
+
+        print(
+            f"{os.path.basename(filename):<24}{len(btor):>10}"
+            f"{legacy_time * 1000:>8.1f}ms{new_time * 1000:>8.1f}ms"
+            f"{legacy_time / new_time:>8.1f}x"
+        )
+        legacy_max_id = max(
+            int(line.split()[0]) for line in legacy.splitlines() if line[0] != ";"
+        )
+        print(f"{'':<24}max id legacy {legacy_max_id}, new {renumberer.max_id}")
+
+
+if __name__ == "__main__":
+    examples_dir = os.path.join(os.path.dirname(__file__), "..", "examples")
+    main(sys.argv[1:] or sorted(glob.glob(os.path.join(examples_dir, "*.btor2"))))
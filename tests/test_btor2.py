@@ -0,0 +1,68 @@
+from verified_agile_hardware.btor2_utils import Btor2Renumberer, renumber_btor2
+import pytest
+
+
+def strip_comments(btor):
+    lines = []
+    for line in btor.splitlines():
+        tokens = line.split(";")[0].split()
+        if tokens:
+            lines.append(" ".join(tokens))
+    return lines
+
+
+@pytest.mark.parametrize(
+    "btor_file",
+    [
+        "examples/RamChip.btor2",
+        "examples/MemCore_inner.btor2",
+        "examples/PondTop.btor2",
+        "examples/mem_core.btor2",
+    ],
+)
+def test_renumber_roundtrip(btor_file):
+    with open(btor_file) as f:
+        btor = f.read()
+
+    renumbered, renumberer = renumber_btor2(btor, 1000)
+    assert renumberer.max_id > 1000
+    restored, _ = renumber_btor2(renumbered, -1000)
+
+    assert strip_comments(restored) == strip_comments(btor)
+
+
+def test_renumber_operands():
+    btor = "\n".join(
+        [
+            "1 sort bitvec 4",
+            "2 sort bitvec 8",
+            "3 sort array 1 2 ; comment",
+            "4 input 1 a",
+            "5 const 1 0101",
+            "6 uext 2 4 4 b",
+            "7 slice 1 6 3 0",
+            "8 add 1 -4 5",
+            "9 state 3 mem",
+            "10 output 8 out",
+        ]
+    )
+
+    renumberer = Btor2Renumberer(10)
+    lines = list(renumberer.renumber(btor.splitlines()))
+
+    assert lines == [
+        "11 sort bitvec 4\n",
+        "12 sort bitvec 8\n",
+        "13 sort array 11 12\n",
+        "14 input 11 a\n",
+        "15 const 11 0101\n",
+        "16 uext 12 14 4 b\n",
+        "17 slice 11 16 3 0\n",
+        "18 add 11 -14 15\n",
+        "19 state 13 mem\n",
+        "20 output 18 out\n",
+    ]
+    assert renumberer.max_id == 20
+    assert renumberer.symbols == {"a": 14, "b": 16}
+    assert renumberer.states == {"mem": 19}
+    assert renumberer.outputs == {"out": 20}
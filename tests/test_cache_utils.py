@@ -0,0 +1,53 @@
+from verified_agile_hardware.cache_utils import (
+    cache_read,
+    cache_write,
+    file_digest,
+    hash_key,
+    package_version,
+    scratch_file,
+)
+import pytest
+import subprocess
+
+
+def test_cache_roundtrip(tmp_path):
+    key = hash_key({"b": 2, "a": 1}, ["clk", "flush"])
+
+    assert key == hash_key({"a": 1, "b": 2}, ["clk", "flush"])
+    assert key != hash_key({"a": 1, "b": 3}, ["clk", "flush"])
+
+    assert cache_read(str(tmp_path), key, "configed.btor") is None
+    cache_write(str(tmp_path), key, "configed.btor", "1 sort bitvec 1\n")
+    assert cache_read(str(tmp_path), key, "configed.btor") == "1 sort bitvec 1\n"
+
+    assert cache_read(None, key, "configed.btor") is None
+
+
+def test_file_digest(tmp_path):
+    filename = tmp_path / "garnet.v"
+    filename.write_text("module a; endmodule\n")
+    digest = file_digest(str(filename))
+
+    assert digest == file_digest(str(filename))
+    assert file_digest(str(tmp_path / "missing.v")) is None
+
+
+def test_scratch_file(tmp_path):
+    # A child process writes through the path, as yosys does
+    with scratch_file("configed.btor") as (f, path):
+        subprocess.run(
+            ["sh", "-c", f"echo '1 sort bitvec 1' > {path}"],
+            pass_fds=(f.fileno(),),
+            check=True,
+        )
+        f.seek(0)
+        assert f.read() == "1 sort bitvec 1\n"
+
+    with scratch_file("configed.btor", str(tmp_path)) as (f, path):
+        f.write("1 sort bitvec 1\n")
+    assert (tmp_path / "configed.btor").read_text() == "1 sort bitvec 1\n"
+
+
+def test_package_version():
+    assert package_version("pytest") == pytest.__version__
+    assert package_version("no-such-package-vah") is None
@@ -1,10 +1,16 @@
+import networkx as nx
 import pytest
 from verified_agile_hardware.coreir_utils import (
+    collapse_route_chains,
+    combinational_order,
     read_coreir,
     coreir_to_nx,
     coreir_to_pdf,
     nx_to_smt,
+    register_width,
 )
+from verified_agile_hardware.garnet_utils import TileMetadataCache
+from verified_agile_hardware.solver import Solver
 
 
 @pytest.mark.parametrize(
@@ -61,3 +67,101 @@ def test_coreir_to_pdf(coreir_file):
 
 #     nx = coreir_to_nx(read_coreir(coreir_file))
 #     nx_to_smt(nx, file_info)
+
+
+def test_combinational_order():
+    g = nx.DiGraph()
+    g.add_node("a", node_type="route")
+    g.add_node("b", node_type="route")
+    g.add_node("r", node_type="coreir.reg")
+    g.add_edges_from([("in", "a"), ("a", "r"), ("r", "b"), ("b", "a"), ("b", "out")])
+
+    # The loop is broken at the register input
+    order = combinational_order(g)
+    assert order.index("b") < order.index("a")
+
+    g.nodes["r"]["node_type"] = "route"
+    with pytest.raises(ValueError, match="Combinational cycle"):
+        combinational_order(g)
+
+
+def test_tile_metadata_cache(capsys):
+    class Core:
+        calls = 0
+
+        def get_config_bitstream(self, metadata):
+            print("generating bitstream")
+            Core.calls += 1
+            return [(0, metadata["config"]["x"])]
+
+    cache = TileMetadataCache(interconnect=None)
+    core = Core()
+    first = cache.config_bitstream(core, {"config": {"x": 1}})
+    second = cache.config_bitstream(core, {"config": {"x": 1}})
+    other = cache.config_bitstream(core, {"config": {"x": 2}})
+
+    assert first is second
+    assert other == [(0, 2)]
+    assert Core.calls == 2
+    assert capsys.readouterr().out == ""
+
+
+def test_collapse_route_chains():
+    graph = nx.DiGraph()
+    graph.add_node("in", node_type="in")
+    graph.add_node("pe", node_type="tile")
+    graph.add_node("mem", node_type="tile")
+    for route in ["r0", "r1", "r2", "fanout", "r3", "r4"]:
+        graph.add_node(route, node_type="route")
+
+    def connect(a, b, source_port="out", sink_port="in", bitwidth=16):
+        graph.add_edge(
+            a, b, source_port=source_port, sink_port=sink_port, bitwidth=bitwidth
+        )
+
+    connect("in", "r0")
+    connect("r0", "pe", sink_port="data0")
+    connect("pe", "r1", source_port="res")
+    connect("r1", "r2")
+    connect("r2", "fanout")
+    connect("fanout", "mem", sink_port="data_in_0")
+    connect("fanout", "r3")
+    connect("r3", "r4")
+    connect("r4", "pe", sink_port="data1")
+
+    assert collapse_route_chains(graph) == (9, 5)
+    assert set(graph.nodes) == {"in", "r0", "pe", "fanout", "mem"}
+    assert graph.edges["pe", "fanout"] == {
+        "source_port": "res",
+        "sink_port": "in",
+        "bitwidth": 16,
+    }
+    assert graph.edges["fanout", "pe"]["sink_port"] == "data1"
+
+
+def test_bit_register():
+    graph = nx.DiGraph()
+    graph.add_node("r", node_type="corebit.reg")
+    graph.add_edge("in", "r", source_port="valid", sink_port="in", bitwidth=1)
+    graph.add_edge("r", "out", source_port="out", sink_port="valid", bitwidth=1)
+    assert register_width(graph, "r") == 1
+
+    solver = Solver()
+    solver.counter_backend = "model"
+    solver, input_symbols, output_symbols = nx_to_smt(graph, None, solver)
+    (valid_in,) = input_symbols.values()
+    (valid_out,) = output_symbols.values()
+    assert valid_out.get_sort() == solver.create_bvsort(1)
+
+    # The register delays its input by two cycles, see create_reg_state
+    solver.assert_formula(solver.ur.at_time(solver.fts.init, 0))
+    for k in range(2):
+        solver.assert_formula(solver.ur.at_time(solver.fts.trans, k))
+    solver.assert_formula(
+        solver.create_term(
+            solver.ops.Distinct,
+            solver.ur.at_time(valid_in, 0),
+            solver.ur.at_time(valid_out, 2),
+        )
+    )
+    assert solver.check_sat().is_unsat()
@@ -0,0 +1,32 @@
+import math
+from verified_agile_hardware.float_utils import (
+    bfloat16_add,
+    bfloat16_mul,
+    bfloat16_to_float,
+    float_to_bfloat16,
+)
+
+
+def test_bfloat16_roundtrip():
+    for bits in [0x0000, 0x8000, 0x3F80, 0xBF80, 0x4049, 0x7F7F, 0x0080, 0x7F80]:
+        assert float_to_bfloat16(bfloat16_to_float(bits)) == bits
+    assert math.isnan(bfloat16_to_float(0x7FC1))
+    # Subnormals are flushed to zero
+    assert bfloat16_to_float(0x0001) == 0.0
+    assert float_to_bfloat16(2.0**-130) == 0x0000
+
+
+def test_bfloat16_rounding():
+    # Ties round to even
+    assert float_to_bfloat16(1 + 2**-8) == 0x3F80
+    assert float_to_bfloat16(1 + 3 * 2**-8) == 0x3F82
+    assert float_to_bfloat16(2.0**128) == 0x7F80
+    assert float_to_bfloat16(-(2.0**128)) == 0xFF80
+
+
+def test_bfloat16_ops():
+    one, two, three = 0x3F80, 0x4000, 0x4040
+    assert bfloat16_add(one, one) == two
+    assert bfloat16_add(one, 0xBF80) == 0x0000
+    assert bfloat16_mul(three, two) == 0x40C0
+    assert bfloat16_add(0x7F80, 0xFF80) == 0x7FC0
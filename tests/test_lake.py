@@ -1,4 +1,13 @@
-from verified_agile_hardware.lake_utils import mem_tile_constraint_generator
+import types
+
+import verified_agile_hardware.lake_utils as lake_utils
+from verified_agile_hardware.lake_utils import (
+    POND_TILE_COUNTERS,
+    mem_tile_cache_key,
+    mem_tile_constraint_generator,
+    pond_tile_counters,
+)
+from verified_agile_hardware.solver import Solver
 
 
 def test_addr_gen_model():
@@ -34,3 +43,51 @@ def test_addr_gen_model():
     assert dim_out[67] == [0, 1]
     assert dim_out[68] == [0, 1]
     assert dim_out[69] == [1, 1]
+
+
+def test_pond_tile_counters_flush_offset():
+    solver = Solver()
+    solver.counter_backend = "model"
+    solver.max_cycles = 8
+    solver.lake_configs["pond_0"] = [
+        ("in2regfile_0_sched_gen_sched_addr_gen_starting_addr", 2),
+        ("in2regfile_0_sched_gen_sched_addr_gen_strides_0", 1),
+        ("in2regfile_0_for_loop_dimensionality", 1),
+        ("in2regfile_0_for_loop_ranges_0", 2),
+    ]
+
+    unshifted = pond_tile_counters(solver, "pond_0")
+    shifted = pond_tile_counters(solver, "pond_0", flush_offset=3)
+
+    assert list(shifted) == POND_TILE_COUNTERS
+    for controller in POND_TILE_COUNTERS:
+        assert len(shifted[controller]) == 11
+        assert list(shifted[controller]) == [0] * 3 + list(unshifted[controller])
+
+
+def test_mem_tile_cache_key(monkeypatch, tmp_path):
+    garnet = tmp_path / "garnet.v"
+    garnet.write_text("module garnet(); endmodule\n")
+    mem_tile = types.SimpleNamespace(
+        dut=types.SimpleNamespace(name="strg_ub_vec_flat", ports={})
+    )
+
+    def key():
+        return mem_tile_cache_key(
+            mem_tile, {"mode": 0}, ["input_width_16_num_0"], [], str(garnet)
+        )
+
+    base = key()
+    assert key() == base
+
+    # The generating code is part of the key, not only the configuration
+    monkeypatch.setattr(lake_utils, "MEM_TILE_YOSYS_SCRIPT", "prep;\n")
+    assert key() != base
+    monkeypatch.undo()
+
+    monkeypatch.setattr(lake_utils, "MEM_TILE_CACHE_VERSION", 0)
+    assert key() != base
+    monkeypatch.undo()
+
+    monkeypatch.setattr(lake_utils, "package_version", lambda name: "0.0")
+    assert key() != base
@@ -46,3 +46,39 @@ def test_bmc_mem_tile(mem_file):
     res = bmc.check_until(2)
 
     assert res is None
+
+
+def test_read_btor2_tile_vars():
+    solver = Solver()
+    solver.read_btor2(
+        "examples/RamChip.btor2",
+        tile_name="ram",
+        state_names=["regfile"],
+        output_names=["rdDataA", "rdDataB"],
+    )
+
+    inputs = solver.get_tile_vars("ram", "inputs")
+    for name in ["clk", "rdAddrA", "rdAddrB", "wrAddr", "wrData", "write"]:
+        assert name in inputs
+
+    assert list(solver.get_tile_vars("ram", "states")) == ["regfile"]
+    assert list(solver.get_tile_vars("ram", "outputs")) == ["rdDataA", "rdDataB"]
+    assert solver.get_tile_vars("ram1", "inputs") == {}
+
+    for i in inputs.values():
+        solver.promote_inputvar(i)
+        solver.promote_inputvar(i)
+    assert not any(i in solver.fts.inputvars for i in inputs.values())
+
+
+def test_named_term_index():
+    solver = Solver()
+    solver.read_btor2("examples/PondTop.btor2")
+    data_array = solver.fts.lookup("memory_0.data_array")
+    assert solver.lookup_named_terms("memory_0", "data_array") == [data_array]
+
+    solver = Solver()
+    solver.read_btor2("examples/RamChip.btor2", tile_name="ram", symbols=["regfile"])
+    regfile = solver.fts.lookup("regfile")
+    assert solver.lookup_named_terms("ram", "regfile") == [regfile]
+    assert solver.lookup_named_terms("ram1", "regfile") == []
@@ -1,12 +1,20 @@
+import subprocess
+import sys
 from hwtypes import BitVector
 from peak import family_closure, Peak, family
 from verified_agile_hardware.solver import Solver
 from verified_agile_hardware.peak_utils import (
+    bbox_constraints,
     create_input,
     load_pe_tile,
     get_aadt,
     get_pe_inputs,
     get_pe_state,
+    pe_template_key,
+    PETemplate,
+    refine_bboxes,
+    specialize_pe_template,
+    symbolic_pe,
 )
 from lassen import PE_fc as lassen_fc
 import smt_switch as ss
@@ -52,10 +60,130 @@ def test_pe_to_pono():
     output = solver.convert(output_val._value_.value)
 
 
+def test_pe_template():
+    solver = Solver()
+    pe0, _, inputs0 = load_pe_tile(solver, PE_fc, 0, pe_name="pe0")
+    pe1, _, inputs1 = load_pe_tile(solver, PE_fc, 0, pe_name="pe1")
+
+    # Both instances come from one symbolic execution
+    assert list(solver.pe_templates) == [PE_fc]
+    assert symbolic_pe.cache_info().currsize >= 1
+    assert pe0 != pe1
+    assert [str(i) for i in inputs0] == ["x_pe0"]
+    assert [str(i) for i in inputs1] == ["x_pe1"]
+
+
+def test_pe_template_key_is_stable():
+    script = (
+        "from lassen import PE_fc\n"
+        "from verified_agile_hardware.peak_utils import pe_template_key\n"
+        "print(pe_template_key(PE_fc))\n"
+    )
+    # Keys must not depend on anything specific to one process
+    keys = [
+        subprocess.run(
+            [sys.executable, "-c", script], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        for _ in range(2)
+    ]
+    assert keys[0] == keys[1]
+    assert keys[0] != "None"
+    assert pe_template_key(lassen_fc) == keys[0]
+    assert pe_template_key(PE_fc) not in (None, keys[0])
+
+
+def test_specialize_pe_template():
+    solver = Solver()
+    bv4 = solver.create_bvsort(4)
+    bv16 = solver.create_bvsort(16)
+    x = solver.create_symbol("x", bv16)
+    r = solver.create_symbol("r", bv16)
+    inst = solver.create_symbol("inst", bv4)
+    add_out = solver.create_symbol("add_out", bv16)
+    mul_out = solver.create_symbol("mul_out", bv16)
+
+    def selected(opcode):
+        return solver.create_term(
+            solver.ops.Equal, inst, solver.create_const(opcode, bv4)
+        )
+
+    output = solver.create_term(
+        solver.ops.Ite,
+        selected(1),
+        add_out,
+        solver.create_term(solver.ops.Ite, selected(2), mul_out, x),
+    )
+    template = PETemplate(
+        {"x": x},
+        inst,
+        output,
+        [(r, solver.create_term(solver.ops.Ite, selected(3), x, r))],
+        {"add": [((x, r), (add_out,))], "mul": [((x, add_out), (mul_out,))]},
+        {r: "r", add_out: "add_out", mul_out: "mul_out"},
+    )
+
+    add = specialize_pe_template(solver, template, 1)
+    assert add.output == add_out
+    assert add.regs == [(r, r)]
+    assert list(add.bboxes) == ["add"]
+    assert add.inst is None
+    assert add.node_count() < template.node_count()
+
+    # The multiplier reads the adder output, so both are kept
+    mul = specialize_pe_template(solver, template, 2)
+    assert mul.output == mul_out
+    assert list(mul.bboxes) == ["add", "mul"]
+
+    move = specialize_pe_template(solver, template, 3)
+    assert move.output == x
+    assert move.regs == [(r, x)]
+    assert move.bboxes == {}
+
+
+def test_bbox_abstraction():
+    solver = Solver()
+    bv16 = solver.create_bvsort(16)
+    a, b, out0, out1 = [
+        solver.create_fts_input_var(name, bv16) for name in ["a", "b", "out0", "out1"]
+    ]
+    solver.bboxes = {"CW_fp_add": [((a, b), (out0,)), ((a, b), (out1,))]}
+
+    one = solver.create_const(0x3F80, bv16)
+    two = solver.create_const(0x4000, bv16)
+    for constraint in bbox_constraints(solver, 0):
+        solver.assert_formula(constraint)
+    solver.assert_formula(
+        solver.create_term(solver.ops.Equal, solver.ur.at_time(a, 0), one)
+    )
+    solver.assert_formula(
+        solver.create_term(solver.ops.Equal, solver.ur.at_time(b, 0), one)
+    )
+
+    # Both black boxes apply the same function
+    solver.solver.push()
+    solver.assert_formula(
+        solver.create_term(
+            solver.ops.Distinct, solver.ur.at_time(out0, 0), solver.ur.at_time(out1, 0)
+        )
+    )
+    assert solver.check_sat().is_unsat()
+    solver.solver.pop()
+
+    # 1.0 + 1.0 != 2.0 is only possible in the abstraction
+    solver.assert_formula(
+        solver.create_term(solver.ops.Distinct, solver.ur.at_time(out0, 0), two)
+    )
+    assert solver.check_sat().is_sat()
+    assert refine_bboxes(solver, [0]) == 1
+    assert solver.check_sat().is_unsat()
+
+
 def test_lassen_to_pono():
     solver = Solver()
-    pe0, bboxes0, _ = load_pe_tile(solver, lassen_fc, pe_name="pe0")
-    pe1, bboxes1, _ = load_pe_tile(solver, lassen_fc, pe_name="pe1")
+    # Keep every black box of the PE instead of folding the datapaths away
+    solver.specialize_pes = False
+    pe0, _, _ = load_pe_tile(solver, lassen_fc, pe_instr=0, pe_name="pe0")
+    pe1, _, _ = load_pe_tile(solver, lassen_fc, pe_instr=0, pe_name="pe1")
 
     solver.assert_formula(solver.ur.at_time(solver.fts.init, 0))
 
@@ -63,6 +191,8 @@ def test_lassen_to_pono():
 
     for i in range(cycles + 1):
         solver.assert_formula(solver.ur.at_time(solver.fts.trans, i))
+        for constraint in bbox_constraints(solver, i):
+            solver.assert_formula(constraint)
         for i0, i1 in zip(get_pe_inputs(solver, "pe0"), get_pe_inputs(solver, "pe1")):
             solver.assert_formula(
                 solver.create_term(
@@ -88,23 +218,6 @@ def test_lassen_to_pono():
                     )
                 )
 
-    bbox_types_to_ins_outs = bboxes0
-    for k, v in bboxes1.items():
-        if k in bbox_types_to_ins_outs:
-            bbox_types_to_ins_outs[k] += v
-        else:
-            bbox_types_to_ins_outs[k] = v
-
-    for idx, (k, v) in enumerate(bbox_types_to_ins_outs.items()):
-        bvs = v[0][0][0].get_sort()
-        func = solver.solver.make_sort(ss.sortkinds.FUNCTION, [bvs, bvs, bvs])
-        f = solver.solver.make_symbol(f"bb{idx}", func)
-        for ins, outs in v:
-            func_form = solver.solver.make_term(ss.primops.Apply, f, ins[0], ins[1])
-            solver.solver.assert_formula(
-                solver.solver.make_term(ss.primops.Equal, outs[0], func_form)
-            )
-
     solver.assert_formula(
         solver.create_term(
             solver.ops.Not,
@@ -116,4 +229,7 @@ def test_lassen_to_pono():
         )
     )
 
-    assert solver.check_sat().is_unsat()
+    result = solver.check_sat()
+    while result.is_sat() and refine_bboxes(solver, range(cycles + 1)):
+        result = solver.check_sat()
+    assert result.is_unsat()
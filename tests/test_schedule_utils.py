@@ -0,0 +1,127 @@
+import numpy
+import pytest
+
+from verified_agile_hardware.schedule_utils import (
+    ChangePointTrace,
+    TraceWindow,
+    affine_segments,
+    find_period,
+    shift_trace,
+    times_to_intervals,
+    trace_window,
+)
+
+
+def test_affine_segments():
+    values = [4, 4, 4, 5, 6, 7, 8, 8, 10, 12, 14]
+
+    segments = affine_segments(values)
+
+    assert segments == [(0, 3, 4, 0), (3, 7, 5, 1), (7, 11, 8, 2)]
+
+    for first, last, base, stride in segments:
+        for i in range(first, last):
+            assert values[i] == base + stride * (i - first)
+
+
+def test_affine_segments_window():
+    values = list(range(20)) + [0] * 10
+
+    assert affine_segments(values, 5, 25) == [(5, 20, 5, 1), (20, 25, 0, 0)]
+    assert affine_segments(values, 29, 100) == [(29, 30, 0, 0)]
+    assert affine_segments(values, 30, 100) == []
+
+
+def test_find_period():
+    warm_up = [9, 9, 9, 1]
+    period = [0, 1, 2, 3, 3, 3]
+    values = warm_up + period * 20
+
+    assert find_period(values) == (len(warm_up), len(period))
+
+    # Window that starts inside the periodic part
+    assert find_period(values, 10, 70) == (10, len(period))
+
+    assert find_period([1, 2, 3, 4, 5, 6]) is None
+
+
+def test_times_to_intervals():
+    times = [5, 3, 4, 10, 12, 14, 16, 40, 50, 51, 4]
+
+    assert times_to_intervals(times) == [
+        (3, 5, 1),
+        (10, 16, 2),
+        (40, 40, 1),
+        (50, 51, 1),
+    ]
+
+
+def test_change_point_trace():
+    trace = ChangePointTrace([0, 3, 4, 8], [5, 6, 7, 8], 10)
+    expected = [5, 5, 5, 6, 7, 7, 7, 7, 8, 8]
+
+    assert len(trace) == 10
+    assert trace == expected
+    assert [trace[i] for i in range(-10, 10)] == expected + expected
+    assert trace[2:9] == expected[2:9]
+    assert trace[2:9].times == [0, 1, 2, 6]
+    assert trace[::3] == expected[::3]
+    assert trace.delay(1, 0) == [0] + expected[:-1]
+    assert trace.map(lambda v: v * 2) == [v * 2 for v in expected]
+
+    # Windows of a trace are traces themselves
+    assert affine_segments(trace, 3, 8) == affine_segments(expected, 3, 8)
+    assert find_period(trace) == find_period(expected)
+
+
+def test_shift_trace():
+    expected = [5, 5, 5, 6, 7, 7, 7, 7, 8, 8]
+    trace = ChangePointTrace([0, 3, 4, 8], [5, 6, 7, 8], 10)
+
+    for values in [expected, trace]:
+        shifted = shift_trace(values, 2)
+        assert len(shifted) == 12
+        assert list(shifted) == [0, 0] + expected
+        assert shift_trace(values, 0) == expected
+
+    # Simulated counters are numpy columns, wide ones hold python ints
+    for dtype in [numpy.uint64, object]:
+        column = numpy.array(expected, dtype=dtype)
+        for cycles in [0, 1, 2]:
+            shifted = shift_trace(column, cycles)
+            assert shifted.dtype == column.dtype
+            assert shifted.tolist() == [0] * cycles + expected
+
+
+def test_trace_window():
+    values = list(range(100, 120))
+    window = trace_window(values, 5)
+
+    assert isinstance(window, TraceWindow)
+    assert len(window) == len(values)
+    assert window[0] == values[0]
+    assert window[5] == values[5] and window[-1] == values[-1]
+    assert window[7:12] == values[7:12]
+    assert affine_segments(window, 5, 20) == affine_segments(values, 5, 20)
+
+    with pytest.raises(IndexError):
+        window[3]
+    with pytest.raises(IndexError):
+        window[2:8]
+
+    assert trace_window(values, 0) is values
+
+
+def test_shift_trace_window():
+    values = list(range(100, 130))
+    window = trace_window(values, 5)
+
+    # The flush delay moves the absolute cycles and the window start together
+    shifted = shift_trace(window, 3)
+    assert isinstance(shifted, TraceWindow)
+    assert shifted.start == 8
+    assert len(shifted) == len(values) + 3
+    assert shifted[0] == 0
+    assert shifted[8:15] == values[5:12]
+    with pytest.raises(IndexError):
+        shifted[6]
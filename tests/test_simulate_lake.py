@@ -0,0 +1,223 @@
+import shutil
+import sys
+
+import numpy
+import pytest
+
+from verified_agile_hardware.simulate_lake import (
+    AddresssGeneratorModel,
+    SchedGenModel,
+    counter_testbench,
+    demux_counter_columns,
+    model_counters,
+    pack_dim_counter,
+    parse_counter_dump,
+    pond_tile_model_signals,
+    run_simulation_step,
+    simulate_counters_batch,
+)
+from verified_agile_hardware.lake_utils import MEM_TILE_COUNTERS, POND_TILE_COUNTERS
+from verified_agile_hardware.schedule_utils import shift_trace
+
+
+def test_model_covers_collected_signals():
+    mem_traces = model_counters("MemCore_inner", [], 10, MEM_TILE_COUNTERS)
+    assert list(mem_traces) == MEM_TILE_COUNTERS
+
+    pond_traces = model_counters("PondTop", [], 10, POND_TILE_COUNTERS)
+    assert list(pond_traces) == POND_TILE_COUNTERS
+
+    for trace in list(mem_traces.values()) + list(pond_traces.values()):
+        assert len(trace) == 10
+
+
+def test_pond_model():
+    ub = "mem_ctrl_strg_ub_thin_PondTop_flat.strg_ub_thin_PondTop_inst"
+    lake_configs = [
+        ("in2regfile_0_sched_gen_sched_addr_gen_starting_addr", 2),
+        ("in2regfile_0_sched_gen_sched_addr_gen_strides_0", 1),
+        ("in2regfile_0_for_loop_dimensionality", 1),
+        ("in2regfile_0_for_loop_ranges_0", 2),
+        ("in2regfile_0_addr_gen_starting_addr", 0),
+        ("in2regfile_0_addr_gen_strides_0", 1),
+    ]
+
+    traces = model_counters("PondTop", lake_configs, 8, pond_tile_model_signals())
+
+    assert traces[f"{ub}.in2regfile_0_sched_gen.addr_out"] == [2, 2, 2, 3, 4, 5, 5, 5]
+    assert traces[f"{ub}.in2regfile_0_addr_gen.addr_out"] == [0, 0, 0, 1, 2, 3, 3, 3]
+    dim_counter = traces[f"{ub}.in2regfile_0_for_loop.dim_counter"]
+    assert dim_counter == [0, 0, 0, 1, 2, 3, 0, 0]
+
+
+def test_pond_model_flush_offset():
+    ub = "mem_ctrl_strg_ub_thin_PondTop_flat.strg_ub_thin_PondTop_inst"
+    lake_configs = [
+        ("in2regfile_0_sched_gen_sched_addr_gen_starting_addr", 2),
+        ("in2regfile_0_sched_gen_sched_addr_gen_strides_0", 1),
+        ("in2regfile_0_for_loop_dimensionality", 1),
+        ("in2regfile_0_for_loop_ranges_0", 2),
+    ]
+
+    traces = model_counters("PondTop", lake_configs, 8, pond_tile_model_signals())
+    sched = shift_trace(traces[f"{ub}.in2regfile_0_sched_gen.addr_out"], 2)
+
+    assert len(sched) == 10
+    assert list(sched) == [0, 0, 2, 2, 2, 3, 4, 5, 5, 5]
+
+
+def test_pack_dim_counter():
+    assert pack_dim_counter([1, 2, 3], 11) == 1 + (2 << 11) + (3 << 22)
+
+
+def test_sched_gen_schedule_matches_step():
+    config = {
+        "starting_addr": 3,
+        "dimensionality": 3,
+        "ranges_0": 2,
+        "ranges_1": 0,
+        "ranges_2": 1,
+        "strides_0": 1,
+        "strides_1": 4,
+        "strides_2": 2,
+        "strides_3": 7,
+    }
+    cycles = 100
+
+    model = SchedGenModel("sched_gen", 6, 11)
+    model.set_config(config)
+    addr_out, dim_out, step_cycles = model.schedule(cycles)
+
+    expected_addr, expected_dim, expected_steps = [], [], []
+    for cycle in range(cycles):
+        expected_addr.append(model.get_address())
+        expected_dim.append(model.dim_cnt.copy())
+        if cycle == model.get_address():
+            expected_steps.append(cycle)
+            model.step()
+
+    assert addr_out == expected_addr
+    assert dim_out == expected_dim
+    assert step_cycles.tolist() == expected_steps
+
+
+def test_addr_gen_trace_matches_step():
+    model = AddresssGeneratorModel("addr_gen", 4, 3)
+    model.set_config({"starting_addr": 1, "strides_0": 3, "strides_1": 1})
+    step_cycles = [2, 3, 5, 6, 9]
+    step_dims = [0, 1, 0, 1, 1]
+    trace = model.trace(numpy.array(step_cycles), numpy.array(step_dims), 12)
+
+    expected = []
+    for cycle in range(12):
+        expected.append(model.get_address())
+        if cycle in step_cycles:
+            model.step(step_dims[step_cycles.index(cycle)])
+
+    assert trace == expected
+
+
+def test_parse_counter_dump():
+    tiles = [("mem_0", "MemCore_inner", ["a", "b"]), ("pond_0", "PondTop", ["c"])]
+    rows = [[1, 2, 3], [4, 5 << 64, 6]]
+    dump = b"".join(b"".join(b"%024x" % v for v in row) + b"\n" for row in rows)
+
+    traces = demux_counter_columns(parse_counter_dump(dump, 3), tiles)
+
+    assert traces["mem_0"]["a"].dtype == numpy.uint64
+    assert traces["mem_0"]["a"].tolist() == [1, 4]
+    assert traces["mem_0"]["b"].tolist() == [2, 5 << 64]
+    assert traces["pond_0"]["c"].tolist() == [3, 6]
+
+
+def test_counter_testbench():
+    tiles = [("mem_0", "MemCore_inner", ["a.b"]), ("pond_0", "PondTop", ["c"])]
+    tb = counter_testbench(tiles, "batch")
+
+    assert "module batch_tb();" in tb
+    assert "mem_0 mem_0_inst (" in tb and "pond_0 pond_0_inst (" in tb
+    assert tb.index("mem_0_inst.MemCore_inner.a.b") < tb.index("pond_0_inst.PondTop.c")
+    # Cycles are a plusarg so compiled testbenches can be reused
+    assert '$value$plusargs("cycles=%d", cycles)' in tb
+
+
+def test_model_counters_window():
+    signals = list(pond_tile_model_signals())
+    lake_configs = [
+        ("in2regfile_0_sched_gen_sched_addr_gen_starting_addr", 2),
+        ("in2regfile_0_sched_gen_sched_addr_gen_strides_0", 1),
+        ("in2regfile_0_for_loop_dimensionality", 1),
+        ("in2regfile_0_for_loop_ranges_0", 2),
+    ]
+
+    full = model_counters("PondTop", lake_configs, 20, signals)
+    window = model_counters("PondTop", lake_configs, 20, signals, start_cycle=8)
+
+    for signal in signals:
+        assert window[signal][0] == full[signal][0]
+        assert window[signal][8:20] == list(full[signal][8:20])
+
+
+def test_run_simulation_step_raises():
+    cmd = [sys.executable, "-c", "import sys; sys.exit('no such module')"]
+    with pytest.raises(RuntimeError, match="testbench") as excinfo:
+        run_simulation_step(cmd, "testbench")
+    assert "no such module" in str(excinfo.value)
+
+
+COUNTER_TILE_V = """
+module tile_0(input clk, input rst_n, input flush);
+    counter core(.clk(clk), .rst_n(rst_n), .flush(flush));
+endmodule
+
+module counter(input clk, input rst_n, input flush);
+    reg [15:0] count;
+    always @(posedge clk or negedge rst_n)
+        if (!rst_n || flush) count <= 0;
+        else count <= count + 1;
+endmodule
+"""
+
+
+@pytest.mark.parametrize(
+    "backend",
+    [
+        pytest.param(
+            backend,
+            marks=pytest.mark.skipif(
+                shutil.which(backend) is None, reason=f"{backend} is not installed"
+            ),
+        )
+        for backend in ["iverilog", "verilator"]
+    ],
+)
+def test_simulate_counters_batch(tmp_path, backend):
+    (tmp_path / "tile_0_simulation.v").write_text(COUNTER_TILE_V)
+    garnet = tmp_path / "garnet.v"
+    garnet.write_text("")
+    tiles = [("tile_0", "core", ["count"])]
+
+    traces = simulate_counters_batch(
+        str(tmp_path),
+        tiles,
+        6,
+        "tiny",
+        backend,
+        cache_dir=str(tmp_path / "cache"),
+        garnet_filename=str(garnet),
+    )
+    assert traces["tile_0"]["count"].tolist() == [0, 1, 2, 3, 4, 5]
+
+    # Only cycle 0 and the cycles from start_cycle on are dumped
+    window = simulate_counters_batch(
+        str(tmp_path),
+        tiles,
+        6,
+        "tiny",
+        backend,
+        cache_dir=str(tmp_path / "cache"),
+        start_cycle=3,
+        garnet_filename=str(garnet),
+    )["tile_0"]["count"]
+    assert window.start == 3 and window.first == 0
+    assert window.values.tolist() == [3, 4, 5]
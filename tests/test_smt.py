@@ -463,3 +463,236 @@ def test_rewriter():
     )
 
     assert solver.check_sat().is_unsat()
+
+
+def test_lut_tree_matches_chain():
+    solver = Solver()
+
+    bvsort16 = solver.create_bvsort(16)
+
+    vals = [0, 0, 3, 3, 3, 7, 7, 1, 1, 1, 1, 0, 5]
+    lut = [
+        (solver.create_const(i, bvsort16), solver.create_const(v, bvsort16))
+        for i, v in enumerate(vals)
+    ]
+
+    chain = solver.create_lut("chain", lut, bvsort16, bvsort16, 2, 11, "chain")
+    tree = solver.create_lut("tree", lut, bvsort16, bvsort16, 2, 11, "tree")
+
+    x = solver.create_symbol("x", bvsort16)
+
+    solver.assert_formula(
+        solver.create_term(
+            solver.ops.Not,
+            solver.create_term(solver.ops.Equal, chain(x), tree(x)),
+        )
+    )
+
+    assert solver.check_sat().is_unsat()
+
+
+def test_lut_window_matches_full():
+    solver = Solver()
+
+    bvsort16 = solver.create_bvsort(16)
+
+    vals = [4, 0, 3, 3, 3, 7, 7, 1, 1, 1, 1, 0, 5]
+    lut = [
+        (solver.create_const(i, bvsort16), solver.create_const(v, bvsort16))
+        for i, v in enumerate(vals)
+    ]
+    default = solver.create_const(vals[0], bvsort16)
+
+    x = solver.create_symbol("x", bvsort16)
+    for encoding in ["chain", "tree"]:
+        full = solver.create_lut("full", lut, bvsort16, bvsort16, 3, 11, encoding)
+        # Only the entries of the window are built
+        window = solver.create_lut(
+            "window",
+            lut[3:11],
+            bvsort16,
+            bvsort16,
+            3,
+            11,
+            encoding,
+            first_idx=3,
+            default=default,
+        )
+
+        solver.solver.push()
+        solver.assert_formula(
+            solver.create_term(
+                solver.ops.Not,
+                solver.create_term(solver.ops.Equal, full(x), window(x)),
+            )
+        )
+        assert solver.check_sat().is_unsat()
+        solver.solver.pop()
+
+
+def test_lut_affine_matches_chain():
+    solver = Solver()
+
+    bvsort16 = solver.create_bvsort(16)
+    bvsort8 = solver.create_bvsort(8)
+
+    vals = [0, 0, 3, 3, 3, 4, 5, 6, 8, 10, 250, 255, 4, 4]
+    lut = [
+        (solver.create_const(i, bvsort16), solver.create_const(v, bvsort8))
+        for i, v in enumerate(vals)
+    ]
+
+    chain = solver.create_lut("chain", lut, bvsort16, bvsort8, 1, 13, "chain")
+    affine = solver.create_affine_lut(vals, bvsort16, bvsort8, 1, 13)
+
+    x = solver.create_symbol("x", bvsort16)
+
+    solver.assert_formula(
+        solver.create_term(
+            solver.ops.Not,
+            solver.create_term(solver.ops.Equal, chain(x), affine(x)),
+        )
+    )
+
+    assert solver.check_sat().is_unsat()
+
+
+def test_lut_periodic_matches_chain():
+    solver = Solver()
+
+    bvsort16 = solver.create_bvsort(16)
+
+    vals = [7, 7, 1] + [0, 1, 2, 2] * 6
+    lut = [
+        (solver.create_const(i, bvsort16), solver.create_const(v, bvsort16))
+        for i, v in enumerate(vals)
+    ]
+
+    chain = solver.create_lut("chain", lut, bvsort16, bvsort16, 1, 25, "chain")
+    periodic = solver.create_periodic_lut(vals, bvsort16, bvsort16, 1, 25, 3, 4)
+
+    x = solver.create_symbol("x", bvsort16)
+
+    solver.assert_formula(
+        solver.create_term(
+            solver.ops.Not,
+            solver.create_term(solver.ops.Equal, chain(x), periodic(x)),
+        )
+    )
+
+    assert solver.check_sat().is_unsat()
+
+
+def test_fts_assert_at_times():
+    solver = Solver()
+
+    bvsort1 = solver.create_bvsort(1)
+    zero = solver.create_const(0, bvsort1)
+    one = solver.create_const(1, bvsort1)
+
+    times = [1, 2, 3, 4, 8, 10, 12, 15]
+    valid = solver.create_fts_state_var("valid", bvsort1)
+    solver.fts_assert_at_times(valid, one, zero, times)
+
+    cycles = 17
+
+    solver.assert_formula(solver.ur.at_time(solver.fts.init, 0))
+    for i in range(cycles):
+        solver.assert_formula(solver.ur.at_time(solver.fts.trans, i))
+
+    mismatch = solver.create_term(False)
+    for i in range(cycles + 1):
+        expected = one if i in times else zero
+        mismatch = solver.create_term(
+            solver.ops.Or,
+            mismatch,
+            solver.create_term(
+                solver.ops.Not,
+                solver.create_term(
+                    solver.ops.Equal, solver.ur.at_time(valid, i), expected
+                ),
+            ),
+        )
+    solver.assert_formula(mismatch)
+
+    assert solver.check_sat().is_unsat()
+
+
+def test_frame_unroller():
+    solver = Solver(specialize_frames=True)
+
+    bvsort16 = solver.create_bvsort(16)
+
+    vals = [0, 4, 4, 4, 5, 6, 7, 0, 1, 2, 3, 0, 1, 2, 3]
+    lut = solver.create_affine_lut(vals, bvsort16, bvsort16, 0, len(vals))
+
+    x = solver.create_fts_state_var("x", bvsort16)
+    solver.fts.add_invar(
+        solver.create_term(solver.ops.Equal, x, lut(solver.bmc_counter))
+    )
+
+    for k, val in enumerate(vals):
+        assert solver.ur.at_time(lut(solver.bmc_counter), k) == solver.create_const(
+            val, bvsort16
+        )
+
+    solver.assert_formula(solver.ur.at_time(solver.fts.init, 0))
+    for k in range(len(vals) - 1):
+        solver.assert_formula(solver.ur.at_time(solver.fts.trans, k))
+
+    solver.assert_formula(
+        solver.create_term(
+            solver.ops.Not,
+            solver.create_term(
+                solver.ops.Equal,
+                solver.ur.at_time(x, 5),
+                solver.create_const(vals[5], bvsort16),
+            ),
+        )
+    )
+
+    assert solver.check_sat().is_unsat()
+
+
+def test_frame_unroller_cycle_count():
+    solver = Solver(specialize_frames=True)
+    solver.starting_cycle = 3
+    solver.step_cycle_count()
+
+    bvsort16 = solver.create_bvsort(16)
+
+    vals = [7, 0, 4, 9, 2, 5, 1, 8]
+    lut = solver.create_lut(
+        "counter",
+        [
+            (solver.create_const(i, bvsort16), solver.create_const(v, bvsort16))
+            for i, v in enumerate(vals)
+        ],
+        bvsort16,
+        bvsort16,
+        solver.starting_cycle,
+        len(vals),
+        encoding="chain",
+    )
+    x = lut(solver.cycle_count)
+
+    for k in range(len(vals) - solver.starting_cycle):
+        folded = solver.ur.at_time(x, k)
+        assert folded == solver.create_const(vals[solver.starting_cycle + k], bvsort16)
+    # Each frame keeps one ConstantFolder across at_time calls
+    assert len(solver.ur.folders) == len(vals) - solver.starting_cycle
+
+    # The folded LUT agrees with cycle_count stepping through the frames
+    y = solver.create_fts_state_var("y", bvsort16)
+    solver.fts.add_invar(solver.create_term(solver.ops.Equal, y, x))
+    solver.assert_formula(solver.ur.at_time(solver.fts.init, 0))
+    for k in range(2):
+        solver.assert_formula(solver.ur.at_time(solver.fts.trans, k))
+    solver.assert_formula(
+        solver.create_term(
+            solver.ops.Distinct,
+            solver.ur.at_time(y, 2),
+            solver.create_const(vals[5], bvsort16),
+        )
+    )
+    assert solver.check_sat().is_unsat()
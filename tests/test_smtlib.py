@@ -0,0 +1,32 @@
+import smt_switch as ss
+from verified_agile_hardware.smtlib_utils import smtlib_to_terms, terms_to_smtlib
+
+
+def test_smtlib_roundtrip():
+    solver = ss.create_bitwuzla_solver(False)
+    bv8 = solver.make_sort(ss.sortkinds.BV, 8)
+    x = solver.make_symbol("x", bv8)
+    y = solver.make_symbol("in y", bv8)
+
+    a = solver.make_term(ss.primops.BVAdd, x, solver.make_term(3, bv8))
+    low = solver.make_term(ss.Op(ss.primops.Extract, 3, 0), a)
+    ext = solver.make_term(ss.Op(ss.primops.Zero_Extend, 4), low)
+    lt = solver.make_term(ss.primops.BVUlt, a, y)
+    ite = solver.make_term(ss.primops.Ite, lt, ext, y)
+    eq = solver.make_term(
+        ss.primops.And,
+        solver.make_term(True),
+        solver.make_term(ss.primops.Equal, ite, a),
+    )
+
+    smtlib, ids = terms_to_smtlib([ite, eq, a])
+
+    # Shared subterms are written once
+    assert smtlib.count("bvadd") == 1
+    assert ids[2] < ids[0] < ids[1]
+
+    other = ss.create_bitwuzla_solver(False)
+    terms = smtlib_to_terms(other, smtlib, "p.")
+    assert str(terms[ids[2]]) == "(bvadd p.x #b00000011)"
+    assert "|p.in y|" in str(terms[ids[0]])
+    assert terms[ids[1]].get_sort().get_sort_kind() == ss.sortkinds.BOOL
@@ -0,0 +1,170 @@
+import io
+
+# Operator -> (takes a sort id, number of node arguments, number of literals)
+BTOR2_OPS = {
+    "sort": (False, 0, 0),
+    "input": (True, 0, 0),
+    "state": (True, 0, 0),
+    "const": (True, 0, 1),
+    "constd": (True, 0, 1),
+    "consth": (True, 0, 1),
+    "zero": (True, 0, 0),
+    "one": (True, 0, 0),
+    "ones": (True, 0, 0),
+    "init": (True, 2, 0),
+    "next": (True, 2, 0),
+    "output": (False, 1, 0),
+    "bad": (False, 1, 0),
+    "constraint": (False, 1, 0),
+    "fair": (False, 1, 0),
+    "sext": (True, 1, 1),
+    "uext": (True, 1, 1),
+    "slice": (True, 1, 2),
+    "ite": (True, 3, 0),
+    "write": (True, 3, 0),
+}
+
+for op in ["not", "inc", "dec", "neg", "redand", "redor", "redxor"]:
+    BTOR2_OPS[op] = (True, 1, 0)
+
+for op in [
+    "iff",
+    "implies",
+    "eq",
+    "neq",
+    "sgt",
+    "sgte",
+    "slt",
+    "slte",
+    "ugt",
+    "ugte",
+    "ult",
+    "ulte",
+    "and",
+    "nand",
+    "nor",
+    "or",
+    "xnor",
+    "xor",
+    "rol",
+    "ror",
+    "sll",
+    "sra",
+    "srl",
+    "add",
+    "mul",
+    "sdiv",
+    "udiv",
+    "smod",
+    "srem",
+    "urem",
+    "sub",
+    "saddo",
+    "uaddo",
+    "sdivo",
+    "udivo",
+    "smulo",
+    "umulo",
+    "ssubo",
+    "usubo",
+    "concat",
+    "read",
+]:
+    BTOR2_OPS[op] = (True, 2, 0)
+
+
+class Btor2Renumberer:
+    """Shift every node and sort id of BTOR2 models by a fixed offset.
+
+    Several models can be merged into one namespace by renumbering each with
+    the max_id of the previous one as offset. Comments are dropped, output names
+    are collected in outputs (name -> new id of the output line), state names
+    in states and all other symbols in symbols (symbol -> new id).
+    """
+
+    def __init__(self, offset=0):
+        self.offset = offset
+        self.max_id = offset
+        self.symbols = {}
+        self.states = {}
+        self.outputs = {}
+
+    def shift(self, token):
+        # Negative node arguments denote the bitwise negation of the node
+        if token[0] == "-":
+            return "-" + self.shift(token[1:])
+        return str(int(token) + self.offset)
+
+    def renumber(self, lines):
+        """Lazily renumber an iterable of lines, dropping comments and blanks."""
+        offset = self.offset
+        ops = BTOR2_OPS
+        # Arguments always refer to earlier nodes, so ids are translated with
+        # a lookup instead of parsing every argument
+        new_ids = {}
+        for line in lines:
+            if ";" in line:
+                line = line[: line.index(";")]
+            tokens = line.split()
+            if not tokens:
+                continue
+
+            node_id = int(tokens[0]) + offset
+            new_ids[tokens[0]] = tokens[0] = str(node_id)
+            op = tokens[1]
+
+            if op == "sort":
+                if tokens[2] == "array":
+                    start, end, literals_end = 3, 5, 5
+                else:
+                    start, end, literals_end = 2, 2, 4
+            elif op == "justice":
+                start, end = 3, 3 + int(tokens[2])
+                literals_end = end
+            else:
+                spec = ops.get(op)
+                if spec is None:
+                    raise ValueError(f"Unknown BTOR2 operator {op}: {line}")
+                has_sort, num_args, num_literals = spec
+                start = 2
+                end = 2 + has_sort + num_args
+                literals_end = end + num_literals
+
+            for i in range(start, end):
+                token = tokens[i]
+                new_id = new_ids.get(token)
+                tokens[i] = self.shift(token) if new_id is None else new_id
+
+            if len(tokens) > literals_end:
+                if op == "output":
+                    self.outputs[tokens[literals_end]] = node_id
+                elif op == "state":
+                    self.states[tokens[literals_end]] = node_id
+                else:
+                    self.symbols[tokens[literals_end]] = node_id
+                del tokens[literals_end + 1 :]
+
+            if node_id > self.max_id:
+                self.max_id = node_id
+
+            yield " ".join(tokens) + "\n"
+
+
+def renumber_btor2(btor, offset=0):
+    """Renumber a BTOR2 model given as a string.
+
+    Returns the renumbered model and the Btor2Renumberer holding its max_id,
+    symbols and outputs.
+    """
+    renumberer = Btor2Renumberer(offset)
+    out = io.StringIO()
+    out.writelines(renumberer.renumber(io.StringIO(btor)))
+    return out.getvalue(), renumberer
+
+
+def renumber_btor2_file(in_filename, out_filename, offset=0):
+    """Stream a BTOR2 file into a renumbered copy, returns the Btor2Renumberer."""
+    renumberer = Btor2Renumberer(offset)
+    with open(in_filename, "r") as f_in, open(out_filename, "w") as f_out:
+        f_out.writelines(renumberer.renumber(f_in))
+    return renumberer
@@ -0,0 +1,105 @@
+import hashlib
+import importlib.metadata
+import json
+import os
+import subprocess
+import tempfile
+from contextlib import contextmanager
+from functools import lru_cache
+
+
+def default_cache_dir():
+    """Directory of the on-disk artifact cache."""
+    return os.environ.get(
+        "VERIFIED_AGILE_HARDWARE_CACHE",
+        os.path.join(os.path.expanduser("~"), ".cache", "verified_agile_hardware"),
+    )
+
+
+@lru_cache(maxsize=None)
+def tool_version(tool, flag="--version"):
+    """Version string of an external tool, None if it is not installed."""
+    try:
+        res = subprocess.run([tool, flag], capture_output=True, text=True)
+    except FileNotFoundError:
+        return None
+    return (res.stdout + res.stderr).strip()
+
+
+def package_version(name):
+    """Installed version of a package, None if it is not installed."""
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+@lru_cache(maxsize=None)
+def _file_digest(filename, mtime, size):
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def file_digest(filename):
+    """Content hash of a file, only recomputed when the file changes."""
+    if not os.path.isfile(filename):
+        return None
+    st = os.stat(filename)
+    return _file_digest(filename, st.st_mtime_ns, st.st_size)
+
+
+def hash_key(*parts):
+    """Canonical hash of json serializable parts."""
+    data = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def cache_path(cache_dir, key, name):
+    return os.path.join(cache_dir, key[:2], key, name)
+
+
+def cache_read(cache_dir, key, name):
+    """Contents of a cached artifact, None on a miss."""
+    if cache_dir is None:
+        return None
+    try:
+        with open(cache_path(cache_dir, key, name), "r") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def cache_write(cache_dir, key, name, contents):
+    """Atomically store an artifact so concurrent runs never see partial files."""
+    if cache_dir is None:
+        return
+    filename = cache_path(cache_dir, key, name)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(filename))
+    with os.fdopen(fd, "w") as f:
+        f.write(contents)
+    os.replace(tmp_filename, filename)
+
+
+@contextmanager
+def scratch_file(name, keep_dir=None):
+    """Yield a (file, path) pair for an intermediate artifact.
+
+    With keep_dir the artifact is a regular file in keep_dir that is kept for
+    debugging. Otherwise it lives in memory (memfd) where supported, or in a
+    temporary file deleted afterwards. path opens the file from this process
+    and from child processes that inherit file.fileno() via pass_fds.
+    """
+    if keep_dir is not None:
+        path = os.path.join(keep_dir, name)
+        with open(path, "w+") as f:
+            yield f, path
+    elif hasattr(os, "memfd_create"):
+        with os.fdopen(os.memfd_create(name), "w+") as f:
+            yield f, f"/dev/fd/{f.fileno()}"
+    else:
+        with tempfile.NamedTemporaryFile("w+", suffix=f"_{name}") as f:
+            yield f, f.name
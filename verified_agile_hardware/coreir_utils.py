@@ -1,5 +1,4 @@
-import os
-import sys
+from concurrent.futures import ProcessPoolExecutor
 import coreir
 import networkx as nx
 import json
@@ -12,11 +11,20 @@ from verified_agile_hardware.peak_utils import (
     create_input,
     load_pe_tile,
     get_aadt,
+    pe_specialization_report,
     get_pe_inputs,
     get_pe_state,
 )
+from verified_agile_hardware.garnet_utils import get_tile_metadata
 from verified_agile_hardware.lake_utils import (
+    GARNET_FILENAME,
+    MEM_TILE_COUNTERS,
+    POND_TILE_COUNTERS,
     load_new_mem_tile,
+    prepare_mem_tile,
+    run_mem_tile_toolchain,
+    simulate_tile_counters,
+    store_mem_tile_artifacts,
     config_rom,
     mem_tile_constraint_generator,
     pond_tile_constraint_generator,
@@ -63,6 +71,199 @@ def port_remap_mem(mode, port, port_remap):
     return port
 
 
+def get_mem_tile_config(solver, node, data, in_symbol_names, out_symbols_names):
+    metadata = data["inst"].metadata
+    # Need to configure memory here
+    mem_tile = solver.interconnect.tile_circuits[(3, 1)].core
+    tile_metadata = get_tile_metadata(solver)
+
+    config = tile_metadata.config_bitstream(mem_tile, metadata)
+
+    strg_ub_vec = None
+    for controller in mem_tile.CC.controllers:
+        if controller.name == "strg_ub_vec":
+            strg_ub_vec = controller
+            break
+    assert strg_ub_vec is not None
+
+    stencil_valid = None
+    for controller in mem_tile.CC.controllers:
+        if controller.name == "stencil_valid":
+            stencil_valid = controller
+            break
+    assert stencil_valid is not None
+
+    lake_configs = list(
+        tile_metadata.controller_bitstream(strg_ub_vec, metadata["config"])
+    )
+    if "stencil_valid" in metadata["config"]:
+        lake_configs += tile_metadata.controller_bitstream(
+            stencil_valid, metadata["config"]
+        )
+    solver.lake_configs[str(node)] = lake_configs
+
+    mode = "UB"
+    if "stencil_valid" in metadata["config"]:
+        mode = "stencil_valid"
+    elif "mode" in metadata and metadata["mode"] == "sram":
+        mode = "ROM"
+        # ROM values embedded in config, we want to remove those
+        config = [c for c in config if len(c) == 2]
+
+    mem_name = str(node)
+    port_remap = tile_metadata.port_remap(mem_tile)
+
+    # About to do something dumb
+    # sort config by the first number of the tuple
+    config = sorted(config, key=lambda x: x[0])
+    registers = tile_metadata.registers(mem_tile)
+    # Sort config inputs by the key
+    config_inputs = {
+        n.split(f"_{mem_name}")[0]: v for n, v in registers.items() if "CONFIG" in n
+    }
+    config_inputs = sorted(config_inputs.items(), key=lambda x: x[0])
+
+    config_dict = {c1[0]: c0[1] for c0, c1 in zip(config, config_inputs)}
+
+    config_dict["tile_en"] = 1
+    config_dict["clk_en"] = 1
+
+    ctrl_mode = tile_metadata.mode_map(mem_tile)[mode].name
+    mode_map = mem_tile.dut.ctrl_to_mode
+
+    mode_val = mode_map[ctrl_mode][0]
+    mode_excl_val = 1 if mode_map[ctrl_mode][1] == "excl" else 0
+
+    config_dict["mode"] = mode_val
+    config_dict["mode_excl"] = mode_excl_val
+
+    config_dict["config_addr_in"] = 0
+    config_dict["config_data_in"] = 0
+    config_dict["config_en"] = 0
+    config_dict["config_read"] = 0
+    config_dict["config_write"] = 0
+
+    # config_dict["flush"] = 0
+    config_dict["rst_n"] = 1
+
+    used_inputs = [
+        port_remap_mem(mode, in_symbol_name.split(f"{mem_name}.")[1], port_remap)
+        for in_symbol_name in in_symbol_names
+    ]
+    used_outputs = [
+        port_remap_mem(mode, out_symbol.split(f"{mem_name}.")[1], port_remap)
+        for out_symbol in out_symbols_names
+    ]
+
+    if mode == "ROM":
+        rom_wen_port = port_remap["ROM"]["wen"]
+        used_inputs.append(rom_wen_port)
+
+    return mem_tile, mode, config_dict, used_inputs, used_outputs, port_remap
+
+
+def get_pond_tile_config(solver, node, data, in_symbol_names, out_symbols_names):
+    pond_name = str(node)
+
+    # Need to configure pond here
+    metadata = data["inst"].metadata
+    pond_tile = solver.interconnect.tile_circuits[(0, 1)].additional_cores[0]
+    tile_metadata = get_tile_metadata(solver)
+    config = tile_metadata.config_bitstream(pond_tile, metadata)
+
+    mode = metadata["mode"]
+    if "mode" in metadata and metadata["mode"] == "sram":
+        mode = "ROM"
+        # ROM values embedded in config, we want to remove those
+        config = [c for c in config if len(c) == 2]
+
+    ctrl_mode = tile_metadata.mode_map(pond_tile)[mode].name
+    mode_map = pond_tile.dut.ctrl_to_mode
+    strg_ub_vec = None
+    for controller in pond_tile.dut.controllers:
+        if controller.name == "strg_ub_thin_PondTop":
+            strg_ub_vec = controller
+            break
+    assert strg_ub_vec is not None
+
+    lake_configs = list(
+        tile_metadata.controller_bitstream(strg_ub_vec, metadata["config"])
+    )
+    solver.lake_configs[pond_name] = lake_configs
+
+    port_remap = tile_metadata.port_remap(pond_tile)
+
+    # About to do something dumb
+    # sort config by the first number of the tuple
+    config = sorted(config, key=lambda x: x[0])
+    registers = tile_metadata.registers(pond_tile)
+    # Sort config inputs by the key
+    config_inputs = {
+        n.split(f"_{pond_name}")[0]: v for n, v in registers.items() if "CONFIG" in n
+    }
+    config_inputs = sorted(config_inputs.items(), key=lambda x: x[0])
+
+    config_dict = {c1[0]: c0[1] for c0, c1 in zip(config, config_inputs)}
+
+    config_dict["tile_en"] = 1
+    config_dict["clk_en"] = 1
+
+    mode_val = mode_map[ctrl_mode][0]
+    mode_excl_val = 1 if mode_map[ctrl_mode][1] == "excl" else 0
+
+    config_dict["mode"] = mode_val
+    config_dict["mode_excl"] = mode_excl_val
+
+    config_dict["config_addr_in"] = 0
+    config_dict["config_data_in"] = 0
+    config_dict["config_en"] = 0
+    config_dict["config_read"] = 0
+    config_dict["config_write"] = 0
+
+    # config_dict["flush"] = 0
+    config_dict["rst_n"] = 1
+
+    used_inputs = [
+        port_remap_mem(mode, in_symbol_name.split(f"{pond_name}.")[1], port_remap)
+        for in_symbol_name in in_symbol_names
+    ]
+    used_outputs = [
+        port_remap_mem(mode, out_symbol.split(f"{pond_name}.")[1], port_remap)
+        for out_symbol in out_symbols_names
+    ]
+
+    if mode == "ROM":
+        rom_wen_port = port_remap["ROM"]["wen"]
+        used_inputs.append(rom_wen_port)
+
+    return pond_tile, mode, config_dict, used_inputs, used_outputs, port_remap
+
+
+REGISTER_TYPES = ("coreir.reg", "corebit.reg")
+
+
+def tile_flush_offset(solver, data):
+    """Cycles the flush takes through the config pipeline to reach a tile."""
+    if "y" not in data:
+        return 0
+    if data["y"] == 0 or solver.interconnect.pipeline_config_interval == 0:
+        return 0
+    return (data["y"] - 1) // solver.interconnect.pipeline_config_interval
+
+
+def create_reg_state(solver, node, sort):
+    name = str(node)
+    reg_in = solver.create_fts_state_var(f"{name}.reg_in", sort)
+    reg_val = solver.create_fts_state_var(f"{name}.reg_val", sort)
+    return reg_in, reg_val
+
+
+def bind_reg_inputs(solver, reg_in, reg_val, in_symbols):
+    for in_symbol_name, in_symbol in in_symbols.items():
+        solver.fts.assign_next(reg_in, in_symbol)
+        solver.fts.assign_next(reg_val, reg_in)
+
+
 def node_to_smt(
     solver, tile_type, in_symbols, out_symbols_names, out_symbol_widths, data, node
 ):
@@ -93,14 +294,12 @@ def node_to_smt(
             pe_name=pe_name,
             out_port_names=out_port_names,
         )
-        solver.bboxes.update(bboxes0)
 
         pe_inputs = {str(i): i for i in pe_inputs}
 
-        port_remap = solver.interconnect.tile_circuits[(1, 1)].core.get_port_remap()[
-            "alu"
-        ]
-        port_remap_reversed = {v: k for k, v in port_remap.items()}
+        port_remap_reversed = get_tile_metadata(solver).reversed_port_remap(
+            solver.interconnect.tile_circuits[(1, 1)].core, "alu"
+        )
 
         for in_symbol_name, in_symbol in in_symbols.items():
             port = in_symbol_name.split(f"{node}.")[1]
@@ -149,10 +348,9 @@ def node_to_smt(
             curr_bit += size
             coreir_name_to_peak_name[n] = f"O{idx}"
 
-        port_remap = solver.interconnect.tile_circuits[(1, 1)].core.get_port_remap()[
-            "alu"
-        ]
-        port_remap_reversed = {v: k for k, v in port_remap.items()}
+        port_remap_reversed = get_tile_metadata(solver).reversed_port_remap(
+            solver.interconnect.tile_circuits[(1, 1)].core, "alu"
+        )
 
         for out_symbol_name in out_symbols_names:
             port = out_symbol_name.split(f"{node}.")[1]
@@ -199,107 +397,20 @@ def node_to_smt(
                 solver.first_valid_output, valid_out_starting_cycle
             )
 
+        mem_tile, mode, config_dict, used_inputs, used_outputs, port_remap = (
+            get_mem_tile_config(solver, node, data, in_symbols, out_symbols_names)
+        )
         metadata = data["inst"].metadata
-        # Need to configure memory here
-        mem_tile = solver.interconnect.tile_circuits[(3, 1)].core
-
-        sys.stdout = open(os.devnull, "w")
-        config = mem_tile.get_config_bitstream(data["inst"].metadata)
-
-        strg_ub_vec = None
-        for controller in mem_tile.CC.controllers:
-            if controller.name == "strg_ub_vec":
-                strg_ub_vec = controller
-                break
-        assert strg_ub_vec is not None
-
-        stencil_valid = None
-        for controller in mem_tile.CC.controllers:
-            if controller.name == "stencil_valid":
-                stencil_valid = controller
-                break
-        assert stencil_valid is not None
-
-        lake_configs = strg_ub_vec.get_bitstream(metadata["config"])
-        if "stencil_valid" in metadata["config"]:
-            lake_configs += stencil_valid.get_bitstream(metadata["config"])
-        sys.stdout = sys.__stdout__
-
-        mode = "UB"
-        if "stencil_valid" in metadata["config"]:
-            mode = "stencil_valid"
-        elif "mode" in metadata and metadata["mode"] == "sram":
-            mode = "ROM"
-            # ROM values embedded in config, we want to remove those
-            config = [c for c in config if len(c) == 2]
-
         mem_name = str(node)
-        port_remap = mem_tile.get_port_remap()
-
-        # About to do something dumb
-        # sort config by the first number of the tuple
-        config = sorted(config, key=lambda x: x[0])
-        registers = mem_tile.registers
-        # Sort config inputs by the key
-        config_inputs = {
-            n.split(f"_{mem_name}")[0]: v for n, v in registers.items() if "CONFIG" in n
-        }
-        config_inputs = sorted(config_inputs.items(), key=lambda x: x[0])
-
-        config_dict = {c1[0]: c0[1] for c0, c1 in zip(config, config_inputs)}
-
-        config_dict["tile_en"] = 1
-        config_dict["clk_en"] = 1
-
-        ctrl_mode = mem_tile.dut.get_mode_map()[mode].name
-        mode_map = mem_tile.dut.ctrl_to_mode
-
-        mode_val = mode_map[ctrl_mode][0]
-        mode_excl_val = 1 if mode_map[ctrl_mode][1] == "excl" else 0
-
-        config_dict["mode"] = mode_val
-        config_dict["mode_excl"] = mode_excl_val
-
-        config_dict["config_addr_in"] = 0
-        config_dict["config_data_in"] = 0
-        config_dict["config_en"] = 0
-        config_dict["config_read"] = 0
-        config_dict["config_write"] = 0
-
-        # config_dict["flush"] = 0
-        config_dict["rst_n"] = 1
-
-        used_inputs = [
-            port_remap_mem(mode, in_symbol_name.split(f"{mem_name}.")[1], port_remap)
-            for in_symbol_name, in_symbol in in_symbols.items()
-        ]
-        used_outputs = [
-            port_remap_mem(mode, out_symbol.split(f"{mem_name}.")[1], port_remap)
-            for out_symbol in out_symbols_names
-        ]
-
-        if mode == "ROM":
-            rom_wen_port = port_remap["ROM"]["wen"]
-            used_inputs.append(rom_wen_port)
 
         mem_inputs, mem_outputs = load_new_mem_tile(
             solver, mem_name, mem_tile, config_dict, used_inputs, used_outputs
         )
 
-        flush_offset = 0
-        if "y" in data:
-            if data["y"] == 0 or solver.interconnect.pipeline_config_interval == 0:
-                flush_offset = 0
-            else:
-                flush_offset = (
-                    data["y"] - 1
-                ) // solver.interconnect.pipeline_config_interval
-
-
         mem_tile_constraint_generator(
             solver,
             mem_name,
-            flush_offset=flush_offset,
+            flush_offset=tile_flush_offset(solver, data),
         )
 
         used_mem_inputs = []
@@ -390,92 +501,19 @@ def node_to_smt(
     elif tile_type == "cgralib.Pond":
         pond_name = str(node)
 
-        # Need to configure pond here
+        pond_tile, mode, config_dict, used_inputs, used_outputs, port_remap = (
+            get_pond_tile_config(solver, node, data, in_symbols, out_symbols_names)
+        )
         metadata = data["inst"].metadata
-        pond_tile = solver.interconnect.tile_circuits[(0, 1)].additional_cores[0]
-        config = pond_tile.get_config_bitstream(data["inst"].metadata)
-
-        mode = metadata["mode"]
-        if "mode" in metadata and metadata["mode"] == "sram":
-            mode = "ROM"
-            # ROM values embedded in config, we want to remove those
-            config = [c for c in config if len(c) == 2]
-
-        ctrl_mode = pond_tile.dut.get_mode_map()[mode].name
-        mode_map = pond_tile.dut.ctrl_to_mode
-        strg_ub_vec = None
-        for controller in pond_tile.dut.controllers:
-            if controller.name == "strg_ub_thin_PondTop":
-                strg_ub_vec = controller
-                break
-        assert strg_ub_vec is not None
-
-        lake_configs = strg_ub_vec.get_bitstream(metadata["config"])
-
-        port_remap = pond_tile.get_port_remap()
-
-        # About to do something dumb
-        # sort config by the first number of the tuple
-        config = sorted(config, key=lambda x: x[0])
-        registers = pond_tile.registers
-        # Sort config inputs by the key
-        config_inputs = {
-            n.split(f"_{pond_name}")[0]: v
-            for n, v in registers.items()
-            if "CONFIG" in n
-        }
-        config_inputs = sorted(config_inputs.items(), key=lambda x: x[0])
-
-        config_dict = {c1[0]: c0[1] for c0, c1 in zip(config, config_inputs)}
-
-        config_dict["tile_en"] = 1
-        config_dict["clk_en"] = 1
-
-        mode_val = mode_map[ctrl_mode][0]
-        mode_excl_val = 1 if mode_map[ctrl_mode][1] == "excl" else 0
-
-        config_dict["mode"] = mode_val
-        config_dict["mode_excl"] = mode_excl_val
-
-        config_dict["config_addr_in"] = 0
-        config_dict["config_data_in"] = 0
-        config_dict["config_en"] = 0
-        config_dict["config_read"] = 0
-        config_dict["config_write"] = 0
-
-        # config_dict["flush"] = 0
-        config_dict["rst_n"] = 1
-
-        used_inputs = [
-            port_remap_mem(mode, in_symbol_name.split(f"{pond_name}.")[1], port_remap)
-            for in_symbol_name in in_symbols
-        ]
-        used_outputs = [
-            port_remap_mem(mode, out_symbol.split(f"{pond_name}.")[1], port_remap)
-            for out_symbol in out_symbols_names
-        ]
-
-        if mode == "ROM":
-            rom_wen_port = port_remap["ROM"]["wen"]
-            used_inputs.append(rom_wen_port)
 
         pond_inputs, pond_outputs = load_new_mem_tile(
             solver, pond_name, pond_tile, config_dict, used_inputs, used_outputs
         )
 
-        flush_offset = 0
-        if "y" in data:
-            if data["y"] == 0 or solver.interconnect.pipeline_config_interval == 0:
-                flush_offset = 0
-            else:
-                flush_offset = (
-                    data["y"] - 1
-                ) // solver.interconnect.pipeline_config_interval
-
         pond_tile_constraint_generator(
             solver,
             pond_name,
-            flush_offset=flush_offset,
+            flush_offset=tile_flush_offset(solver, data),
         )
 
         used_pond_inputs = []
@@ -564,20 +602,6 @@ def node_to_smt(
             assert "init" in metadata
             config_rom(solver, pond_name, metadata["init"])
 
-    elif tile_type == "coreir.reg" or tile_type == "corebit.reg":
-        name = str(node)
-        reg_in = solver.create_fts_state_var(
-            f"{name}.reg_in", list(in_symbols.values())[0].get_sort()
-        )
-        reg_val = solver.create_fts_state_var(
-            f"{name}.reg_val", list(in_symbols.values())[0].get_sort()
-        )
-        for in_symbol_name, in_symbol in in_symbols.items():
-            solver.fts.assign_next(reg_in, in_symbol)
-            solver.fts.assign_next(reg_val, reg_in)
-
-        for out_symbol_name in out_symbols_names:
-            out_symbols[out_symbol_name] = reg_val
     elif (
         tile_type == "corebit.const"
         or tile_type == "coreir.const"
@@ -640,9 +664,192 @@ def pack_pe_constants(graph):
                         break
 
 
+def collapse_route_chains(graph):
+    """Contract pass-through route nodes into single edges, in place.
+
+    A route node with one input and one output edge of equal bitwidth is
+    replaced by one edge from the source port of its input to the sink port
+    of its output, so whole chains collapse. Fan-out points are kept, and so
+    are routes next to the design inputs and outputs, which name the input
+    and output symbols. Returns the number of nodes before and after.
+    """
+    num_nodes = graph.number_of_nodes()
+
+    for node in list(graph.nodes):
+        data = graph.nodes[node]
+        if "inst" in data or data.get("node_type") != "route":
+            continue
+        if graph.in_degree(node) != 1 or graph.out_degree(node) != 1:
+            continue
+
+        ((pred, _, in_edge),) = graph.in_edges(node, data=True)
+        ((_, succ, out_edge),) = graph.out_edges(node, data=True)
+        if (
+            pred in ("in", "out")
+            or succ in ("in", "out")
+            or pred == succ
+            or graph.has_edge(pred, succ)
+            or in_edge["bitwidth"] != out_edge["bitwidth"]
+        ):
+            continue
+
+        edge = dict(out_edge, source_port=in_edge["source_port"])
+        graph.remove_node(node)
+        graph.add_edge(pred, succ, **edge)
+
+    return num_nodes, graph.number_of_nodes()
+
+
+def node_port_names(graph, node):
+    in_symbol_names = [
+        f'{node}.{graph.edges[in_]["sink_port"]}' for in_ in graph.in_edges(node)
+    ]
+    out_symbols_names = [
+        f'{node}.{graph.edges[out_]["source_port"]}' for out_ in graph.out_edges(node)
+    ]
+    return in_symbol_names, out_symbols_names
+
+
+def presynthesize_tiles(graph, solver):
+    """Synthesize and simulate every memory and pond tile up front.
+
+    The verilog is generated here, sv2v and yosys of each distinct
+    configuration run in a pool of solver.jobs processes. The iverilog
+    counter simulations of all configurations then share one testbench so
+    garnet.v is only compiled once. The results are picked up by
+    load_new_mem_tile and the constraint generators.
+    """
+    jobs = {}
+    tiles = {}
+    simulations = {}
+    max_flush_offset = 0
+    for node, data in graph.nodes(data=True):
+        if "inst" not in data:
+            continue
+
+        tile_type = data["inst"].module.ref_name
+        if tile_type == "cgralib.Mem":
+            get_tile_config = get_mem_tile_config
+            tile_args = ("MemCore_inner", MEM_TILE_COUNTERS)
+        elif tile_type == "cgralib.Pond":
+            get_tile_config = get_pond_tile_config
+            tile_args = ("PondTop", POND_TILE_COUNTERS)
+        else:
+            continue
+
+        in_symbol_names, out_symbols_names = node_port_names(graph, node)
+        tile, mode, config_dict, used_inputs, used_outputs, port_remap = (
+            get_tile_config(solver, node, data, in_symbol_names, out_symbols_names)
+        )
+        key, cached_name, artifacts = prepare_mem_tile(
+            solver, tile, config_dict, used_inputs, used_outputs
+        )
+
+        if artifacts is None and key not in jobs:
+            jobs[key] = (
+                solver.app_dir,
+                cached_name,
+                GARNET_FILENAME,
+                solver.keep_artifacts,
+            )
+
+        # The counter models run in the constraint generators, only synthesize
+        if solver.counter_backend == "model":
+            continue
+
+        # Tiles with the same configuration share one simulation
+        tiles.setdefault(key, []).append(str(node))
+        if tile_type == "cgralib.Pond":
+            max_flush_offset = max(max_flush_offset, tile_flush_offset(solver, data))
+        simulations[key] = (cached_name, artifacts, *tile_args)
+
+    if solver.jobs > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=solver.jobs) as pool:
+            futures = {
+                key: pool.submit(run_mem_tile_toolchain, *args)
+                for key, args in jobs.items()
+            }
+            results = {key: future.result() for key, future in futures.items()}
+    else:
+        results = {key: run_mem_tile_toolchain(*args) for key, args in jobs.items()}
+
+    for key, artifacts in results.items():
+        store_mem_tile_artifacts(solver, key, artifacts)
+
+    batch = {}
+    for key, (cached_name, artifacts, *tile_args) in simulations.items():
+        btor, simulation_v = results.get(key, artifacts)
+        batch[cached_name] = (simulation_v, *tile_args)
+
+    traces = simulate_tile_counters(
+        solver.app_dir,
+        batch,
+        solver.max_cycles,
+        solver.counter_backend,
+        solver.cache_dir,
+        # Pond traces are delayed by their flush offset, keep the cycles
+        # that are shifted into the verified window
+        max(0, solver.starting_cycle - max_flush_offset),
+        GARNET_FILENAME,
+    )
+    for key, (cached_name, *_) in simulations.items():
+        for tile_name in tiles[key]:
+            solver.counter_traces[tile_name] = traces[cached_name]
+
+
+def is_register_node(data):
+    if "inst" in data:
+        return data["inst"].module.ref_name in REGISTER_TYPES
+    return data.get("node_type") in REGISTER_TYPES
+
+
+def register_width(graph, node):
+    edges = list(graph.in_edges(node)) or list(graph.out_edges(node))
+    return graph.edges[edges[0]]["bitwidth"]
+
+
+def node_in_symbols(graph, node, node_symbols):
+    in_symbols = {}
+    for in_ in graph.in_edges(node):
+        edge_info = graph.edges[in_]
+        source = in_[0]
+        in_name = f'{in_[1]}.{edge_info["sink_port"]}'
+        out_name = f'{source}.{edge_info["source_port"]}'
+        in_symbols[in_name] = node_symbols[source][out_name]
+    return in_symbols
+
+
+def combinational_order(graph):
+    """Topological order of graph with the inputs of registers cut.
+
+    Register outputs only depend on state, so cycles through registers are
+    fine. Raises a ValueError naming one combinational cycle otherwise.
+    """
+    cut = nx.subgraph_view(
+        graph, filter_edge=lambda u, v: not is_register_node(graph.nodes[v])
+    )
+    try:
+        return list(nx.topological_sort(cut))
+    except nx.NetworkXUnfeasible:
+        cycle = nx.find_cycle(cut)
+        raise ValueError(
+            "Combinational cycle in design: "
+            + " -> ".join(str(u) for u, v in cycle)
+            + f" -> {cycle[-1][1]}"
+        )
+
+
 def nx_to_smt(graph, interconnect, solver):
     pack_pe_constants(graph)
 
+    if solver.collapse_routes:
+        num_nodes, num_collapsed = collapse_route_chains(graph)
+        if solver.verbose and num_nodes:
+            print(
+                f"Collapsed route chains: {num_nodes} -> {num_collapsed} nodes "
+                f"({1 - num_collapsed / num_nodes:.1%} fewer)"
+            )
+
     solver.interconnect = interconnect
 
     stencil_valid_to_port_controller = {}
@@ -676,15 +883,16 @@ def nx_to_smt(graph, interconnect, solver):
             stencil_valid_name = f"{edge[1]}.{edge[0]}"
             solver.stencil_valid_to_port_controller[stencil_valid_name] = node
 
-    if len(list(nx.simple_cycles(graph))) > 0:
-        breakpoint()
+    order = combinational_order(graph)
+
+    presynthesize_tiles(graph, solver)
 
     node_symbols = {}
     input_symbols = {}
     output_symbols = {}
+    registers = {}
 
-    # Topological sort
-    for node in nx.topological_sort(graph):
+    for node in order:
         # for node, data in graph.nodes(data=True):
         data = graph.nodes[node]
         if node == "in":
@@ -722,15 +930,6 @@ def nx_to_smt(graph, interconnect, solver):
             else:
                 tile_type = data["inst"].module.ref_name
 
-            in_symbols = {}
-            for in_ in graph.in_edges(node):
-                edge_info = graph.edges[in_]
-                source = in_[0]
-                in_name = f'{in_[1]}.{edge_info["sink_port"]}'
-                out_name = f'{source}.{edge_info["source_port"]}'
-                source_symbol = node_symbols[source][out_name]
-                in_symbols[in_name] = source_symbol
-
             out_symbol_widths = {}
             out_symbols_names = []
             for out_ in graph.out_edges(node):
@@ -740,6 +939,18 @@ def nx_to_smt(graph, interconnect, solver):
                 out_symbols_names.append(name)
                 out_symbol_widths[name] = edge_info["bitwidth"]
 
+            # Register outputs are state, their inputs are bound once the
+            # whole graph has been walked
+            if tile_type in REGISTER_TYPES:
+                reg_state = create_reg_state(
+                    solver, node, solver.create_bvsort(register_width(graph, node))
+                )
+                registers[node] = reg_state
+                node_symbols[node] = {name: reg_state[1] for name in out_symbols_names}
+                continue
+
+            in_symbols = node_in_symbols(graph, node, node_symbols)
+
             node_symbols[node] = node_to_smt(
                 solver,
                 tile_type,
@@ -750,6 +961,13 @@ def nx_to_smt(graph, interconnect, solver):
                 node,
             )
 
+    for node, (reg_in, reg_val) in registers.items():
+        in_symbols = node_in_symbols(graph, node, node_symbols)
+        bind_reg_inputs(solver, reg_in, reg_val, in_symbols)
+
+    if solver.verbose and solver.pe_specializations:
+        print(pe_specialization_report(solver))
+
     return solver, input_symbols, output_symbols
 
 
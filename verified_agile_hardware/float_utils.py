@@ -0,0 +1,57 @@
+import math
+
+BFLOAT16_INF = 0x7F80
+BFLOAT16_NAN = 0x7FC0
+
+
+def bfloat16_to_float(bits):
+    """Value of a bfloat16 bit pattern, subnormals are flushed to zero."""
+    sign = -1.0 if bits & 0x8000 else 1.0
+    exp = (bits >> 7) & 0xFF
+    frac = bits & 0x7F
+    if exp == 0:
+        return sign * 0.0
+    if exp == 0xFF:
+        return math.nan if frac else sign * math.inf
+    return sign * (1 + frac / 128) * 2.0 ** (exp - 127)
+
+
+def float_to_bfloat16(x):
+    """Round x to the nearest bfloat16, ties to even.
+
+    Results below the smallest normal are flushed to zero and NaNs are
+    returned as the canonical quiet NaN.
+    """
+    if math.isnan(x):
+        return BFLOAT16_NAN
+    sign = 0x8000 if math.copysign(1.0, x) < 0 else 0
+    x = abs(x)
+    if x == 0:
+        return sign
+    if math.isinf(x):
+        return sign | BFLOAT16_INF
+
+    # x = m * 2**e with 0.5 <= m < 1, round to 8 significant bits. m * 2**8 is
+    # exact, so round() breaks ties to even
+    m, e = math.frexp(x)
+    significand = round(m * 2**8)
+    exp = e - 1 + 127
+    if significand == 2**8:
+        significand = 2**7
+        exp += 1
+
+    if exp >= 0xFF:
+        return sign | BFLOAT16_INF
+    if exp <= 0:
+        return sign
+    return sign | exp << 7 | (significand - 2**7)
+
+
+# Sums and products of two bfloat16 values are exact in double precision,
+# or off by less than half a bfloat16 ulp, so a single rounding is correct
+def bfloat16_add(a, b):
+    return float_to_bfloat16(bfloat16_to_float(a) + bfloat16_to_float(b))
+
+
+def bfloat16_mul(a, b):
+    return float_to_bfloat16(bfloat16_to_float(a) * bfloat16_to_float(b))
@@ -1,5 +1,70 @@
 from gemstone.common.configurable import ConfigRegister
+from contextlib import contextmanager, redirect_stdout
+import os
 import re
+from verified_agile_hardware.cache_utils import hash_key
+
+
+@contextmanager
+def suppress_stdout():
+    """Silence the prints of garnet and lake generator code in the block."""
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        yield
+
+
+class TileMetadataCache:
+    """Memoized metadata lookups on the cores of one interconnect.
+
+    Port remaps, mode maps and registers only depend on the core, bitstreams
+    also depend on a canonical hash of the tile metadata, so the garnet and
+    lake generator code runs once per distinct lookup. Returned values are
+    shared, callers copy them before mutating.
+    """
+
+    def __init__(self, interconnect):
+        self.interconnect = interconnect
+        self.lookups = {}
+
+    def lookup(self, key, compute):
+        if key not in self.lookups:
+            with suppress_stdout():
+                self.lookups[key] = compute()
+        return self.lookups[key]
+
+    def port_remap(self, core):
+        return self.lookup(("port_remap", id(core)), core.get_port_remap)
+
+    def reversed_port_remap(self, core, mode):
+        return self.lookup(
+            ("reversed_port_remap", id(core), mode),
+            lambda: {v: k for k, v in self.port_remap(core)[mode].items()},
+        )
+
+    def mode_map(self, core):
+        return self.lookup(("mode_map", id(core)), core.dut.get_mode_map)
+
+    def registers(self, core):
+        return self.lookup(("registers", id(core)), lambda: core.registers)
+
+    def config_bitstream(self, core, metadata):
+        return self.lookup(
+            ("config_bitstream", id(core), hash_key(metadata)),
+            lambda: core.get_config_bitstream(metadata),
+        )
+
+    def controller_bitstream(self, controller, config):
+        return self.lookup(
+            ("controller_bitstream", id(controller), hash_key(config)),
+            lambda: controller.get_bitstream(config),
+        )
+
+
+def get_tile_metadata(solver):
+    """TileMetadataCache of solver.interconnect, created on first use."""
+    cache = solver.tile_metadata
+    if cache is None or cache.interconnect is not solver.interconnect:
+        cache = solver.tile_metadata = TileMetadataCache(solver.interconnect)
+    return cache
 
 
 def get_config_addr(self, reg_addr: int, feat_addr: int, x: int, y: int):
@@ -12,17 +77,17 @@ def get_config_addr(self, reg_addr: int, feat_addr: int, x: int, y: int):
     return addr
 
 
-def get_garnet_inputs(solver):
-    input_vars = []
-    for i in solver.fts.inputvars:
-        solver.fts.promote_inputvar(i)
-        input_vars.append(i)
-
-    input_vars = sorted(input_vars, key=lambda x: str(x))
+def get_garnet_inputs(solver, tile_name=None):
+    # Without a tile name, promote and return all pending inputs
+    if tile_name is None:
+        input_vars = {str(i): i for i in solver.fts.inputvars}
+    else:
+        input_vars = solver.get_tile_vars(tile_name, "inputs")
 
     input_dict = {}
-    for i in input_vars:
-        input_dict[str(i)] = i
+    for name in sorted(input_vars):
+        solver.promote_inputvar(input_vars[name])
+        input_dict[name] = input_vars[name]
 
     return input_dict
 
@@ -1,41 +1,56 @@
 from verified_agile_hardware.solver import Solver, Rewriter
-from verified_agile_hardware.yosys_utils import mem_tile_to_btor, sv2v
+from verified_agile_hardware.yosys_utils import (
+    MEM_TILE_YOSYS_SCRIPT,
+    mem_tile_to_btor,
+    sv2v,
+)
 from verified_agile_hardware.configure_mem_tile import MemtileConfig
 from verified_agile_hardware.simulate_lake import (
+    GARNET_FILENAME,
+    model_counters,
     simulate_counters,
+    simulate_counters_batch,
+)
+from verified_agile_hardware.btor2_utils import Btor2Renumberer
+from verified_agile_hardware.schedule_utils import (
+    affine_segments,
+    find_period,
+    shift_trace,
+)
+from verified_agile_hardware.cache_utils import (
+    cache_read,
+    cache_write,
+    file_digest,
+    hash_key,
+    package_version,
+    scratch_file,
+    tool_version,
 )
 from _kratos import create_wrapper_flatten
 from lake.models.addr_gen_model import AddrGenModel
+import inspect
+import io
 import os
 import magma
 import kratos as kts
 import json
 import smt_switch as ss
 
+# Bump when the layout or meaning of the cached tile artifacts changes
+MEM_TILE_CACHE_VERSION = 1
 
-def get_mem_btor_outputs(solver, btor_filename):
-    output_symbols = {}
-    with open(btor_filename) as f:
-        for line in f:
-            if " output " in line:
-                output_var = line.split()[3]
-                output_symbols[output_var] = solver.fts.lookup(output_var)
 
-    return output_symbols
+def get_mem_btor_outputs(solver, mem_name):
+    return solver.get_tile_vars(mem_name, "outputs")
 
 
 def get_mem_inputs(solver, mem_name):
-    input_vars = []
-    for i in solver.fts.inputvars:
-        solver.fts.promote_inputvar(i)
-        if mem_name in str(i):
-            input_vars.append(i)
-
-    input_vars = sorted(input_vars, key=lambda x: str(x))
-
     input_dict = {}
-    for i in input_vars:
-        input_dict[str(i)] = i
+    for name, i in solver.get_tile_vars(mem_name, "inputs").items():
+        solver.promote_inputvar(i)
+        # Unnamed inputs are promoted but not exposed as ports
+        if mem_name in name:
+            input_dict[name] = i
 
     return input_dict
 
@@ -281,75 +296,311 @@ def produce_configed_simulation_memtile_verilog(
         f.write(verilog)
 
 
-def load_new_mem_tile(
-    solver, mem_name, mem_tile, config_dict, used_inputs, used_outputs
+def mem_tile_cache_key(
+    mem_tile, config_dict, used_inputs, used_outputs, garnet_filename
 ):
+    # Everything that influences the generated BTOR2 and simulation verilog,
+    # including the code generating them
+    ports = []
+    for port in mem_tile.dut.ports:
+        p = mem_tile.dut.ports[port]
+        ports.append((p.name, str(p.port_direction), p.width, p.is_packed, p.size[0]))
+
+    return hash_key(
+        "mem_tile",
+        MEM_TILE_CACHE_VERSION,
+        type(mem_tile).__name__,
+        mem_tile.dut.name,
+        package_version("lake-aha"),
+        package_version("kratos"),
+        inspect.getsource(produce_configed_memtile_verilog),
+        inspect.getsource(produce_configed_simulation_memtile_verilog),
+        MEM_TILE_YOSYS_SCRIPT,
+        sorted(ports),
+        sorted(config_dict.items()),
+        sorted(used_inputs),
+        sorted(used_outputs),
+        file_digest(garnet_filename),
+        tool_version("yosys", "-V"),
+        tool_version("sv2v"),
+    )
+
+
+def prepare_mem_tile(solver, mem_tile, config_dict, used_inputs, used_outputs):
+    """Generate the configured verilog of a tile unless its artifacts exist.
+
+    Returns (key, cached_name, artifacts), artifacts is None if the external
+    toolchain still has to run on the generated verilog.
+    """
+    # Tiles with the same configuration produce the same artifacts up to the
+    # tile name, so they are generated under a name derived from the cache
+    # key and renamed afterwards
+    key = mem_tile_cache_key(
+        mem_tile, config_dict, used_inputs, used_outputs, GARNET_FILENAME
+    )
+    cached_name = f"vah_{key[:16]}"
+
+    if key in solver.tile_artifacts:
+        return key, cached_name, solver.tile_artifacts[key]
+
+    btor = cache_read(solver.cache_dir, key, "configed.btor")
+    simulation_v = cache_read(solver.cache_dir, key, "simulation.v")
+    if btor is not None and simulation_v is not None:
+        return key, cached_name, (btor, simulation_v)
+
+    # The verilog generators add the clock and reset ports in place
+    config_dict = dict(config_dict)
+    used_inputs = list(used_inputs)
+
     # Write kratos config_dict to configure mem tile
     produce_configed_memtile_verilog(
-        solver.app_dir, mem_tile, config_dict, mem_name, used_inputs, used_outputs
+        solver.app_dir,
+        mem_tile,
+        config_dict,
+        cached_name,
+        used_inputs,
+        used_outputs,
     )
 
     produce_configed_simulation_memtile_verilog(
-        solver.app_dir, mem_tile, config_dict, mem_name
+        solver.app_dir, mem_tile, config_dict, cached_name
     )
 
+    return key, cached_name, None
+
+
+def run_mem_tile_toolchain(
+    app_dir, cached_name, garnet_filename=GARNET_FILENAME, keep_artifacts=False
+):
+    """Run sv2v and yosys on the verilog written by prepare_mem_tile."""
     sv2v(
-        f"{solver.app_dir}/{mem_name}_simulation.sv",
-        f"{solver.app_dir}/{mem_name}_simulation.v",
+        f"{app_dir}/{cached_name}_simulation.sv",
+        f"{app_dir}/{cached_name}_simulation.v",
     )
 
-    unique = solver.num_memtiles + 12345  # this is stupid
-    solver.num_memtiles += 1
+    # Yosys writes the BTOR2 straight into memory unless it is kept around
+    with scratch_file(
+        f"{cached_name}_configed_temp.btor", app_dir if keep_artifacts else None
+    ) as (f, btor_file_t):
+        mem_tile_to_btor(
+            app_dir,
+            garnet_filename,
+            f"{app_dir}/{cached_name}_configed.sv",
+            mem_tile_module=cached_name,
+            btor_filename=btor_file_t,
+            write_verilog=keep_artifacts,
+            pass_fds=(f.fileno(),),
+        )
+        f.seek(0)
+        btor = f.read()
 
-    btor_file_t = f"{solver.app_dir}/{mem_name}_configed_temp.btor"
-    btor_file = f"{solver.app_dir}/{mem_name}_configed.btor"
+    with open(f"{app_dir}/{cached_name}_simulation.v", "r") as f:
+        simulation_v = f.read()
 
-    mem_tile_to_btor(
-        solver.app_dir,
-        "/aha/garnet/garnet.v",
-        f"{solver.app_dir}/{mem_name}_configed.sv",
-        mem_tile_module=f"{mem_name}",
-        btor_filename=btor_file_t,
-    )
+    return btor, simulation_v
 
-    f = open(btor_file_t, "r")
-    lines = f.readlines()
-    f.close()
 
-    rewritten_terms = {}
+def store_mem_tile_artifacts(solver, key, artifacts):
+    btor, simulation_v = artifacts
+    solver.tile_artifacts[key] = artifacts
+    cache_write(solver.cache_dir, key, "configed.btor", btor)
+    cache_write(solver.cache_dir, key, "simulation.v", simulation_v)
 
-    for l_idx, line in enumerate(lines):
-        split_lines = line.split()
-        if split_lines[0].isnumeric():
-            rewritten_terms[split_lines[0]] = str(unique) + split_lines[0]
 
-        for s_idx, s in enumerate(split_lines):
-            if "sort" == split_lines[1] and s_idx > 1 and "array" != split_lines[2]:
-                continue
+def simulate_tile_counters(
+    app_dir,
+    tiles,
+    max_cycles,
+    backend="iverilog",
+    cache_dir=None,
+    start_cycle=0,
+    garnet_filename=GARNET_FILENAME,
+):
+    """Simulate the counters of several synthesized tiles in one testbench.
+
+    tiles maps cached_name to (simulation_v, tile_type, symbols_to_collect).
+    Returns the traces of each cached_name.
+    """
+    batch = []
+    for cached_name, (simulation_v, tile_type, symbols_to_collect) in tiles.items():
+        with open(f"{app_dir}/{cached_name}_simulation.v", "w") as f:
+            f.write(simulation_v)
+        batch.append((cached_name, tile_type, symbols_to_collect))
+
+    if not batch:
+        return {}
+
+    return simulate_counters_batch(
+        app_dir,
+        batch,
+        max_cycles,
+        "vah_counters",
+        backend,
+        cache_dir,
+        start_cycle,
+        garnet_filename,
+    )
 
-            if "const" == split_lines[1] and s_idx > 2:
-                continue
 
-            if ("uext" == split_lines[1] or "sext" == split_lines[1]) and s_idx > 3:
-                continue
+def load_new_mem_tile(
+    solver, mem_name, mem_tile, config_dict, used_inputs, used_outputs
+):
+    key, cached_name, artifacts = prepare_mem_tile(
+        solver, mem_tile, config_dict, used_inputs, used_outputs
+    )
 
-            if "slice" == split_lines[1] and s_idx > 3:
-                continue
+    if artifacts is None:
+        artifacts = run_mem_tile_toolchain(
+            solver.app_dir, cached_name, keep_artifacts=solver.keep_artifacts
+        )
+        store_mem_tile_artifacts(solver, key, artifacts)
 
-            if s in rewritten_terms:
-                split_lines[s_idx] = rewritten_terms[s]
+    btor, simulation_v = artifacts
 
-        lines[l_idx] = " ".join(split_lines) + "\n"
+    # Only needed if the counters of this tile are simulated with iverilog
+    if solver.keep_artifacts or (
+        solver.counter_backend != "model" and mem_name not in solver.counter_traces
+    ):
+        with open(f"{solver.app_dir}/{mem_name}_simulation.v", "w") as f:
+            f.write(simulation_v.replace(cached_name, mem_name))
 
-    f = open(btor_file, "w")
-    f.writelines(lines)
-    f.close()
+    solver.num_memtiles += 1
 
-    solver.read_btor2(btor_file)
+    # Keep node ids unique across all tiles loaded into the solver and stream
+    # the renumbered model to the encoder without going through disk
+    renumberer = Btor2Renumberer(solver.btor2_offset)
+    with scratch_file(
+        f"{mem_name}_configed.btor",
+        solver.app_dir if solver.keep_artifacts else None,
+    ) as (f, btor_file):
+        f.writelines(
+            renumberer.renumber(io.StringIO(btor.replace(cached_name, mem_name)))
+        )
+        f.flush()
+        solver.read_btor2(
+            btor_file,
+            tile_name=mem_name,
+            symbols=renumberer.symbols,
+            state_names=renumberer.states,
+            output_names=renumberer.outputs,
+        )
+    solver.btor2_offset = renumberer.max_id
 
     mem_inputs = get_mem_inputs(solver, mem_name)
 
-    return mem_inputs, get_mem_btor_outputs(solver, btor_file)
+    return mem_inputs, get_mem_btor_outputs(solver, mem_name)
+
+
+MEM_TILE_COUNTERS = [
+    "mem_ctrl_stencil_valid_flat.stencil_valid_inst.stencil_valid_sched_gen.addr_out",
+    "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.agg_only.agg_write_sched_gen_0.addr_out",
+    "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.agg_only.agg_write_sched_gen_1.addr_out",
+    "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.sram_tb_shared.output_sched_gen_0.addr_out",
+    "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.sram_tb_shared.output_sched_gen_1.addr_out",
+    "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.tb_only.tb_read_sched_gen_0.addr_out",
+    "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.tb_only.tb_read_sched_gen_1.addr_out",
+    "mem_ctrl_stencil_valid_flat.stencil_valid_inst.loops_stencil_valid.dim_counter",
+    "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.agg_only.loops_in2buf_0.dim_counter",
+    "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.agg_only.loops_in2buf_1.dim_counter",
+    "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.sram_tb_shared.loops_buf2out_autovec_read_0.dim_counter",
+    "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.sram_tb_shared.loops_buf2out_autovec_read_1.dim_counter",
+    "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.tb_only.loops_buf2out_read_0.dim_counter",
+    "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.tb_only.loops_buf2out_read_1.dim_counter",
+    "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.sram_only.output_addr_gen_0.addr_out",
+    "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.sram_only.output_addr_gen_1.addr_out",
+    "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.tb_only.tb_read_addr_gen_0.addr_out",
+    "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.tb_only.tb_read_addr_gen_1.addr_out",
+    "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.agg_sram_shared.agg_sram_shared_addr_gen_0.lin_addr_cnter",
+    "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.agg_sram_shared.agg_sram_shared_addr_gen_1.lin_addr_cnter",
+    "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.agg_only.agg_write_addr_gen_0.addr_out",
+    "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.agg_only.agg_write_addr_gen_1.addr_out",
+    "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.tb_only.tb_write_addr_gen_0.addr_out",
+    "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.tb_only.tb_write_addr_gen_1.addr_out",
+]
+
+POND_TILE_COUNTERS = [
+    "mem_ctrl_strg_ub_thin_PondTop_flat.strg_ub_thin_PondTop_inst.in2regfile_0_sched_gen.addr_out",
+    "mem_ctrl_strg_ub_thin_PondTop_flat.strg_ub_thin_PondTop_inst.regfile2out_0_sched_gen.addr_out",
+    "mem_ctrl_strg_ub_thin_PondTop_flat.strg_ub_thin_PondTop_inst.in2regfile_0_addr_gen.addr_out",
+    "mem_ctrl_strg_ub_thin_PondTop_flat.strg_ub_thin_PondTop_inst.regfile2out_0_addr_gen.addr_out",
+    "mem_ctrl_strg_ub_thin_PondTop_flat.strg_ub_thin_PondTop_inst.in2regfile_0_for_loop.dim_counter",
+    "mem_ctrl_strg_ub_thin_PondTop_flat.strg_ub_thin_PondTop_inst.regfile2out_0_for_loop.dim_counter",
+]
+
+
+def collect_counters(
+    solver, tile_name, tile_type, symbols_to_collect, start_cycle=None
+):
+    """Per cycle values of the controller signals of a tile.
+
+    Only the cycles from start_cycle (solver.starting_cycle by default) on
+    are kept.
+    """
+    if start_cycle is None:
+        start_cycle = solver.starting_cycle
+
+    if tile_name in solver.counter_traces:
+        return dict(solver.counter_traces.pop(tile_name))
+
+    if solver.counter_backend == "model":
+        return model_counters(
+            tile_type,
+            solver.lake_configs[tile_name],
+            solver.max_cycles,
+            symbols_to_collect,
+            start_cycle,
+        )
+
+    return simulate_counters(
+        solver.app_dir,
+        tile_name,
+        tile_type,
+        solver.max_cycles,
+        symbols_to_collect,
+        solver.counter_backend,
+        solver.cache_dir,
+        start_cycle,
+    )
+
+
+def create_trace_lut(solver, name, trace, elem_sort):
+    # trace[i] is the value of a controller at cycle i
+    idx_sort = solver.create_bvsort(16)
+    start = solver.starting_cycle
+    end = solver.max_cycles
+
+    if solver.lut_encoding == "periodic":
+        # Steady state schedules repeat after a warm-up prefix, only use the
+        # periodic encoding if it needs fewer segments than the affine one
+        periodic = find_period(trace, start, end)
+        if periodic is not None:
+            prefix_end, period = periodic
+            periodic_size = len(affine_segments(trace, start, prefix_end)) + len(
+                affine_segments(trace, prefix_end, prefix_end + period)
+            )
+            if periodic_size < len(affine_segments(trace, start, end)):
+                return solver.create_periodic_lut(
+                    trace, idx_sort, elem_sort, start, end, prefix_end, period
+                )
+
+    if solver.lut_encoding in ("affine", "periodic"):
+        return solver.create_affine_lut(trace, idx_sort, elem_sort, start, end)
+
+    # Only the verified window of the trace is available, cycles outside of
+    # it fall back to the default entry
+    end = min(end, len(trace))
+    lut = [
+        (
+            solver.create_const(i, idx_sort),
+            solver.create_const(int(trace[i]), elem_sort),
+        )
+        for i in range(start, end)
+    ]
+    default = solver.create_const(int(trace[0]), elem_sort)
+
+    return solver.create_lut(
+        name, lut, idx_sort, elem_sort, start, end, first_idx=start, default=default
+    )
 
 
 def mem_tile_constraint_generator(
@@ -358,43 +609,9 @@ def mem_tile_constraint_generator(
     flush_offset=0,
 ):
 
-    symbols_to_collect = [
-        "mem_ctrl_stencil_valid_flat.stencil_valid_inst.stencil_valid_sched_gen.addr_out",
-        "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.agg_only.agg_write_sched_gen_0.addr_out",
-        "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.agg_only.agg_write_sched_gen_1.addr_out",
-        "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.sram_tb_shared.output_sched_gen_0.addr_out",
-        "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.sram_tb_shared.output_sched_gen_1.addr_out",
-        "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.tb_only.tb_read_sched_gen_0.addr_out",
-        "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.tb_only.tb_read_sched_gen_1.addr_out",
-        "mem_ctrl_stencil_valid_flat.stencil_valid_inst.loops_stencil_valid.dim_counter",
-        "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.agg_only.loops_in2buf_0.dim_counter",
-        "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.agg_only.loops_in2buf_1.dim_counter",
-        "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.sram_tb_shared.loops_buf2out_autovec_read_0.dim_counter",
-        "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.sram_tb_shared.loops_buf2out_autovec_read_1.dim_counter",
-        "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.tb_only.loops_buf2out_read_0.dim_counter",
-        "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.tb_only.loops_buf2out_read_1.dim_counter",
-        "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.sram_only.output_addr_gen_0.addr_out",
-        "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.sram_only.output_addr_gen_1.addr_out",
-        "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.tb_only.tb_read_addr_gen_0.addr_out",
-        "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.tb_only.tb_read_addr_gen_1.addr_out",
-        "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.agg_sram_shared.agg_sram_shared_addr_gen_0.lin_addr_cnter",
-        "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.agg_sram_shared.agg_sram_shared_addr_gen_1.lin_addr_cnter",
-        "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.agg_only.agg_write_addr_gen_0.addr_out",
-        "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.agg_only.agg_write_addr_gen_1.addr_out",
-        "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.tb_only.tb_write_addr_gen_0.addr_out",
-        "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst.tb_only.tb_write_addr_gen_1.addr_out",
-    ]
+    addr_out = collect_counters(solver, mem_name, "MemCore_inner", MEM_TILE_COUNTERS)
 
-    addr_out = simulate_counters(
-        solver.app_dir,
-        mem_name,
-        "MemCore_inner",
-        solver.max_cycles,
-        symbols_to_collect,
-    )
-
-
-    garnet_mem_name = mem_name
+    garnet_tile_name = None
     if hasattr(solver, "placement") and mem_name in solver.placement:
         loc = solver.placement[mem_name]
         x = loc[0]
@@ -408,45 +625,33 @@ def mem_tile_constraint_generator(
         if len(y_hex) == 1:
             y_hex = "0" + y_hex
 
-        garnet_mem_name = (
-            f"Tile_X{x_hex}_Y{y_hex}.MemCore_inst0.MemCore_inner_W_inst0.MemCore_inner"
-        )
+        garnet_tile_name = f"Tile_X{x_hex}_Y{y_hex}"
 
     for controller, addr_out_list in addr_out.items():
-        for name, term in solver.fts.named_terms.items():
-            if (
-                controller in name
-                and (mem_name in name or garnet_mem_name in name)
-                and not solver.fts.is_next_var(term)
-            ):
-
-                # print("Adding mem addr out constraint", controller, name)
-                addr_out_type = term.get_sort()
-
-                addr_out_lut = []
-                for i, addr in enumerate(addr_out_list):
-                    addr_out_lut.append(
-                        (
-                            solver.create_const(i, solver.create_bvsort(16)),
-                            solver.create_const(addr, addr_out_type),
-                        )
-                    )
-
-                addr_out_var = solver.create_lut(
-                    f"{mem_name}_{controller}_address_out",
-                    addr_out_lut,
-                    solver.create_bvsort(16),
-                    addr_out_type,
-                    solver.starting_cycle,
-                    solver.max_cycles,
-                )
+        terms = solver.lookup_named_terms(mem_name, controller)
+        if garnet_tile_name is not None:
+            terms = terms + solver.lookup_named_terms(
+                garnet_tile_name,
+                f"MemCore_inst0.MemCore_inner_W_inst0.MemCore_inner.{controller}",
+            )
+
+        for term in terms:
+            if solver.fts.is_next_var(term):
+                continue
+
+            # print("Adding mem addr out constraint", controller, term)
+            addr_out_var = create_trace_lut(
+                solver,
+                f"{mem_name}_{controller}_address_out",
+                addr_out_list,
+                term.get_sort(),
+            )
 
-                solver.fts.add_invar(
-                    solver.create_term(
-                        solver.ops.Equal, term, addr_out_var(solver.cycle_count)
-                    )
+            solver.fts.add_invar(
+                solver.create_term(
+                    solver.ops.Equal, term, addr_out_var(solver.cycle_count)
                 )
-                # break
+            )
 
 
 def mem_tile_get_num_valids(config, cycles, iterator_support=2, address_width=16):
@@ -482,64 +687,47 @@ def mem_tile_get_num_valids(config, cycles, iterator_support=2, address_width=16
     return cycles_to_idx, valids
 
 
+def pond_tile_counters(solver, pond_name, flush_offset=0):
+    """Pond controller traces delayed by the flush_offset cycles it takes the
+    flush to reach the tile."""
+    # The cycles shifted into the verified window have to be collected too
+    addr_out = collect_counters(
+        solver,
+        pond_name,
+        "PondTop",
+        POND_TILE_COUNTERS,
+        max(0, solver.starting_cycle - flush_offset),
+    )
+    return {
+        controller: shift_trace(trace, flush_offset)
+        for controller, trace in addr_out.items()
+    }
+
+
 def pond_tile_constraint_generator(
     solver,
     pond_name,
     flush_offset=0,
 ):
 
-    symbols_to_collect = [
-        "mem_ctrl_strg_ub_thin_PondTop_flat.strg_ub_thin_PondTop_inst.in2regfile_0_sched_gen.addr_out",
-        "mem_ctrl_strg_ub_thin_PondTop_flat.strg_ub_thin_PondTop_inst.regfile2out_0_sched_gen.addr_out",
-        "mem_ctrl_strg_ub_thin_PondTop_flat.strg_ub_thin_PondTop_inst.in2regfile_0_addr_gen.addr_out",
-        "mem_ctrl_strg_ub_thin_PondTop_flat.strg_ub_thin_PondTop_inst.regfile2out_0_addr_gen.addr_out",
-        "mem_ctrl_strg_ub_thin_PondTop_flat.strg_ub_thin_PondTop_inst.in2regfile_0_for_loop.dim_counter",
-        "mem_ctrl_strg_ub_thin_PondTop_flat.strg_ub_thin_PondTop_inst.regfile2out_0_for_loop.dim_counter",
-    ]
-
-    addr_out = simulate_counters(
-        solver.app_dir,
-        pond_name,
-        "PondTop",
-        solver.max_cycles,
-        symbols_to_collect,
-    )
+    addr_out = pond_tile_counters(solver, pond_name, flush_offset)
 
     for controller, addr_out_list in addr_out.items():
-        addr_out[controller] = [0] * flush_offset + addr_out_list
+        for term in solver.lookup_named_terms(pond_name, controller):
+            if solver.fts.is_next_var(term):
+                continue
 
-    for controller, addr_out_list in addr_out.items():
-        for name, term in solver.fts.named_terms.items():
-            if (
-                controller in name
-                and pond_name in name
-                and not solver.fts.is_next_var(term)
-            ):
-
-                # print("Adding pond addr out constraint", controller, name)
-                addr_out_type = term.get_sort()
-
-                addr_out_lut = []
-                for i, addr in enumerate(addr_out_list):
-                    addr_out_lut.append(
-                        (
-                            solver.create_const(i, solver.create_bvsort(16)),
-                            solver.create_const(addr, addr_out_type),
-                        )
-                    )
-
-                addr_out_var = solver.create_lut(
-                    f"{pond_name}_{controller}_address_out",
-                    addr_out_lut,
-                    solver.create_bvsort(16),
-                    addr_out_type,
-                    solver.starting_cycle,
-                    solver.max_cycles,
-                )
+            # print("Adding pond addr out constraint", controller, term)
+            addr_out_var = create_trace_lut(
+                solver,
+                f"{pond_name}_{controller}_address_out",
+                addr_out_list,
+                term.get_sort(),
+            )
 
-                solver.fts.add_invar(
-                    solver.create_term(
-                        solver.ops.Equal, term, addr_out_var(solver.cycle_count)
-                    )
+            solver.fts.add_invar(
+                solver.create_term(
+                    solver.ops.Equal, term, addr_out_var(solver.cycle_count)
                 )
-                break
+            )
+            break
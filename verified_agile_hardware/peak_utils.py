@@ -10,11 +10,36 @@ from peak.mapper.utils import (
 from peak.family import _RegFamily, SMTFamily
 from peak.black_box import BlackBox
 from collections import defaultdict
+from functools import lru_cache
 import pysmt
+import smt_switch as ss
 import pysmt.shortcuts as smt
 from pysmt.typing import BVType, BOOL
 from lassen import PE_fc, Inst_fc
+import inspect
+import json
 import os
+import types
+from verified_agile_hardware.cache_utils import (
+    cache_read,
+    cache_write,
+    hash_key,
+    package_version,
+)
+from verified_agile_hardware.float_utils import bfloat16_add, bfloat16_mul
+from verified_agile_hardware.solver import ConstantFolder, term_value
+from verified_agile_hardware.smtlib_utils import smtlib_to_terms, terms_to_smtlib
+
+# Symbols of templates loaded from disk are renamed so they never clash with
+# symbols of the design
+PE_TEMPLATE_PREFIX = "pe_template."
+
+# Concrete semantics of black boxes on integer bit patterns, used to refine
+# their uninterpreted functions, see refine_bboxes
+BBOX_SEMANTICS = {
+    "CW_fp_add": lambda a, b: (bfloat16_add(a, b),),
+    "CW_fp_mult": lambda a, b: (bfloat16_mul(a, b),),
+}
 
 
 def get_aadt(T):
@@ -59,26 +84,25 @@ def make_freevar(x):
 
 
 def get_pe_inputs(solver, pe_name):
-    input_vars = []
-    for i in solver.fts.inputvars:
-        if pe_name in str(i):
-            input_vars.append(i)
-
-    input_vars = sorted(input_vars, key=lambda x: str(x))
-    return input_vars
+    return list(solver.get_tile_vars(pe_name, "inputs").values())
 
 
 def get_pe_state(solver, pe_name):
-    state_vars = []
-    for i in solver.fts.statevars:
-        if pe_name in str(i):
-            state_vars.append(i)
+    """State vars of the PE, including the inputs promoted to state vars."""
+    state_vars = solver.get_tile_vars(pe_name, "states")
+    for name, var in solver.get_tile_vars(pe_name, "inputs").items():
+        if var in solver.promoted_inputs:
+            state_vars[name] = var
+    return [var for _, var in sorted(state_vars.items())]
 
-    state_vars = sorted(state_vars, key=lambda x: str(x))
-    return state_vars
 
+@lru_cache(maxsize=None)
+def symbolic_pe(PE_fc):
+    """Symbolically execute PE_fc once per process with a free instruction.
 
-def load_pe_tile(solver, PE_fc, pe_instr, pe_name="", out_port_names=()):
+    Returns the pysmt level inputs, outputs, registers before and after the
+    step and the black box (inputs, outputs) by black box type.
+    """
     PE_smt = PE_fc(family.SMTFamily())
 
     pe = PE_smt()
@@ -90,11 +114,6 @@ def load_pe_tile(solver, PE_fc, pe_instr, pe_name="", out_port_names=()):
     recursive_filter_fc(pe, is_bbox, set_bbox_outputs)
 
     inputs = create_input(PE_smt.input_t)
-
-    instr = inputs["inst"]._assembler_.disassemble(pe_instr)
-
-    AsmInst = SMTFamily().get_adt_t(Inst_fc.Py)
-    inputs["inst"] = AsmInst(**instr.value_dict)
     outputs = pe(**inputs)
 
     bboxes = defaultdict(list)
@@ -111,83 +130,415 @@ def load_pe_tile(solver, PE_fc, pe_instr, pe_name="", out_port_names=()):
     aadt = get_aadt(PE_fc.Py.output_t)
     output_val = aadt.from_fields(*outputs)
 
-    mapping = {}
+    return inputs, output_val, regs, regs_next, dict(bboxes)
+
+
+class PETemplate:
+    """smt-switch terms of a symbolically executed PE.
+
+    Instances are created by substituting fresh variables for the inputs,
+    registers and black box outputs and a constant for the instruction.
+    names holds the name of each register and black box output, instance
+    variables are named after it.
+    """
+
+    def __init__(self, inputs, inst, output, regs, bboxes, names):
+        self.inputs = inputs
+        self.inst = inst
+        self.output = output
+        self.regs = regs
+        self.bboxes = bboxes
+        self.names = names
+
+    @classmethod
+    def from_pe(cls, solver, PE_fc):
+        inputs, output_val, regs, regs_next, bboxes = symbolic_pe(PE_fc)
+
+        template_inputs = {}
+        inst = None
+        for name, val in inputs.items():
+            if hasattr(val, "_value_"):
+                inst = solver.convert(val._value_.value)
+            else:
+                template_inputs[name] = solver.convert(val.value)
+
+        output = solver.convert(output_val._value_.value)
+
+        template_regs = [
+            (solver.convert(reg.value), solver.convert(reg_next.value))
+            for reg, reg_next in zip(regs, regs_next)
+        ]
+
+        def as_tuple(x):
+            return x if isinstance(x, tuple) else (x,)
+
+        # Black boxes are keyed by type name so templates loaded from disk match
+        template_bboxes = {}
+        for bbox_type, op_bboxes in bboxes.items():
+            template_bboxes[bbox_type.__name__] = [
+                (
+                    tuple(solver.convert(x.value) for x in as_tuple(ins)),
+                    tuple(solver.convert(x.value) for x in as_tuple(outs)),
+                )
+                for ins, outs in op_bboxes
+            ]
+
+        names = {reg: repr(reg) for reg, _ in template_regs}
+        for op_bboxes in template_bboxes.values():
+            for _, outs in op_bboxes:
+                names.update((out, repr(out)) for out in outs)
+
+        return cls(template_inputs, inst, output, template_regs, template_bboxes, names)
+
+    def roots(self):
+        """Every term of the template that instances refer to."""
+        roots = list(self.inputs.values()) + [self.output]
+        if self.inst is not None:
+            roots.append(self.inst)
+        for reg, reg_next in self.regs:
+            roots += [reg, reg_next]
+        for op_bboxes in self.bboxes.values():
+            for ins, outs in op_bboxes:
+                roots += list(ins) + list(outs)
+        return roots
+
+    def node_count(self):
+        return len(dag_nodes(self.roots()))
+
+    def num_bboxes(self):
+        return sum(len(op_bboxes) for op_bboxes in self.bboxes.values())
+
+    def to_smtlib(self):
+        """Serialize the template as an SMT-LIB2 script and json metadata."""
+        roots = self.roots()
+        smtlib, root_ids = terms_to_smtlib(roots)
+        ids = dict(zip(roots, root_ids))
+
+        metadata = {
+            "inputs": {name: ids[x] for name, x in self.inputs.items()},
+            "inst": None if self.inst is None else ids[self.inst],
+            "output": ids[self.output],
+            "regs": [[ids[reg], ids[reg_next]] for reg, reg_next in self.regs],
+            "bboxes": {
+                bbox_type: [
+                    [[ids[x] for x in ins], [ids[x] for x in outs]]
+                    for ins, outs in op_bboxes
+                ]
+                for bbox_type, op_bboxes in self.bboxes.items()
+            },
+            "names": {ids[x]: name for x, name in self.names.items()},
+        }
+        return smtlib, json.dumps(metadata)
+
+    @classmethod
+    def from_smtlib(cls, solver, smtlib, metadata):
+        """Rebuild a template written by to_smtlib in solver."""
+        terms = smtlib_to_terms(solver.solver, smtlib, PE_TEMPLATE_PREFIX)
+        metadata = json.loads(metadata)
+
+        inputs = {name: terms[i] for name, i in metadata["inputs"].items()}
+        inst = None if metadata["inst"] is None else terms[metadata["inst"]]
+        regs = [(terms[reg], terms[reg_next]) for reg, reg_next in metadata["regs"]]
+        bboxes = {
+            bbox_type: [
+                (tuple(terms[i] for i in ins), tuple(terms[i] for i in outs))
+                for ins, outs in op_bboxes
+            ]
+            for bbox_type, op_bboxes in metadata["bboxes"].items()
+        }
+        names = {terms[int(i)]: name for i, name in metadata["names"].items()}
+        return cls(inputs, inst, terms[metadata["output"]], regs, bboxes, names)
+
+
+def dag_nodes(terms, nodes=None):
+    """Add the nodes of the term DAG below terms to nodes and return it."""
+    nodes = set() if nodes is None else nodes
+    stack = [t for t in terms if t not in nodes]
+    while stack:
+        term = stack.pop()
+        if term in nodes:
+            continue
+        nodes.add(term)
+        stack.extend(c for c in term if c not in nodes)
+    return nodes
+
+
+def specialize_pe_template(solver, template, pe_instr):
+    """Partially evaluate template for the constant instruction pe_instr.
+
+    The instruction is substituted and constant folded through the output
+    and register updates, which collapses the opcode muxes to the selected
+    datapath. Black boxes whose outputs no longer reach the output, a
+    register update or a kept black box are dropped.
+    """
+    substitutions = {}
+    if template.inst is not None:
+        substitutions[template.inst] = solver.create_const(
+            int(pe_instr), template.inst.get_sort()
+        )
+    folder = ConstantFolder(solver, substitutions)
+
+    output = folder.fold(template.output)
+    regs = [(reg, folder.fold(reg_next)) for reg, reg_next in template.regs]
+    live = dag_nodes([output] + [reg_next for _, reg_next in regs])
+
+    # Keeping a black box makes its inputs live, which can keep others
+    kept = {}
+    changed = True
+    while changed:
+        changed = False
+        for bbox_type, op_bboxes in template.bboxes.items():
+            for idx, (ins, outs) in enumerate(op_bboxes):
+                if (bbox_type, idx) in kept or not any(out in live for out in outs):
+                    continue
+                ins = tuple(folder.fold(x) for x in ins)
+                kept[bbox_type, idx] = (ins, outs)
+                dag_nodes(ins, live)
+                changed = True
+
+    bboxes = {}
+    for bbox_type, op_bboxes in template.bboxes.items():
+        op_kept = [
+            kept[bbox_type, i] for i in range(len(op_bboxes)) if (bbox_type, i) in kept
+        ]
+        if op_kept:
+            bboxes[bbox_type] = op_kept
+
+    return PETemplate(template.inputs, None, output, regs, bboxes, template.names)
+
+
+def get_pe_specialization(solver, PE_fc, pe_instr):
+    key = (PE_fc, int(pe_instr))
+    if key not in solver.pe_specializations:
+        template = get_pe_template(solver, PE_fc)
+        solver.pe_specializations[key] = specialize_pe_template(
+            solver, template, pe_instr
+        )
+    return solver.pe_specializations[key]
+
+
+def pe_specialization_report(solver):
+    """Node and black box counts of every PE template before and after
+    specialization to the instructions of the design."""
+    lines = []
+    for (PE_fc, pe_instr), specialized in solver.pe_specializations.items():
+        template = solver.pe_templates[PE_fc]
+        lines.append(
+            f"PE instruction {pe_instr:#x}: "
+            f"{template.node_count()} -> {specialized.node_count()} nodes, "
+            f"{template.num_bboxes()} -> {specialized.num_bboxes()} black boxes"
+        )
+    return "\n".join(lines)
+
+
+def closure_function(PE_fc):
+    """The function wrapped by a family_closure, PE_fc if it is a function."""
+    if isinstance(PE_fc, types.FunctionType):
+        return PE_fc
+    for value in getattr(PE_fc, "__dict__", {}).values():
+        if isinstance(value, types.FunctionType):
+            return value
+    return None
+
+
+def pe_template_key(PE_fc):
+    """Disk cache key of the template of PE_fc, None if it cannot be keyed.
+
+    The key holds the module, name and source of the family closure
+    function and the lassen and peak versions, so it is stable across
+    processes and changes with the PE definition.
+    """
+    fc = closure_function(PE_fc)
+    if fc is None:
+        return None
+    try:
+        source = inspect.getsource(fc)
+    except (OSError, TypeError):
+        return None
+    return hash_key(
+        "pe_template",
+        fc.__module__,
+        fc.__qualname__,
+        source,
+        package_version("lassen"),
+        package_version("peak"),
+    )
+
+
+def get_pe_template(solver, PE_fc):
+    if PE_fc in solver.pe_templates:
+        return solver.pe_templates[PE_fc]
+
+    key = pe_template_key(PE_fc)
+    cache_dir = None if key is None else solver.cache_dir
+    smtlib = cache_read(cache_dir, key, "pe.smt2")
+    metadata = cache_read(cache_dir, key, "pe.json")
+
+    if smtlib is not None and metadata is not None:
+        template = PETemplate.from_smtlib(solver, smtlib, metadata)
+    else:
+        template = PETemplate.from_pe(solver, PE_fc)
+        if cache_dir is not None:
+            smtlib, metadata = template.to_smtlib()
+            cache_write(cache_dir, key, "pe.smt2", smtlib)
+            cache_write(cache_dir, key, "pe.json", metadata)
+
+    solver.pe_templates[PE_fc] = template
+    return template
 
-    for name, val in inputs.items():
-        if hasattr(val, "_value_"):
-            converted_in = solver.convert(val._value_.value)
-        else:
-            converted_in = solver.convert(val.value)
 
-            mapping[converted_in] = solver.fts.make_inputvar(
-                f"{name}_{pe_name}", converted_in.get_sort()
-            )
+def load_pe_tile(solver, PE_fc, pe_instr, pe_name="", out_port_names=()):
+    if solver.specialize_pes:
+        template = get_pe_specialization(solver, PE_fc, pe_instr)
+    else:
+        template = get_pe_template(solver, PE_fc)
+
+    mapping = {}
+    if template.inst is not None:
+        mapping[template.inst] = solver.create_const(
+            int(pe_instr), template.inst.get_sort()
+        )
 
-    o = solver.convert(output_val._value_.value)
+    for name, converted_in in template.inputs.items():
+        mapping[converted_in] = solver.fts.make_inputvar(
+            f"{name}_{pe_name}", converted_in.get_sort()
+        )
+        solver.add_tile_var(pe_name, "inputs", mapping[converted_in])
 
     # make pono statevars for all registers
-    for reg in regs:
-        reg = solver.convert(reg.value)
-        statevar = solver.fts.make_statevar(f"{repr(reg)}_{pe_name}", reg.get_sort())
+    for reg, _ in template.regs:
+        statevar = solver.fts.make_statevar(
+            f"{template.names[reg]}_{pe_name}", reg.get_sort()
+        )
+        solver.add_tile_var(pe_name, "states", statevar)
         mapping[reg] = statevar
 
     # make pono inputvars for all black box outputs
-    for op_bboxes in list(bboxes.values()):
-        for bbox in op_bboxes:
-            outs = bbox[1]
-            if not isinstance(outs, tuple):
-                outs = (outs,)
-
+    for op_bboxes in template.bboxes.values():
+        for _, outs in op_bboxes:
             for out in outs:
-                out = solver.convert(out.value)
                 inputvar = solver.fts.make_inputvar(
-                    f"{repr(out)}_{pe_name}", out.get_sort()
+                    f"{template.names[out]}_{pe_name}", out.get_sort()
                 )
+                solver.add_tile_var(pe_name, "inputs", inputvar)
                 mapping[out] = inputvar
 
-    # solver.convert black box inputs/outputs to corresponding pono/smt-switch terms
-    for op_bboxes in list(bboxes.values()):
-        for idx in range(len(op_bboxes)):
-            ins, outs = op_bboxes[idx]
-            if not isinstance(ins, tuple):
-                ins = (ins,)
-            if not isinstance(outs, tuple):
-                outs = (outs,)
-
-            ins = tuple(
-                [
-                    solver.solver.substitute(solver.convert(x.value), mapping)
-                    for x in ins
-                ]
-            )
-            outs = tuple(
-                [
-                    solver.solver.substitute(solver.convert(x.value), mapping)
-                    for x in outs
-                ]
-            )
-
-            op_bboxes[idx] = (ins, outs)
+    # bind the black box inputs/outputs to this instance
+    bboxes = defaultdict(list)
+    for bbox_type, op_bboxes in template.bboxes.items():
+        for ins, outs in op_bboxes:
+            ins = tuple(solver.solver.substitute(x, mapping) for x in ins)
+            outs = tuple(solver.solver.substitute(x, mapping) for x in outs)
+            bboxes[bbox_type].append((ins, outs))
+            solver.bboxes.setdefault(bbox_type, []).append((ins, outs))
 
     # set pono register next values
-    for reg, reg_next in zip(regs, regs_next):
-        reg = solver.convert(reg.value)
-        reg_next = solver.convert(reg_next.value)
+    for reg, reg_next in template.regs:
         reg_next = solver.solver.substitute(reg_next, mapping)
         intermediate_reg = solver.fts.make_statevar(
             str(mapping[reg]) + "_intermediate", reg.get_sort()
         )
+        solver.add_tile_var(pe_name, "states", intermediate_reg)
         solver.fts.assign_next(intermediate_reg, reg_next)
         solver.fts.assign_next(mapping[reg], intermediate_reg)
 
-    # for port, out in outputs:
-    #     outputs[port] = solver.solver.substitute(out, mapping)
-
-    o = solver.solver.substitute(o, mapping)
+    o = solver.solver.substitute(template.output, mapping)
 
     pe_inputs = get_pe_inputs(solver, pe_name)
 
     for input_var in pe_inputs:
-        solver.fts.promote_inputvar(input_var)
+        solver.promote_inputvar(input_var)
 
     return o, bboxes, pe_inputs
+
+
+def bbox_functions(solver, bbox_type, ins, outs):
+    """Uninterpreted functions, one per output, shared by all black boxes of
+    bbox_type in every PE and frame."""
+    if bbox_type not in solver.bbox_functions:
+        domain = [x.get_sort() for x in ins]
+        solver.bbox_functions[bbox_type] = [
+            solver.solver.make_symbol(
+                f"{bbox_type}_{i}",
+                solver.solver.make_sort(
+                    ss.sortkinds.FUNCTION, domain + [out.get_sort()]
+                ),
+            )
+            for i, out in enumerate(outs)
+        ]
+    return solver.bbox_functions[bbox_type]
+
+
+def bbox_constraints(solver, k):
+    """Constraints binding the black box outputs at frame k to the functions
+    of their type, empty unless solver.bbox_abstraction is set.
+
+    The black box outputs of load_pe_tile are unconstrained inputs, so
+    whoever unrolls the transition system asserts these for every frame k
+    next to fts.trans, and calls refine_bboxes on a counterexample.
+    """
+    if not solver.bbox_abstraction:
+        return []
+
+    constraints = []
+    for bbox_type, op_bboxes in solver.bboxes.items():
+        for ins, outs in op_bboxes:
+            funcs = bbox_functions(solver, bbox_type, ins, outs)
+            ins_k = [solver.ur.at_time(x, k) for x in ins]
+            for func, out in zip(funcs, outs):
+                constraints.append(
+                    solver.create_term(
+                        solver.ops.Equal,
+                        solver.ur.at_time(out, k),
+                        solver.create_term(solver.ops.Apply, func, *ins_k),
+                    )
+                )
+    return constraints
+
+
+def refine_bboxes(solver, frames):
+    """Refine black box functions where the current model contradicts their
+    concrete semantics in BBOX_SEMANTICS.
+
+    For every such application at the given frames, the function is fixed
+    to its concrete result at these input values. Returns the number of
+    lemmas asserted, 0 means the counterexample does not depend on the
+    abstraction.
+    """
+    lemmas = {}
+    for bbox_type, op_bboxes in solver.bboxes.items():
+        semantics = BBOX_SEMANTICS.get(bbox_type)
+        if semantics is None:
+            continue
+
+        for ins, outs in op_bboxes:
+            funcs = bbox_functions(solver, bbox_type, ins, outs)
+            for k in frames:
+                in_vals = tuple(
+                    term_value(solver.solver.get_value(solver.ur.at_time(x, k)))
+                    for x in ins
+                )
+                out_vals = tuple(
+                    term_value(solver.solver.get_value(solver.ur.at_time(x, k)))
+                    for x in outs
+                )
+                expected = semantics(*in_vals)
+                if out_vals == expected or (bbox_type, in_vals) in lemmas:
+                    continue
+
+                args = [
+                    solver.create_const(v, x.get_sort()) for v, x in zip(in_vals, ins)
+                ]
+                lemmas[bbox_type, in_vals] = [
+                    solver.create_term(
+                        solver.ops.Equal,
+                        solver.create_term(solver.ops.Apply, func, *args),
+                        solver.create_const(v, out.get_sort()),
+                    )
+                    for func, v, out in zip(funcs, expected, outs)
+                ]
+
+    for lemma in lemmas.values():
+        for term in lemma:
+            solver.assert_formula(term)
+    return len(lemmas)
@@ -0,0 +1,285 @@
+import bisect
+
+import numpy
+
+
+def affine_segments(values, start=0, end=None):
+    """Split values[start:end] into maximal affine runs.
+
+    Returns a list of (first, last, base, stride) tuples such that
+    values[i] == base + stride * (i - first) for first <= i < last.
+    Affine runs stay affine on any sub range, so taking the longest run
+    from each start point gives the minimum number of segments.
+    """
+    if end is None or end > len(values):
+        end = len(values)
+
+    segments = []
+    i = start
+    while i < end:
+        base = int(values[i])
+        if i + 1 == end:
+            segments.append((i, end, base, 0))
+            break
+
+        stride = int(values[i + 1]) - base
+        j = i + 2
+        while j < end and int(values[j]) - int(values[j - 1]) == stride:
+            j += 1
+
+        segments.append((i, j, base, stride))
+        i = j
+
+    return segments
+
+
+def z_function(values):
+    """z[i] is the length of the longest common prefix of values and values[i:]."""
+    n = len(values)
+    z = [0] * n
+    if n == 0:
+        return z
+
+    z[0] = n
+    left, right = 0, 0
+    for i in range(1, n):
+        if i < right:
+            z[i] = min(right - i, z[i - left])
+        while i + z[i] < n and values[z[i]] == values[i + z[i]]:
+            z[i] += 1
+        if i + z[i] > right:
+            left, right = i, i + z[i]
+
+    return z
+
+
+def find_period(values, start=0, end=None, min_repeats=2):
+    """Find a warm-up prefix and repeating period in values[start:end].
+
+    Returns (prefix_end, period) such that values[i] == values[i + period]
+    for prefix_end <= i < end - period, picking the pair that minimizes the
+    number of entries that have to be stored (prefix plus one period).
+    Returns None if no period repeats at least min_repeats times.
+    """
+    if end is None or end > len(values):
+        end = len(values)
+
+    # A periodic suffix of the window is a periodic prefix of the reversed
+    # window, whose length for period p is p + z[p]
+    window = [int(v) for v in values[start:end]]
+    window.reverse()
+    n = len(window)
+    z = z_function(window)
+
+    best = None
+    for period in range(1, n):
+        if period + z[period] < min_repeats * period:
+            continue
+
+        table_size = n - z[period]
+        if best is None or table_size < best[0]:
+            best = (table_size, period)
+
+    if best is None:
+        return None
+
+    table_size, period = best
+    return start + table_size - period, period
+
+
+def times_to_intervals(times):
+    """Merge a list of times into strided intervals.
+
+    Returns a sorted list of (first, last, stride) tuples that together
+    cover exactly the given times, last is inclusive. Strided runs shorter
+    than three times are split into single points since comparing against
+    each point directly is cheaper than a range and modulo check.
+    """
+    times = sorted(set(int(t) for t in times))
+
+    intervals = []
+    i = 0
+    while i < len(times):
+        if i + 1 == len(times):
+            intervals.append((times[i], times[i], 1))
+            break
+
+        stride = times[i + 1] - times[i]
+        j = i + 2
+        while j < len(times) and times[j] - times[j - 1] == stride:
+            j += 1
+
+        if stride > 1 and j - i < 3:
+            # Leave the next time free to start its own run
+            intervals.append((times[i], times[i], 1))
+            i += 1
+        else:
+            intervals.append((times[i], times[j - 1], stride))
+            i = j
+
+    return intervals
+
+
+class ChangePointTrace:
+    """Per cycle trace stored as the cycles at which its value changes.
+
+    times is an increasing list of cycles starting at 0 and values[i] is the
+    value from times[i] until the next change point. The trace behaves like a
+    read only list of length cycles and only expands to per cycle values
+    when iterated over.
+    """
+
+    def __init__(self, times, values, cycles):
+        self.times = list(times)
+        self.values = list(values)
+        self.cycles = cycles
+        self._expanded = None
+
+    def __len__(self):
+        return self.cycles
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(self.cycles)
+            if step != 1:
+                return self.expand()[idx]
+            return self.window(start, stop)
+
+        if idx < 0:
+            idx += self.cycles
+        if not 0 <= idx < self.cycles:
+            raise IndexError("trace index out of range")
+        if self._expanded is not None:
+            return self._expanded[idx]
+        return self.values[bisect.bisect_right(self.times, idx) - 1]
+
+    def __iter__(self):
+        return iter(self.expand())
+
+    def __eq__(self, other):
+        if isinstance(other, ChangePointTrace):
+            other = other.expand()
+        try:
+            return self.expand() == list(other)
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self):
+        return f"ChangePointTrace({self.times}, {self.values}, {self.cycles})"
+
+    def expand(self):
+        """Per cycle values as a list, computed once."""
+        if self._expanded is None:
+            expanded = []
+            ends = self.times[1:] + [self.cycles]
+            for time, end, value in zip(self.times, ends, self.values):
+                expanded.extend([value] * (end - time))
+            self._expanded = expanded
+        return self._expanded
+
+    def window(self, start, stop):
+        """Trace of cycles start to stop, re-based to start at cycle 0."""
+        stop = max(start, stop)
+        if start >= stop:
+            return ChangePointTrace([], [], 0)
+
+        first = bisect.bisect_right(self.times, start) - 1
+        last = bisect.bisect_left(self.times, stop)
+        times = [0] + [t - start for t in self.times[first + 1 : last]]
+        return ChangePointTrace(times, self.values[first:last], stop - start)
+
+    def map(self, func):
+        """Apply func to each distinct run instead of every cycle."""
+        return ChangePointTrace(self.times, map(func, self.values), self.cycles)
+
+    def delay(self, cycles, fill):
+        """The trace delayed by a number of cycles, starting with fill."""
+        if self.cycles == 0:
+            return ChangePointTrace([], [], 0)
+
+        times = [0]
+        values = [fill]
+        for time, value in zip(self.times, self.values):
+            time += cycles
+            if time >= self.cycles:
+                break
+            if time == times[-1]:
+                values[-1] = value
+            else:
+                times.append(time)
+                values.append(value)
+        return ChangePointTrace(times, values, self.cycles)
+
+    def shift(self, cycles, fill):
+        """The trace with cycles values of fill prepended, see shift_trace."""
+        if cycles == 0:
+            return self
+        times = [0] + [t + cycles for t in self.times]
+        return ChangePointTrace(times, [fill] + self.values, self.cycles + cycles)
+
+
+class TraceWindow:
+    """Trace that only holds the cycles from start on.
+
+    values[i] is the value at cycle start + i, indexing and slicing use
+    absolute cycles. Cycle 0 is kept as first since it is the default entry
+    of the lookup tables, other cycles before start raise an IndexError.
+    """
+
+    def __init__(self, values, start, first):
+        self.values = values
+        self.start = start
+        self.first = first
+
+    def __len__(self):
+        return self.start + len(self.values)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            if start < self.start and start < stop:
+                raise IndexError(
+                    f"Cycle {start} is before the trace window at {self.start}"
+                )
+            return self.values[start - self.start : stop - self.start : step]
+
+        if idx < 0:
+            idx += len(self)
+        if idx >= self.start:
+            return self.values[idx - self.start]
+        if idx == 0:
+            return self.first
+        raise IndexError(f"Cycle {idx} is before the trace window at {self.start}")
+
+    def shift(self, cycles, fill):
+        """Delay the window and its start by cycles, see shift_trace."""
+        if cycles == 0:
+            return self
+        return TraceWindow(self.values, self.start + cycles, fill)
+
+    def __iter__(self):
+        if self.start > 0:
+            raise TypeError("Only the cycles of the trace window can be iterated")
+        return iter(self.values)
+
+
+def trace_window(trace, start):
+    """Keep the cycles of trace from start on, see TraceWindow."""
+    if start <= 0 or len(trace) == 0:
+        return trace
+    start = min(start, len(trace))
+    return TraceWindow(trace[start:], start, trace[0])
+
+
+def shift_trace(trace, cycles, fill=0):
+    """Prepend cycles values of fill to a trace of any representation.
+
+    Unlike ChangePointTrace.delay, the trace grows by cycles so none of its
+    values are dropped.
+    """
+    if hasattr(trace, "shift"):
+        return trace.shift(cycles, fill)
+    if isinstance(trace, numpy.ndarray):
+        fills = numpy.full(cycles, fill, dtype=trace.dtype)
+        return numpy.concatenate((fills, trace))
+    return [fill] * cycles + list(trace)
@@ -1,4 +1,32 @@
+import os
+import shutil
 import subprocess
+import tempfile
+
+import numpy
+
+from verified_agile_hardware.cache_utils import (
+    cache_path,
+    file_digest,
+    hash_key,
+    tool_version,
+)
+from verified_agile_hardware.schedule_utils import (
+    ChangePointTrace,
+    TraceWindow,
+    trace_window,
+)
+
+GARNET_FILENAME = "/aha/garnet/garnet.v"
+
+# Hex digits per signal and cycle in the counter dump, wide enough for the
+# packed dim counters
+COUNTER_DUMP_DIGITS = 24
+
+HEX_DIGIT_VALUES = numpy.full(256, 255, dtype=numpy.uint8)
+HEX_DIGIT_VALUES[numpy.frombuffer(b"0123456789abcdef", dtype=numpy.uint8)] = (
+    numpy.arange(16)
+)
 
 
 class AddresssGeneratorModel:
@@ -37,6 +65,36 @@ class AddresssGeneratorModel:
 
         self.next_dim = curr_dim
 
+    def trace(self, step_cycles, step_dims, cycles):
+        """Address trace when stepping at step_cycles with step_dims.
+
+        step_cycles must be increasing, the addr gen steps at the end of each
+        of these cycles. Matches calling step at every step cycle, without
+        changing the model state.
+        """
+        strides = numpy.array(
+            [self.config[f"strides_{i}"] for i in range(self.iterator_support)] + [0],
+            dtype=numpy.int64,
+        )
+        # The stride of each step is selected by the dim of the previous one
+        next_dims = numpy.concatenate(([self.next_dim], step_dims))
+        offsets = strides[next_dims.astype(numpy.int64)[: len(step_dims)]]
+
+        addrs = numpy.empty(len(offsets) + 1, dtype=numpy.int64)
+        addrs[0] = self.address
+        start = 0
+        limit = 2**self.address_width
+        while start < len(offsets):
+            addrs[start + 1 :] = addrs[start] + numpy.cumsum(offsets[start:])
+            # Wrap to 0 at the first overflow and continue from there
+            overflow = numpy.flatnonzero(addrs[start + 1 :] >= limit)
+            if len(overflow) == 0:
+                break
+            start += overflow[0] + 1
+            addrs[start] = 0
+
+        return change_points(step_cycles, addrs, cycles)
+
 
 class SchedGenModel:
     def __init__(self, name, iterator_support, address_width):
@@ -69,6 +127,31 @@ class SchedGenModel:
     def get_address(self):
         return self.address
 
+    def steps(self, cycles):
+        """Step cycles, addresses and dim counters after each step."""
+        dimensionality = self.config["dimensionality"]
+        ranges = [self.config[f"ranges_{i}"] for i in range(dimensionality)]
+        strides = [
+            self.config.get(f"strides_{i}", 0) for i in range(dimensionality + 1)
+        ]
+        step_cycles, addrs, dims = sched_gen_schedule(
+            self.config["starting_addr"], ranges, strides, cycles
+        )
+
+        # Pad dims to the full iterator support
+        padded = numpy.zeros((len(addrs), self.iterator_support), dtype=numpy.int64)
+        padded[:, :dimensionality] = dims
+        return step_cycles, addrs, padded
+
+    def schedule(self, cycles):
+        """addr_out and dim_out traces and the step cycles from the config."""
+        step_cycles, addrs, dims = self.steps(cycles)
+        return (
+            change_points(step_cycles, addrs, cycles),
+            change_points(step_cycles, dims, cycles),
+            step_cycles,
+        )
+
     def step(self):
 
         curr_dim = 0
@@ -84,12 +167,170 @@ class SchedGenModel:
         self.address = self.address + offset
 
 
-def simulate_mem_tile_counters(
-    config, lake_configs, cycles, iterator_support, address_width=16
+def run_counter_models(
+    sched_gens,
+    addr_gens,
+    sched_gen_to_read_addr_gen,
+    sched_gen_to_write_addr_gen,
+    loops_to_sched_gen,
+    lake_configs,
+    cycles,
 ):
+    """Configure sched and addr gen models from lake_configs and run them.
 
+    Returns per cycle lists of the sched gen addresses, dim counters and the
+    addresses of the read and write addr gens driven by each sched gen.
+    """
     lake_configs_dict = {k: v for (k, v) in lake_configs}
 
+    sched_and_addr_gen_dict = sched_gens.copy()
+    sched_and_addr_gen_dict.update(addr_gens)
+
+    for addr_gen_name, addr_gen in sched_and_addr_gen_dict.items():
+        new_config = {}
+
+        for config_name, lake_config in lake_configs:
+            if addr_gen_name in config_name:
+                new_config[config_name.split(addr_gen_name + "_")[1]] = lake_config
+
+            if (
+                addr_gen_name in loops_to_sched_gen
+                and loops_to_sched_gen[addr_gen_name] in config_name
+            ):
+                new_config[
+                    config_name.split(loops_to_sched_gen[addr_gen_name] + "_")[1]
+                ] = lake_config
+
+        addr_gen.set_config(new_config)
+
+    addr_out = {}
+    dim_out = {}
+    read_addr_out = {}
+    write_addr_out = {}
+
+    for controller_name, controller in sched_gens.items():
+        step_cycles, addrs, dims = controller.steps(cycles)
+        addr_out[controller_name] = change_points(step_cycles, addrs, cycles)
+        dim_out[controller_name] = change_points(step_cycles, dims, cycles)
+
+        # Addr gens step with the sched gen, curr_dim is the first dim whose
+        # counter equals the loop range before the step
+        step_dims = numpy.zeros(len(step_cycles), dtype=numpy.int64)
+        if controller_name in loops_to_sched_gen:
+            loop_name = loops_to_sched_gen[controller_name]
+            dimensionality = loop_name + "_dimensionality"
+
+            if dimensionality in lake_configs_dict:
+                step_dim_cnt = dims[: len(step_cycles)]
+                found = numpy.zeros(len(step_cycles), dtype=bool)
+                for dim in range(lake_configs_dict[dimensionality]):
+                    extent = lake_configs_dict[loop_name + "_ranges_" + str(dim)]
+                    match = ~found & (step_dim_cnt[:, dim] == extent)
+                    step_dims[match] = dim + 1
+                    found |= match
+
+        if controller_name in sched_gen_to_read_addr_gen:
+            read_controller = sched_gen_to_read_addr_gen[controller_name]
+            read_steps = numpy.ones(len(step_cycles), dtype=bool)
+            if "agg_sram_shared_addr_gen" in read_controller.name:
+                # agg sram shared addr gen is a special case
+                # Only steps if the last 2 bits of the agg only sched gen address are 3
+                read_steps = step_cycles & 0b11 == 3
+            read_addr_out[controller_name] = read_controller.trace(
+                step_cycles[read_steps], step_dims[read_steps], cycles
+            )
+
+        if controller_name in sched_gen_to_write_addr_gen:
+            write_controller = sched_gen_to_write_addr_gen[controller_name]
+            write_addr_out[controller_name] = write_controller.trace(
+                step_cycles, step_dims, cycles
+            )
+
+    return addr_out, dim_out, read_addr_out, write_addr_out
+
+
+def mixed_radix_digits(counts, extents, num_digits):
+    """Digits of counts in the mixed radix given by extents, lowest first."""
+    counts = numpy.asarray(counts, dtype=numpy.int64)
+    digits = numpy.zeros((len(counts), num_digits), dtype=numpy.int64)
+    period = 1
+    for d, extent in enumerate(extents):
+        # Digits whose period exceeds every count stay zero
+        if period > counts.max(initial=0):
+            break
+        digits[:, d] = (counts // period) % extent
+        period *= extent
+    return digits
+
+
+def sched_gen_schedule(starting_addr, ranges, strides, cycles):
+    """Closed form of the steps of a SchedGenModel within cycles.
+
+    ranges and strides hold the configured dimensions. The sched gen steps
+    whenever the cycle equals its address, step k applies the stride of the
+    number of dimensions that wrap, i.e. that have a period dividing k.
+    Returns the cycles the sched gen steps at, and its addresses and dim
+    counters after 0, 1, ... steps. Steps are generated in growing chunks,
+    so the cost scales with the number of steps instead of cycles.
+    """
+    extents = [int(r) + 2 for r in ranges]
+    stride_table = numpy.zeros(len(extents) + 1, dtype=numpy.int64)
+    stride_table[: len(strides)] = strides[: len(extents) + 1]
+
+    # The sched gen stalls for good once its address stops increasing
+    # or runs past the last cycle
+    chunks = [numpy.array([starting_addr], dtype=numpy.int64)]
+    valid = 0 <= starting_addr < cycles
+    first_step, chunk_size = 1, 64
+    while valid and first_step <= cycles:
+        steps = numpy.arange(
+            first_step, min(first_step + chunk_size, cycles + 1), dtype=numpy.int64
+        )
+
+        # Dimension of the stride applied by each step
+        curr_dim = numpy.zeros(len(steps), dtype=numpy.int64)
+        period = 1
+        for extent in extents:
+            period *= extent
+            if period > steps[-1]:
+                break
+            curr_dim += steps % period == 0
+
+        prev = chunks[-1][-1]
+        addrs = prev + numpy.cumsum(stride_table[curr_dim])
+        valid_steps = (addrs >= 0) & (addrs < cycles)
+        valid_steps[0] &= addrs[0] > prev
+        valid_steps[1:] &= addrs[1:] > addrs[:-1]
+        valid = valid_steps.all()
+        if not valid:
+            # Keep the address of the last step, it never fires again
+            addrs = addrs[: numpy.argmin(valid_steps) + 1]
+
+        chunks.append(addrs)
+        first_step += len(steps)
+        chunk_size *= 2
+
+    # addrs[k] is the address after k steps
+    addrs = numpy.concatenate(chunks)
+    step_cycles = addrs[:-1]
+    dims = mixed_radix_digits(numpy.arange(len(addrs)), extents, len(extents))
+
+    return step_cycles, addrs, dims
+
+
+def change_points(step_cycles, values, cycles):
+    """ChangePointTrace of a value that changes to values[k] after step k."""
+    times = [0] + (numpy.asarray(step_cycles) + 1).tolist()
+    # A step in the last cycle is not visible
+    if times[-1] >= cycles:
+        times.pop()
+    return ChangePointTrace(times, values[: len(times)].tolist(), cycles)
+
+
+def simulate_mem_tile_counters(
+    config, lake_configs, cycles, iterator_support, address_width=16
+):
+
     # So in order to get the valid starting address, dim count, read address, and write address, we need to run the
     # SchedGenModel for a number of cycles and record the outputs at each cycle
 
@@ -258,103 +499,15 @@ def simulate_mem_tile_counters(
     )
     loops_to_sched_gen["stencil_valid_sched_gen_sched_addr_gen"] = "loops_stencil_valid"
 
-    sched_and_addr_gen_dict = sched_gens.copy()
-    sched_and_addr_gen_dict.update(addr_gens)
-
-    for addr_gen_name, addr_gen in sched_and_addr_gen_dict.items():
-        new_config = {}
-
-        for config_name, lake_config in lake_configs:
-            if addr_gen_name in config_name:
-                new_config[config_name.split(addr_gen_name + "_")[1]] = lake_config
-
-            if (
-                addr_gen_name in loops_to_sched_gen
-                and loops_to_sched_gen[addr_gen_name] in config_name
-            ):
-                new_config[
-                    config_name.split(loops_to_sched_gen[addr_gen_name] + "_")[1]
-                ] = lake_config
-
-        addr_gen.set_config(new_config)
-
-    addr_out = {}
-    dim_out = {}
-    read_addr_out = {}
-    write_addr_out = {}
-
-    for controller_name in sched_gens:
-        addr_out[controller_name] = []
-        dim_out[controller_name] = []
-
-        if controller_name in sched_gen_to_read_addr_gen:
-            read_addr_out[controller_name] = []
-
-        if controller_name in sched_gen_to_write_addr_gen:
-            write_addr_out[controller_name] = []
-
-    for cycle in range(cycles):
-        # Collect outputs
-        for controller_name, controller in sched_gens.items():
-            addr_out[controller_name].append(controller.get_address())
-            dim_out[controller_name].append(controller.dim_cnt.copy())
-
-            # read address gen
-            if controller_name in sched_gen_to_read_addr_gen:
-                read_controller = sched_gen_to_read_addr_gen[controller_name]
-                read_addr_out[controller_name].append(read_controller.get_address())
-
-            # write address gen
-            if controller_name in sched_gen_to_write_addr_gen:
-                write_controller = sched_gen_to_write_addr_gen[controller_name]
-                write_addr_out[controller_name].append(write_controller.get_address())
-
-        # Step all controllers
-        for controller_name, controller in sched_gens.items():
-
-            step_controller = cycle == controller.get_address()
-
-            if step_controller:
-
-                curr_dim = 0
-
-                if controller_name in loops_to_sched_gen:
-                    loop_name = loops_to_sched_gen[controller_name]
-
-                    dimensionality = loop_name + "_dimensionality"
-
-                    if dimensionality in lake_configs_dict:
-                        extents = []
-                        for dim in range(lake_configs_dict[dimensionality]):
-                            r = loop_name + "_ranges_" + str(dim)
-                            extent = lake_configs_dict[r]
-
-                            if controller.dim_cnt[dim] == extent:
-                                curr_dim = dim + 1
-                                break
-
-                if controller_name in sched_gen_to_read_addr_gen:
-                    read_controller = sched_gen_to_read_addr_gen[controller_name]
-                    if (
-                        "agg_sram_shared_addr_gen"
-                        not in sched_gen_to_read_addr_gen[controller_name].name
-                    ):
-                        read_controller.step(curr_dim)
-                    else:
-                        # agg sram shared addr gen is a special case
-                        # Only steps if the last 2 bits of the agg only sched gen address are 0
-                        # Get last two bits of controller.get_address()
-                        last_two_bits = controller.get_address() & 0b11
-                        if last_two_bits == 3:
-                            read_controller.step(curr_dim)
-
-                if controller_name in sched_gen_to_write_addr_gen:
-                    write_controller = sched_gen_to_write_addr_gen[controller_name]
-                    write_controller.step(curr_dim)
-
-                controller.step()
-
-        # Special case
+    addr_out, dim_out, read_addr_out, write_addr_out = run_counter_models(
+        sched_gens,
+        addr_gens,
+        sched_gen_to_read_addr_gen,
+        sched_gen_to_write_addr_gen,
+        loops_to_sched_gen,
+        lake_configs,
+        cycles,
+    )
 
     # There is a pipeline register between the sram_tb_shared sched gen and the tb write addr gen
     # Need to delay this controller write addr by one cycle
@@ -368,33 +521,219 @@ def simulate_mem_tile_counters(
     ]
 
     for controller_name in write_registered_step:
-        write_addr_out[controller_name] = [0] + write_addr_out[controller_name][:-1]
+        write_addr_out[controller_name] = write_addr_out[controller_name].delay(1, 0)
 
     for controller_name in read_registered_step:
-        read_addr_out[controller_name] = [0] + read_addr_out[controller_name][:-1]
+        read_addr_out[controller_name] = read_addr_out[controller_name].delay(1, 0)
 
     return addr_out, dim_out, read_addr_out, write_addr_out
 
 
-def simulate_counters(app_dir, tile_name, tile_type, max_cycles, symbols_to_collect):
+def simulate_pond_tile_counters(lake_configs, cycles, address_width=16):
+    sched_gens = {}
+    addr_gens = {}
+
+    # One write (in2regfile) and one read (regfile2out) port
+    sched_gens["in2regfile_0_sched_gen_sched_addr_gen"] = SchedGenModel(
+        "in2regfile_0_sched_gen",
+        iterator_support=4,
+        address_width=address_width,
+    )
+    sched_gens["regfile2out_0_sched_gen_sched_addr_gen"] = SchedGenModel(
+        "regfile2out_0_sched_gen",
+        iterator_support=4,
+        address_width=address_width,
+    )
+
+    addr_gens["in2regfile_0_addr_gen"] = AddresssGeneratorModel(
+        "in2regfile_0_addr_gen", iterator_support=4, address_width=5
+    )
+    addr_gens["regfile2out_0_addr_gen"] = AddresssGeneratorModel(
+        "regfile2out_0_addr_gen", iterator_support=4, address_width=5
+    )
+
+    sched_gen_to_read_addr_gen = {
+        "regfile2out_0_sched_gen_sched_addr_gen": addr_gens["regfile2out_0_addr_gen"]
+    }
+    sched_gen_to_write_addr_gen = {
+        "in2regfile_0_sched_gen_sched_addr_gen": addr_gens["in2regfile_0_addr_gen"]
+    }
+
+    loops_to_sched_gen = {
+        "in2regfile_0_sched_gen_sched_addr_gen": "in2regfile_0_for_loop",
+        "regfile2out_0_sched_gen_sched_addr_gen": "regfile2out_0_for_loop",
+    }
+
+    return run_counter_models(
+        sched_gens,
+        addr_gens,
+        sched_gen_to_read_addr_gen,
+        sched_gen_to_write_addr_gen,
+        loops_to_sched_gen,
+        lake_configs,
+        cycles,
+    )
+
+
+def mem_tile_model_signals():
+    """Map collected MemCore_inner signals to (model output, sched gen) pairs."""
+    ub = "mem_ctrl_strg_ub_vec_flat.strg_ub_vec_inst"
+    sv = "mem_ctrl_stencil_valid_flat.stencil_valid_inst"
+    stencil_valid = "stencil_valid_sched_gen_sched_addr_gen"
+
+    signals = {
+        f"{sv}.stencil_valid_sched_gen.addr_out": ("addr", stencil_valid),
+        f"{sv}.loops_stencil_valid.dim_counter": ("dim", stencil_valid),
+    }
+
+    for i in range(2):
+        agg = f"agg_only_agg_write_sched_gen_{i}_sched_addr_gen"
+        sram = f"sram_tb_shared_output_sched_gen_{i}_sched_addr_gen"
+        tb = f"tb_only_tb_read_sched_gen_{i}_sched_addr_gen"
+
+        signals[f"{ub}.agg_only.agg_write_sched_gen_{i}.addr_out"] = ("addr", agg)
+        signals[f"{ub}.sram_tb_shared.output_sched_gen_{i}.addr_out"] = ("addr", sram)
+        signals[f"{ub}.tb_only.tb_read_sched_gen_{i}.addr_out"] = ("addr", tb)
+
+        signals[f"{ub}.agg_only.loops_in2buf_{i}.dim_counter"] = ("dim", agg)
+        signals[f"{ub}.sram_tb_shared.loops_buf2out_autovec_read_{i}.dim_counter"] = (
+            "dim",
+            sram,
+        )
+        signals[f"{ub}.tb_only.loops_buf2out_read_{i}.dim_counter"] = ("dim", tb)
+
+        signals[f"{ub}.sram_only.output_addr_gen_{i}.addr_out"] = ("read", sram)
+        signals[f"{ub}.tb_only.tb_read_addr_gen_{i}.addr_out"] = ("read", tb)
+        signals[f"{ub}.agg_sram_shared.agg_sram_shared_addr_gen_{i}.lin_addr_cnter"] = (
+            "read",
+            agg,
+        )
+
+        signals[f"{ub}.agg_only.agg_write_addr_gen_{i}.addr_out"] = ("write", agg)
+        signals[f"{ub}.tb_only.tb_write_addr_gen_{i}.addr_out"] = ("write", sram)
+
+    return signals
+
+
+def pond_tile_model_signals():
+    """Map collected PondTop signals to (model output, sched gen) pairs."""
+    ub = "mem_ctrl_strg_ub_thin_PondTop_flat.strg_ub_thin_PondTop_inst"
+    in2regfile = "in2regfile_0_sched_gen_sched_addr_gen"
+    regfile2out = "regfile2out_0_sched_gen_sched_addr_gen"
+
+    return {
+        f"{ub}.in2regfile_0_sched_gen.addr_out": ("addr", in2regfile),
+        f"{ub}.regfile2out_0_sched_gen.addr_out": ("addr", regfile2out),
+        f"{ub}.in2regfile_0_addr_gen.addr_out": ("write", in2regfile),
+        f"{ub}.regfile2out_0_addr_gen.addr_out": ("read", regfile2out),
+        f"{ub}.in2regfile_0_for_loop.dim_counter": ("dim", in2regfile),
+        f"{ub}.regfile2out_0_for_loop.dim_counter": ("dim", regfile2out),
+    }
+
+
+def pack_dim_counter(dim_cnt, counter_width):
+    # dim_counter is a packed array with dimension 0 in the low bits
+    packed = 0
+    for dim, cnt in enumerate(dim_cnt):
+        packed |= cnt << (counter_width * dim)
+    return packed
+
+
+def model_counters(
+    tile_type, lake_configs, max_cycles, symbols_to_collect, start_cycle=0
+):
+    """Drop-in replacement for simulate_counters built on the lake models."""
+    if tile_type == "MemCore_inner":
+        outputs = simulate_mem_tile_counters(None, lake_configs, max_cycles, 6)
+        signals = mem_tile_model_signals()
+        counter_width = 11
+    elif tile_type == "PondTop":
+        outputs = simulate_pond_tile_counters(lake_configs, max_cycles)
+        signals = pond_tile_model_signals()
+        counter_width = 16
+    else:
+        raise ValueError(f"No counter model for tile type {tile_type}")
+
+    addr_out, dim_out, read_addr_out, write_addr_out = outputs
+    model_outputs = {
+        "addr": addr_out,
+        "dim": dim_out,
+        "read": read_addr_out,
+        "write": write_addr_out,
+    }
+
+    traces = {}
+    for symbol in symbols_to_collect:
+        kind, sched_gen = signals[symbol]
+        trace = model_outputs[kind][sched_gen]
+        if kind == "dim":
+            trace = trace.map(lambda d: pack_dim_counter(d, counter_width))
+        traces[symbol] = trace_window(trace, start_cycle)
+
+    return traces
+
+
+def simulate_counters(
+    app_dir,
+    tile_name,
+    tile_type,
+    max_cycles,
+    symbols_to_collect,
+    backend="iverilog",
+    cache_dir=None,
+    start_cycle=0,
+    garnet_filename=GARNET_FILENAME,
+):
+    return simulate_counters_batch(
+        app_dir,
+        [(tile_name, tile_type, symbols_to_collect)],
+        max_cycles,
+        f"{tile_name}_simulation",
+        backend,
+        cache_dir,
+        start_cycle,
+        garnet_filename,
+    )[tile_name]
+
+
+def counter_testbench(tiles, batch_name):
+    """Verilog testbench dumping the counters of tiles every cycle.
+
+    The number of cycles and the dump file are passed as +cycles and +dump
+    plusargs, so a compiled testbench can be reused. With +start only cycle
+    0 and the cycles from start on are dumped.
+    """
 
-    # First, create a verilog testbench for the tile tile
     tile_tb = f"""
-module {tile_name}_simulation_tb();
+module {batch_name}_tb();
     reg clk;
     reg rst_n;
     reg flush;
-
+"""
+    for tile_name, _, _ in tiles:
+        tile_tb += f"""
     {tile_name} {tile_name}_inst (
         .clk(clk),
         .rst_n(rst_n),
         .flush(flush)
     );
+"""
 
+    tile_tb += f"""
     integer k = 0;
+    integer cycles;
+    integer start;
+    integer fd;
+    reg [8*1024-1:0] dump_filename;
+    reg [{COUNTER_DUMP_DIGITS * 4 - 1}:0] sample;
 
     initial begin
 
+        if (!$value$plusargs("cycles=%d", cycles)) cycles = 0;
+        if (!$value$plusargs("start=%d", start)) start = 0;
+        if (!$value$plusargs("dump=%s", dump_filename)) dump_filename = "counters.hex";
+        fd = $fopen(dump_filename, "w");
+
         clk = 0;
 
         rst_n = 1;
@@ -408,80 +747,220 @@ module {tile_name}_simulation_tb();
 
 
         // Run simulation
-        for(k = 0; k<{max_cycles}; k=k+1)
+        for(k = 0; k<cycles; k=k+1)
         begin
+            if (k == 0 || k >= start)
+            begin
     """
-    for addr in symbols_to_collect:
-        tile_tb += f"""
-        $display({tile_name}_inst.{tile_type}.{addr});
+    for tile_name, tile_type, symbols_to_collect in tiles:
+        for addr in symbols_to_collect:
+            tile_tb += f"""
+                sample = {tile_name}_inst.{tile_type}.{addr};
+                $fwrite(fd, "%h", sample);
         """
 
     tile_tb += f"""
+                $fwrite(fd, "\\n");
+            end
             #10;
         end
 
+        $fclose(fd);
         $finish;
 
     end
-    
+
     always begin
         #5 clk = ~clk;
     end
 endmodule
     """
 
-    # write this to a file
-    with open(f"{app_dir}/{tile_name}_simulation_tb.v", "w") as f:
-        f.write(tile_tb)
+    return tile_tb
 
-    sources = [
-        f"{app_dir}/{tile_name}_simulation_tb.v",
-        f"{app_dir}/{tile_name}_simulation.v",
-        f"/aha/garnet/garnet.v",
-    ]
 
-    vtile_name = tile_name.replace("$", "_")
+def run_simulation_step(cmd, what):
+    # print("Running command", cmd)
+    sim_res = subprocess.run(cmd, capture_output=True, text=True)
+    # check for errors
+    if sim_res.returncode != 0:
+        raise RuntimeError(
+            f"Error running {what} (exit code {sim_res.returncode}):\n"
+            f"{sim_res.stderr}"
+        )
+
+
+def build_iverilog_testbench(app_dir, batch_name, sources):
+    vbatch_name = batch_name.replace("$", "_")
+    binary = f"{app_dir}/{vbatch_name}_tb"
 
     # Run the simulation using icarus
+    cmd = ["iverilog", "-o", binary, *sources, "-s", f"{batch_name}_tb"]
+    run_simulation_step(cmd, "iverilog")
+
+    return binary
+
+
+def build_verilator_testbench(app_dir, batch_name, sources, cache_dir=None):
+    """Compile the testbench with verilator, cached by the hash of its sources.
+
+    The sources contain the tile configurations, and cycles and the dump file
+    are plusargs, so the same binary serves every run of a configuration.
+    This backend is experimental, verilator is 2-state so counters that
+    iverilog samples as x or z read as 0 here.
+    """
+    key = hash_key(
+        "verilator_counters",
+        batch_name,
+        [file_digest(source) for source in sources],
+        tool_version("verilator"),
+    )
+    binary_name = f"V{key[:16]}"
+
+    if cache_dir is not None:
+        binary = cache_path(cache_dir, key, binary_name)
+        if os.path.isfile(binary):
+            return binary
+
+    vbatch_name = batch_name.replace("$", "_")
+    obj_dir = f"{app_dir}/{vbatch_name}_obj_dir"
     cmd = [
-        "iverilog",
+        "verilator",
+        "--binary",
+        "--timing",
+        "-Wno-fatal",
+        "-Wno-lint",
+        "-Wno-style",
+        "--top-module",
+        f"{batch_name}_tb",
+        "--Mdir",
+        obj_dir,
         "-o",
-        f"{app_dir}/{vtile_name}_simulation_tb",
+        binary_name,
         *sources,
-        "-s",
-        f"{tile_name}_simulation_tb",
     ]
+    run_simulation_step(cmd, "verilator")
+    binary = f"{obj_dir}/{binary_name}"
+
+    if cache_dir is not None:
+        # Copy under a temporary name so concurrent runs never see a
+        # partial binary
+        cached = cache_path(cache_dir, key, binary_name)
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        fd, tmp_binary = tempfile.mkstemp(dir=os.path.dirname(cached))
+        os.close(fd)
+        shutil.copy2(binary, tmp_binary)
+        os.replace(tmp_binary, cached)
+        binary = cached
+
+    return binary
+
+
+def simulate_counters_batch(
+    app_dir,
+    tiles,
+    max_cycles,
+    batch_name,
+    backend="iverilog",
+    cache_dir=None,
+    start_cycle=0,
+    garnet_filename=GARNET_FILENAME,
+):
+    """Simulate the counters of several tiles in one testbench.
+
+    tiles is a list of (tile_name, tile_type, symbols_to_collect), the module
+    of each tile is read from {app_dir}/{tile_name}_simulation.v.
+    garnet_filename is only compiled once for all of them. backend is "iverilog" or the
+    experimental "verilator" (see build_verilator_testbench), verilator
+    binaries are cached in cache_dir. Returns a dict
+    mapping each tile_name to its per cycle traces of symbols_to_collect,
+    only the cycles from start_cycle on are kept (see TraceWindow).
+    """
 
-    # print("Running command", cmd)
-    sim_res = subprocess.run(cmd, capture_output=True, text=True)
-    # check for errors
-    if sim_res.returncode != 0:
-        print("Error running iverilog")
-        print(sim_res.stderr)
-        breakpoint()
+    # First, create a verilog testbench instantiating every tile
+    with open(f"{app_dir}/{batch_name}_tb.v", "w") as f:
+        f.write(counter_testbench(tiles, batch_name))
+
+    sources = [f"{app_dir}/{batch_name}_tb.v"]
+    for tile_name, _, _ in tiles:
+        sources.append(f"{app_dir}/{tile_name}_simulation.v")
+    sources.append(garnet_filename)
+
+    if backend == "iverilog":
+        binary = build_iverilog_testbench(app_dir, batch_name, sources)
+    elif backend == "verilator":
+        binary = build_verilator_testbench(app_dir, batch_name, sources, cache_dir)
+    else:
+        raise ValueError(f"Unknown counter simulation backend {backend}")
 
     # Run the simulation
-    cmd = [f"{app_dir}/{vtile_name}_simulation_tb"]
-    # print("Running command", cmd)
-    sim_res = subprocess.run(cmd, capture_output=True, text=True)
+    dump_filename = f"{app_dir}/{batch_name}_counters.hex"
+    cmd = [
+        binary,
+        f"+cycles={max_cycles}",
+        f"+start={start_cycle}",
+        f"+dump={dump_filename}",
+    ]
+    run_simulation_step(cmd, "testbench")
 
-    # check for errors
-    if sim_res.returncode != 0:
-        print("Error running testbench")
-        print(sim_res.stderr)
-        breakpoint()
+    with open(dump_filename, "rb") as f:
+        columns = parse_counter_dump(f.read(), sum(len(t[2]) for t in tiles))
 
-    sim_res = sim_res.stdout.split("\n")
-    sim_res = [s.strip() for s in sim_res if s != ""]
+    # The first row is cycle 0, the rest start at start_cycle
+    if 0 < start_cycle:
+        start = min(start_cycle, max_cycles)
+        columns = [TraceWindow(c[1:], start, c[0]) if len(c) else c for c in columns]
 
-    # Deinterleave sim_res
-    addr_out = {}
+    return demux_counter_columns(columns, tiles)
 
-    for addr in symbols_to_collect:
-        addr_out[addr] = []
 
-    while sim_res:
-        for addr in symbols_to_collect:
-            addr_out[addr].append(int(sim_res.pop(0)))
+def parse_counter_dump(data, num_signals):
+    """Parse the fixed width hex dump of a counter testbench.
 
-    return addr_out
+    Every cycle is one line holding COUNTER_DUMP_DIGITS hex digits per
+    signal. Returns one array per signal, uint64 if all of its values fit
+    and Python ints otherwise.
+    """
+    row_size = num_signals * COUNTER_DUMP_DIGITS + 1
+    raw = numpy.frombuffer(data, dtype=numpy.uint8)
+    cycles = len(raw) // row_size if num_signals else 0
+    digits = HEX_DIGIT_VALUES[
+        raw[: cycles * row_size].reshape(cycles, row_size)[:, :-1]
+    ].reshape(cycles, num_signals, COUNTER_DUMP_DIGITS)
+
+    if (digits > 15).any():
+        raise ValueError("Counter dump contains undefined values")
+
+    # Fold the digits into the 64 low bits and the bits above them
+    low_digits = 16
+    high = numpy.zeros((cycles, num_signals), dtype=numpy.uint64)
+    low = numpy.zeros((cycles, num_signals), dtype=numpy.uint64)
+    for i in range(COUNTER_DUMP_DIGITS):
+        word = high if i < COUNTER_DUMP_DIGITS - low_digits else low
+        word <<= numpy.uint64(4)
+        word |= digits[:, :, i]
+
+    columns = []
+    for j in range(num_signals):
+        if high[:, j].any():
+            column = numpy.array(
+                [(int(h) << 64) | int(l) for h, l in zip(high[:, j], low[:, j])],
+                dtype=object,
+            )
+        else:
+            column = low[:, j]
+        columns.append(column)
+
+    return columns
+
+
+def demux_counter_columns(columns, tiles):
+    """Split the signal columns of a batched testbench into traces per tile.
+
+    The columns hold the symbols_to_collect of every tile in order.
+    """
+    columns = iter(columns)
+    return {
+        tile_name: {addr: next(columns) for addr in symbols_to_collect}
+        for tile_name, _, symbols_to_collect in tiles
+    }
@@ -0,0 +1,144 @@
+import re
+
+import smt_switch as ss
+
+SMTLIB_TOKEN = re.compile(r"\(|\)|\|[^|]*\||[^\s()|]+")
+
+
+def _primops_by_name():
+    primops = {}
+    for name in dir(ss.primops):
+        if name.startswith("_"):
+            continue
+        primops.setdefault(str(getattr(ss.primops, name)), getattr(ss.primops, name))
+    return primops
+
+
+PRIMOPS = _primops_by_name()
+
+
+def op_to_smtlib(op):
+    name = str(op.prim_op)
+    if op.num_idx == 0:
+        return name
+    indices = [op.idx0, op.idx1][: op.num_idx]
+    return f"(_ {name} {' '.join(str(i) for i in indices)})"
+
+
+def sort_to_smtlib(sort):
+    kind = sort.get_sort_kind()
+    if kind == ss.sortkinds.BOOL or kind == ss.sortkinds.BV:
+        return str(sort)
+    raise ValueError(f"Unsupported sort {sort}")
+
+
+def terms_to_smtlib(terms):
+    """Serialize the DAG of terms into an SMT-LIB2 script.
+
+    Every symbol is declared with declare-fun and every other node becomes
+    one define-fun named t<id>, so shared subterms are written once.
+    Returns the script and the ids of terms.
+    """
+    ids = {}
+    lines = []
+
+    for root in terms:
+        # Iterative post order, PE terms are too deep for recursion
+        stack = [(root, False)]
+        while stack:
+            term, children_done = stack.pop()
+            if term in ids:
+                continue
+
+            leaf = term.is_symbolic_const() or term.is_value()
+            children = [] if leaf else list(term)
+
+            if not children_done and children:
+                stack.append((term, True))
+                stack.extend((c, False) for c in reversed(children) if c not in ids)
+                continue
+
+            node_id = len(ids)
+            sort = sort_to_smtlib(term.get_sort())
+            if term.is_symbolic_const():
+                name = str(term)
+                if not name.startswith("|"):
+                    name = f"|{name}|"
+                lines.append(f"(declare-fun {name} () {sort})")
+                body = name
+            elif term.is_value():
+                body = str(term)
+            else:
+                args = " ".join(f"t{ids[c]}" for c in children)
+                body = f"({op_to_smtlib(term.get_op())} {args})"
+
+            lines.append(f"(define-fun t{node_id} () {sort} {body})")
+            ids[term] = node_id
+
+    return "\n".join(lines) + "\n", [ids[t] for t in terms]
+
+
+def parse_sexpr(text):
+    stack = [[]]
+    for token in SMTLIB_TOKEN.findall(text):
+        if token == "(":
+            stack.append([])
+        elif token == ")":
+            expr = stack.pop()
+            stack[-1].append(expr)
+        else:
+            stack[-1].append(token)
+    return stack[0]
+
+
+def smtlib_to_terms(solver, text, symbol_prefix=""):
+    """Rebuild the terms of a script written by terms_to_smtlib.
+
+    Symbols are created with symbol_prefix prepended to their names.
+    Returns the list of terms indexed by id.
+    """
+
+    def make_sort(expr):
+        if expr == "Bool":
+            return solver.make_sort(ss.sortkinds.BOOL)
+        if isinstance(expr, list) and expr[:2] == ["_", "BitVec"]:
+            return solver.make_sort(ss.sortkinds.BV, int(expr[2]))
+        raise ValueError(f"Unsupported sort {expr}")
+
+    def make_op(expr, num_args):
+        if isinstance(expr, list):
+            _, name, *indices = expr
+            return ss.Op(PRIMOPS[name], *(int(i) for i in indices))
+        if expr == "-":
+            return ss.Op(ss.primops.Negate if num_args == 1 else ss.primops.Minus)
+        return ss.Op(PRIMOPS[expr])
+
+    terms = []
+    symbols = {}
+    for command in parse_sexpr(text):
+        if command[0] == "declare-fun":
+            name, sort = command[1], command[3]
+            symbols[name] = solver.make_symbol(
+                symbol_prefix + name.strip("|"), make_sort(sort)
+            )
+            continue
+
+        assert command[0] == "define-fun", f"Unexpected command {command[0]}"
+        name, _, sort, body = command[1:]
+        assert name == f"t{len(terms)}", f"Unexpected term id {name}"
+
+        if isinstance(body, list):
+            args = [terms[int(arg[1:])] for arg in body[1:]]
+            terms.append(solver.make_term(make_op(body[0], len(args)), *args))
+        elif body in symbols:
+            terms.append(symbols[body])
+        elif body in ("true", "false"):
+            terms.append(solver.make_term(body == "true"))
+        elif body.startswith("#b"):
+            terms.append(solver.make_term(int(body[2:], 2), make_sort(sort)))
+        elif body.startswith("#x"):
+            terms.append(solver.make_term(int(body[2:], 16), make_sort(sort)))
+        else:
+            terms.append(terms[int(body[1:])])
+
+    return terms
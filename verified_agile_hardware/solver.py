@@ -2,34 +2,79 @@ import smt_switch as ss
 import smt_switch.pysmt_frontend as fe
 import pono
 import os
+from verified_agile_hardware.cache_utils import default_cache_dir
+from verified_agile_hardware.schedule_utils import (
+    affine_segments,
+    times_to_intervals,
+)
 
 
 class Solver:
-    def __init__(self, solver_name="btor"):
+    def __init__(self, solver_name="btor", specialize_frames=False):
         self.fe_solver = fe.Solver(solver_name)
         self.solver = self.fe_solver.solver
         self.solver.set_opt("incremental", "true")
         self.solver.set_opt("produce-models", "true")
         self.convert = self.fe_solver.converter.convert
         self.fts = pono.FunctionalTransitionSystem(self.solver)
-        self.ur = pono.Unroller(self.fts)
+        if specialize_frames:
+            self.ur = FrameUnroller(self)
+        else:
+            self.ur = pono.Unroller(self.fts)
         self.ops = ss.primops
         self.sortkinds = ss.sortkinds
         self.module_smt = {}
+        # Black box (inputs, outputs) of all PEs by black box type, filled by
+        # load_pe_tile
         self.bboxes = {}
+        # Model each black box type as one uninterpreted function shared by
+        # all PEs and frames. The constraints are not part of fts, they are
+        # asserted per unrolled frame, see bbox_constraints and refine_bboxes
+        self.bbox_abstraction = True
+        self.bbox_functions = {}
+        # PETemplate by PE family closure, see load_pe_tile
+        self.pe_templates = {}
+        # Substitute the instruction into PEs and fold away the datapaths it
+        # does not select, see specialize_pe_template
+        self.specialize_pes = True
+        self.pe_specializations = {}
         self.file_info = {}
+        # TileMetadataCache of the interconnect, see get_tile_metadata
+        self.tile_metadata = None
+        # Contract pass-through pnr route chains before building the SMT,
+        # see collapse_route_chains
+        self.collapse_routes = True
         self.app_dir = ""
+        self.cache_dir = default_cache_dir()
+        # Write intermediate BTOR2 and netlists to app_dir for debugging
+        self.keep_artifacts = False
+        self.jobs = os.cpu_count() or 1
+        self.tile_artifacts = {}
+        self.counter_traces = {}
+        # "iverilog" simulates the tiles. "verilator" is experimental: it is
+        # 2-state, so x/z counter samples read as 0 instead of matching
+        # iverilog. "model" runs the lake counter models, which are not yet
+        # checked against the simulation
+        self.counter_backend = "iverilog"
+        self.lake_configs = {}
         self.verbose = False
         self.rsts = []
         self.clks = []
         self.flushes = []
         self.num_memtiles = 0
+        # Input, state and output vars of each tile, see add_tile_var
+        self.tile_vars = {}
+        self.promoted_inputs = set()
+        # Named terms by tile and hierarchical path, see index_named_term
+        self.named_term_index = {}
+        self.btor2_offset = 0
         self.first_valid_output = 0
         self.stencil_valid_to_port_controller = {}
         self.stencil_valid_to_schedule = {}
         self.id_to_name = {}
         self.max_cycles = 100
         self.starting_cycle = 0
+        self.lut_encoding = "periodic"
         self.cycle_count = self.fts.make_statevar(
             "cycle_count", self.solver.make_sort(ss.sortkinds.BV, 16)
         )
@@ -48,6 +93,36 @@ class Solver:
             ),
         )
 
+        # Counters that start at the given value and increment by one every
+        # frame, FrameUnroller replaces them with their value at each frame.
+        # cycle_count is added by step_cycle_count
+        self.frame_counters = {self.bmc_counter: 0}
+
+    def step_cycle_count(self, start=None):
+        """Make cycle_count start at start and increment every frame.
+
+        start defaults to starting_cycle, the first cycle of the trace LUTs
+        of the mem and pond tiles, which are indexed by cycle_count.
+        Registering it in frame_counters lets FrameUnroller fold them to a
+        constant per frame.
+        """
+        if start is None:
+            start = self.starting_cycle
+
+        sort = self.cycle_count.get_sort()
+        self.fts.constrain_init(
+            self.create_term(
+                self.ops.Equal, self.cycle_count, self.create_const(start, sort)
+            )
+        )
+        self.fts.assign_next(
+            self.cycle_count,
+            self.create_term(
+                self.ops.BVAdd, self.cycle_count, self.create_const(1, sort)
+            ),
+        )
+        self.frame_counters[self.cycle_count] = start
+
     def create_bvsort(self, width):
         return self.solver.make_sort(ss.sortkinds.BV, width)
 
@@ -75,7 +150,31 @@ class Solver:
     def assert_formula(self, formula):
         self.solver.assert_formula(formula)
 
-    def create_lut(self, name, lut_vals, idx_sort, elem_sort, min_idx, max_idx):
+    def create_lut(
+        self,
+        name,
+        lut_vals,
+        idx_sort,
+        elem_sort,
+        min_idx,
+        max_idx,
+        encoding=None,
+        first_idx=0,
+        default=None,
+    ):
+        # lut_vals[i] is the entry for index first_idx + i, indices outside of
+        # [min_idx, max_idx) return default, the value of lut_vals[0] if unset
+        if encoding is None:
+            encoding = self.lut_encoding
+        if default is None:
+            default = lut_vals[0][1]
+
+        if encoding == "tree":
+            return self.create_tree_lut(
+                lut_vals, idx_sort, min_idx, max_idx, first_idx, default
+            )
+
+        assert encoding == "chain", f"Unknown LUT encoding: {encoding}"
 
         # array = self.create_fts_state_var(
         #     name,
@@ -106,9 +205,10 @@ class Solver:
         # Compressing the LUT by removing lut entries that are the same as the index
 
         def lut_return_val(select_val):
-            ret_val = lut_vals[0][1]
+            ret_val = default
 
-            for idx, val in lut_vals[min_idx:max_idx]:
+            first = max(min_idx - first_idx, 0)
+            for idx, val in lut_vals[first : max(max_idx - first_idx, first)]:
                 ret_val = self.create_term(
                     self.ops.Ite,
                     self.create_term(self.ops.Equal, idx, select_val),
@@ -120,20 +220,242 @@ class Solver:
 
         return lut_return_val
 
+    def create_tree_lut(
+        self, lut_vals, idx_sort, min_idx, max_idx, first_idx=0, default=None
+    ):
+        # Decode the index bit by bit (MSB first) into a balanced ite tree
+        # lut_vals[i] must hold the entry for index first_idx + i, indices
+        # outside of [min_idx, max_idx) return default just like the chain
+        # encoding
+        if default is None:
+            default = lut_vals[0][1]
+        min_idx = max(min_idx, first_idx)
+        max_idx = min(max_idx, first_idx + len(lut_vals))
+        width = idx_sort.get_width()
+
+        def lut_return_val(select_val):
+            one = self.create_const(1, self.create_bvsort(1))
+            bit_set = {}
+            nodes = {}
+
+            def is_bit_set(bit):
+                if bit not in bit_set:
+                    bit_set[bit] = self.create_term(
+                        self.ops.Equal,
+                        self.create_term(ss.Op(self.ops.Extract, bit, bit), select_val),
+                        one,
+                    )
+                return bit_set[bit]
+
+            def build(lo, bit):
+                # Subtree covering indices [lo, lo + 2 ** (bit + 1))
+                hi = lo + (1 << (bit + 1))
+                if hi <= min_idx or lo >= max_idx:
+                    return default
+
+                if bit < 0:
+                    return lut_vals[lo - first_idx][1]
+
+                low = build(lo, bit - 1)
+                high = build(lo + (1 << bit), bit - 1)
+
+                # Collapse identical leaves/subtrees
+                if low == high:
+                    return low
+
+                key = (bit, high, low)
+                if key not in nodes:
+                    nodes[key] = self.create_term(
+                        self.ops.Ite, is_bit_set(bit), high, low
+                    )
+                return nodes[key]
+
+            return build(0, width - 1)
+
+        return lut_return_val
+
+    def create_affine_lut(self, vals, idx_sort, elem_sort, min_idx, max_idx):
+        # vals is a list of ints, each maximal affine run becomes
+        # base + stride * (idx - start) selected by a binary search on idx
+        segments = affine_segments(vals, min_idx, max_idx)
+        idx_width = idx_sort.get_width()
+        elem_width = elem_sort.get_width()
+        default = self.create_const(int(vals[0]), elem_sort)
+
+        def segment_val(select_val, start, base, stride):
+            base = self.create_const(base % 2**elem_width, elem_sort)
+            if stride == 0:
+                return base
+
+            offset = self.create_term(
+                self.ops.BVSub, select_val, self.create_const(start, idx_sort)
+            )
+            if elem_width < idx_width:
+                offset = self.create_term(
+                    ss.Op(self.ops.Extract, elem_width - 1, 0), offset
+                )
+            elif elem_width > idx_width:
+                offset = self.create_term(
+                    ss.Op(self.ops.Zero_Extend, elem_width - idx_width), offset
+                )
+
+            return self.create_term(
+                self.ops.BVAdd,
+                base,
+                self.create_term(
+                    self.ops.BVMul,
+                    self.create_const(stride % 2**elem_width, elem_sort),
+                    offset,
+                ),
+            )
+
+        def lut_return_val(select_val):
+            def build(lo, hi):
+                if hi - lo == 1:
+                    start, _, base, stride = segments[lo]
+                    return segment_val(select_val, start, base, stride)
+
+                mid = (lo + hi) // 2
+                return self.create_term(
+                    self.ops.Ite,
+                    self.create_term(
+                        self.ops.BVUlt,
+                        select_val,
+                        self.create_const(segments[mid][0], idx_sort),
+                    ),
+                    build(lo, mid),
+                    build(mid, hi),
+                )
+
+            if len(segments) == 0:
+                return default
+
+            ret_val = build(0, len(segments))
+
+            # Outside of [min_idx, max_idx) return the first entry
+            last = segments[-1][1]
+            if last < 2**idx_width:
+                ret_val = self.create_term(
+                    self.ops.Ite,
+                    self.create_term(
+                        self.ops.BVUlt, select_val, self.create_const(last, idx_sort)
+                    ),
+                    ret_val,
+                    default,
+                )
+            if min_idx > 0:
+                ret_val = self.create_term(
+                    self.ops.Ite,
+                    self.create_term(
+                        self.ops.BVUlt,
+                        select_val,
+                        self.create_const(min_idx, idx_sort),
+                    ),
+                    default,
+                    ret_val,
+                )
+
+            return ret_val
+
+        return lut_return_val
+
+    def create_periodic_lut(
+        self, vals, idx_sort, elem_sort, min_idx, max_idx, prefix_end, period
+    ):
+        # Entries from prefix_end on repeat every period cycles, so they are
+        # looked up with (idx - prefix_end) % period in a table of one period
+        idx_width = idx_sort.get_width()
+        max_idx = min(max_idx, len(vals))
+        default = self.create_const(int(vals[0]), elem_sort)
+
+        prefix_lut = self.create_affine_lut(
+            vals, idx_sort, elem_sort, min_idx, prefix_end
+        )
+        period_lut = self.create_affine_lut(
+            vals[prefix_end : prefix_end + period], idx_sort, elem_sort, 0, period
+        )
+
+        def lut_return_val(select_val):
+            period_idx = self.create_term(
+                self.ops.BVUrem,
+                self.create_term(
+                    self.ops.BVSub,
+                    select_val,
+                    self.create_const(prefix_end, idx_sort),
+                ),
+                self.create_const(period, idx_sort),
+            )
+
+            ret_val = self.create_term(
+                self.ops.Ite,
+                self.create_term(
+                    self.ops.BVUlt, select_val, self.create_const(prefix_end, idx_sort)
+                ),
+                prefix_lut(select_val),
+                period_lut(period_idx),
+            )
+
+            # The trace is only known up to max_idx
+            if max_idx < 2**idx_width:
+                ret_val = self.create_term(
+                    self.ops.Ite,
+                    self.create_term(
+                        self.ops.BVUlt, select_val, self.create_const(max_idx, idx_sort)
+                    ),
+                    ret_val,
+                    default,
+                )
+
+            return ret_val
+
+        return lut_return_val
+
     def fts_assert_at_times(self, var, val_at_times, val_at_other_times, times):
         assert len(times) > 0, "Must have at least one time"
 
         bvsort16 = self.solver.make_sort(ss.sortkinds.BV, 16)
-        times = [self.solver.make_term(t, bvsort16) for t in times]
+
+        def bv16(t):
+            return self.solver.make_term(t, bvsort16)
+
         # times is list of times that val_at_times should be true
         # construct ite that is true at times and false at other times
-        eq = self.fts.make_term(self.ops.Equal, self.bmc_counter, times[0])
-        for time in times[1:]:
-            eq = self.fts.make_term(
-                self.ops.Or,
-                eq,
-                self.fts.make_term(self.ops.Equal, self.bmc_counter, time),
-            )
+        # times are merged into strided intervals so the condition grows with
+        # the number of bursts instead of the number of cycles
+        eq = None
+        for first, last, stride in times_to_intervals(times):
+            if first == last:
+                in_interval = self.fts.make_term(
+                    self.ops.Equal, self.bmc_counter, bv16(first)
+                )
+            else:
+                in_interval = self.fts.make_term(
+                    self.ops.And,
+                    self.fts.make_term(self.ops.BVUge, self.bmc_counter, bv16(first)),
+                    self.fts.make_term(self.ops.BVUle, self.bmc_counter, bv16(last)),
+                )
+
+            if stride > 1:
+                in_interval = self.fts.make_term(
+                    self.ops.And,
+                    in_interval,
+                    self.fts.make_term(
+                        self.ops.Equal,
+                        self.fts.make_term(
+                            self.ops.BVUrem,
+                            self.fts.make_term(
+                                self.ops.BVSub, self.bmc_counter, bv16(first)
+                            ),
+                            bv16(stride),
+                        ),
+                        bv16(0),
+                    ),
+                )
+
+            if eq is None:
+                eq = in_interval
+            else:
+                eq = self.fts.make_term(self.ops.Or, eq, in_interval)
 
         self.fts.add_invar(
             self.fts.make_term(
@@ -143,11 +465,69 @@ class Solver:
             )
         )
 
-    def read_btor2(self, filename):
+    def read_btor2(
+        self, filename, tile_name=None, symbols=(), state_names=(), output_names=()
+    ):
+        """Encode a BTOR2 file into the transition system.
+
+        With tile_name, the new inputs and the given states and outputs are
+        added to the variable index of that tile, and all given names to its
+        named term index. Without it, new hierarchical names are indexed under
+        their first component.
+        """
         if not os.path.isfile(filename):
             raise FileNotFoundError("File does not exist: {}".format(filename))
+
+        # Inputs are promoted as tiles are loaded, so only few are pending
+        inputs = set(self.fts.inputvars)
+        if tile_name is None:
+            names = set(self.fts.named_terms)
         pono.BTOR2Encoder(filename, self.fts)
 
+        if tile_name is None:
+            for name, term in self.fts.named_terms.items():
+                if name not in names and "." in name:
+                    self.index_named_term(name.split(".", 1)[0], name, term)
+            return
+
+        for var in self.fts.inputvars:
+            if var not in inputs:
+                self.add_tile_var(tile_name, "inputs", var)
+        for name in state_names:
+            self.add_tile_var(tile_name, "states", self.fts.lookup(name))
+        for name in output_names:
+            self.add_tile_var(tile_name, "outputs", self.fts.lookup(name), name)
+
+        for group in (symbols, state_names, output_names):
+            for name in group:
+                self.index_named_term(tile_name, name, self.fts.lookup(name))
+
+    def add_tile_var(self, tile_name, kind, var, name=None):
+        """Index var as one of the "inputs", "states" or "outputs" of a tile."""
+        if tile_name not in self.tile_vars:
+            self.tile_vars[tile_name] = {"inputs": {}, "states": {}, "outputs": {}}
+        self.tile_vars[tile_name][kind][str(var) if name is None else name] = var
+
+    def get_tile_vars(self, tile_name, kind):
+        """Vars of a tile by name, sorted by name."""
+        tile_vars = self.tile_vars.get(tile_name, {}).get(kind, {})
+        return dict(sorted(tile_vars.items()))
+
+    def index_named_term(self, tile_name, name, term):
+        # Hierarchical names are indexed by their path below the tile
+        path = name.split(".", 1)[1] if "." in name else name
+        self.named_term_index.setdefault(tile_name, {}).setdefault(path, [])
+        self.named_term_index[tile_name][path].append(term)
+
+    def lookup_named_terms(self, tile_name, path):
+        """Named terms of a tile whose name ends in the given path."""
+        return self.named_term_index.get(tile_name, {}).get(path, [])
+
+    def promote_inputvar(self, var):
+        if var not in self.promoted_inputs:
+            self.fts.promote_inputvar(var)
+            self.promoted_inputs.add(var)
+
     def check_sat(self):
         return self.solver.check_sat()
 
@@ -209,3 +589,190 @@ class Rewriter(ss.TermDagVisitor):
 
         self.rewritten_terms[term] = new_term
         return new_term
+
+
+def term_value(term):
+    # Python value of a smt-switch value term
+    value = str(term)
+    if value == "true":
+        return True
+    if value == "false":
+        return False
+    if value.startswith("#b"):
+        return int(value[2:], 2)
+    if value.startswith("#x"):
+        return int(value[2:], 16)
+    if value.startswith("(_ bv"):
+        return int(value[5:].split()[0])
+    raise ValueError(f"Cannot read value of term: {value}")
+
+
+def to_signed(value, width):
+    return value - 2**width if value >> (width - 1) else value
+
+
+class ConstantFolder(ss.TermDagVisitor):
+    bv_ops = {
+        ss.primops.BVAdd: lambda a, b: a + b,
+        ss.primops.BVSub: lambda a, b: a - b,
+        ss.primops.BVMul: lambda a, b: a * b,
+        ss.primops.BVUdiv: lambda a, b: a // b if b else -1,
+        ss.primops.BVUrem: lambda a, b: a % b if b else a,
+        ss.primops.BVAnd: lambda a, b: a & b,
+        ss.primops.BVOr: lambda a, b: a | b,
+        ss.primops.BVXor: lambda a, b: a ^ b,
+        ss.primops.BVNot: lambda a: ~a,
+        ss.primops.BVNeg: lambda a: -a,
+        ss.primops.BVShl: lambda a, b: a << b,
+        ss.primops.BVLshr: lambda a, b: a >> b,
+    }
+
+    cmp_ops = {
+        ss.primops.Equal: lambda a, b: a == b,
+        ss.primops.Distinct: lambda a, b: a != b,
+        ss.primops.BVUlt: lambda a, b: a < b,
+        ss.primops.BVUle: lambda a, b: a <= b,
+        ss.primops.BVUgt: lambda a, b: a > b,
+        ss.primops.BVUge: lambda a, b: a >= b,
+        ss.primops.Xor: lambda a, b: a != b,
+        ss.primops.Implies: lambda a, b: not a or b,
+    }
+
+    signed_cmp_ops = {
+        ss.primops.BVSlt: lambda a, b: a < b,
+        ss.primops.BVSle: lambda a, b: a <= b,
+        ss.primops.BVSgt: lambda a, b: a > b,
+        ss.primops.BVSge: lambda a, b: a >= b,
+    }
+
+    def __init__(self, solver, substitutions=None):
+        self._solver = solver
+        self.folded_terms = dict(substitutions or {})
+
+    def fold(self, term):
+        if term not in self.folded_terms:
+            self.walk_dag(term)
+        return self.folded_terms[term]
+
+    def visit_term(self, term, new_children):
+        try:
+            return self.folded_terms[term]
+        except KeyError:
+            pass
+
+        op = term.get_op()
+
+        if op:
+            new_term = self.fold_op(op, term.get_sort(), new_children)
+        else:
+            new_term = term
+
+        self.folded_terms[term] = new_term
+        return new_term
+
+    def fold_op(self, op, sort, children):
+        prim_op = op.prim_op
+        values = [term_value(c) if c.is_value() else None for c in children]
+        all_values = all(v is not None for v in values)
+
+        if prim_op == ss.primops.Ite:
+            if values[0] is not None:
+                return children[1] if values[0] else children[2]
+            if children[1] == children[2]:
+                return children[1]
+
+        elif prim_op == ss.primops.Not:
+            if all_values:
+                return self._solver.solver.make_term(not values[0])
+
+        elif prim_op == ss.primops.And or prim_op == ss.primops.Or:
+            absorbing = prim_op == ss.primops.Or
+            if absorbing in values:
+                return self._solver.solver.make_term(absorbing)
+            children = [c for c, v in zip(children, values) if v is None]
+            if len(children) == 0:
+                return self._solver.solver.make_term(not absorbing)
+            if len(children) == 1:
+                return children[0]
+
+        elif prim_op in self.cmp_ops:
+            if all_values:
+                return self._solver.solver.make_term(self.cmp_ops[prim_op](*values))
+            if prim_op == ss.primops.Equal and children[0] == children[1]:
+                return self._solver.solver.make_term(True)
+
+        elif all_values and prim_op in self.signed_cmp_ops:
+            width = children[0].get_sort().get_width()
+            values = [to_signed(v, width) for v in values]
+            return self._solver.solver.make_term(self.signed_cmp_ops[prim_op](*values))
+
+        elif all_values and prim_op == ss.primops.BVComp:
+            return self._solver.create_const(int(values[0] == values[1]), sort)
+
+        elif all_values and prim_op == ss.primops.BVAshr:
+            width = sort.get_width()
+            value = to_signed(values[0], width) >> min(values[1], width)
+            return self._solver.create_const(value % 2**width, sort)
+
+        elif all_values and prim_op in self.bv_ops:
+            width = sort.get_width()
+            value = self.bv_ops[prim_op](*values) % 2**width
+            return self._solver.create_const(value, sort)
+
+        elif all_values and prim_op == ss.primops.Extract:
+            value = (values[0] >> op.idx1) % 2 ** (op.idx0 - op.idx1 + 1)
+            return self._solver.create_const(value, sort)
+
+        elif all_values and prim_op == ss.primops.Zero_Extend:
+            return self._solver.create_const(values[0], sort)
+
+        elif all_values and prim_op == ss.primops.Sign_Extend:
+            width = children[0].get_sort().get_width()
+            value = to_signed(values[0], width) % 2 ** sort.get_width()
+            return self._solver.create_const(value, sort)
+
+        elif all_values and prim_op == ss.primops.Concat:
+            width = children[1].get_sort().get_width()
+            return self._solver.create_const(values[0] << width | values[1], sort)
+
+        return self._solver.solver.make_term(op, children)
+
+
+class FrameUnroller:
+    """
+    Wraps pono.Unroller and specializes unrolled terms to their frame.
+
+    Every counter in solver.frame_counters is replaced by its value at the
+    frame and the result is constant folded, so cycle indexed LUTs and
+    fts_assert_at_times invariants collapse to a single constant per frame.
+    Each frame keeps its ConstantFolder, so subterms shared by several
+    at_time calls are only folded once.
+    """
+
+    def __init__(self, solver):
+        self._solver = solver
+        self.ur = pono.Unroller(solver.fts)
+        self.folders = {}
+        self.frame_counters = {}
+
+    def folder(self, k):
+        # Folded terms depend on the registered counters
+        if self.frame_counters != self._solver.frame_counters:
+            self.frame_counters = dict(self._solver.frame_counters)
+            self.folders = {}
+
+        if k not in self.folders:
+            substitutions = {}
+            for counter, start in self.frame_counters.items():
+                sort = counter.get_sort()
+                substitutions[self.ur.at_time(counter, k)] = self._solver.create_const(
+                    (start + k) % 2 ** sort.get_width(), sort
+                )
+            self.folders[k] = ConstantFolder(self._solver, substitutions)
+        return self.folders[k]
+
+    def at_time(self, term, k):
+        return self.folder(k).fold(self.ur.at_time(term, k))
+
+    def __getattr__(self, name):
+        return getattr(self.ur, name)
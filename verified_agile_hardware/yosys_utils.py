@@ -2,9 +2,38 @@ import subprocess
 import os
 from gemstone.common.configurable import ConfigRegister
 
+MEM_TILE_YOSYS_SCRIPT = """
+read -formal {memtile_filename} {garnet_filename} 
 
-def run_yosys_script(script, yosys_path="yosys"):
-    """Run a Yosys script and return the output."""
+prep -top {mem_tile_module};
+
+hierarchy -check;
+
+chformal -assume -early;
+
+memory -nomap; 
+#opt -full;
+clean -purge;
+
+flatten; 
+#opt -full;
+clean -purge;
+
+clk2fflogic;
+opt -full;
+
+clean -purge;
+
+setundef -undriven -expose; 
+opt -full;
+"""
+
+
+def run_yosys_script(script, yosys_path="yosys", pass_fds=()):
+    """Run a Yosys script and return the output.
+
+    pass_fds are inherited by yosys so the script can write to /dev/fd/N.
+    """
     # Check if yosys is installed
     try:
         subprocess.run(
@@ -19,7 +48,11 @@ def run_yosys_script(script, yosys_path="yosys"):
 
     # print("Running Yosys script...")
     p = subprocess.Popen(
-        cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        cmd,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        pass_fds=pass_fds,
     )
     stdout, stderr = p.communicate(script.encode("utf-8"))
 
@@ -65,8 +98,14 @@ def mem_tile_to_btor(
     memtile_filename="/aha/garnet/garnet.v",
     mem_tile_module="strg_ub_vec_flat",
     btor_filename="mem_core.btor2",
+    write_verilog=True,
+    pass_fds=(),
 ):
-    """Convert a memory tile to a BTOR2 file."""
+    """Convert a memory tile to a BTOR2 file.
+
+    btor_filename may be /dev/fd/N of a descriptor listed in pass_fds,
+    write_verilog also dumps the synthesized netlist to {btor_filename}.v.
+    """
     # Check if garnet_filename exists
     try:
         with open(garnet_filename, "r") as f:
@@ -97,35 +136,15 @@ def mem_tile_to_btor(
     # except FileNotFoundError:
     sv2v(memtile_filename, sv2v_memtile_filename)
 
-    script = f"""
-read -formal {sv2v_memtile_filename} {sv2v_garnet_filename} 
-
-prep -top {mem_tile_module};
-
-hierarchy -check;
-
-chformal -assume -early;
-
-memory -nomap; 
-#opt -full;
-clean -purge;
-
-flatten; 
-#opt -full;
-clean -purge;
-
-clk2fflogic;
-opt -full;
-
-clean -purge;
-
-setundef -undriven -expose; 
-opt -full;
-
-write_verilog {btor_filename}.v
-write_btor {btor_filename}            
-    """
-    run_yosys_script(script)
+    script = MEM_TILE_YOSYS_SCRIPT.format(
+        memtile_filename=sv2v_memtile_filename,
+        garnet_filename=sv2v_garnet_filename,
+        mem_tile_module=mem_tile_module,
+    )
+    if write_verilog:
+        script += f"write_verilog {btor_filename}.v\n"
+    script += f"write_btor {btor_filename}\n"
+    run_yosys_script(script, pass_fds=pass_fds)
     # print(f"Finished writing BTOR2 file to {btor_filename}")
 
 